@@ -5,6 +5,17 @@ import os
 
 import log
 
+from ssh import Archive
+
+# Hash of the tool last shipped to remote, stored next to it
+ARCHIVE_STAMP_FILENAME = '.archive_sha256'
+
+# Report written by the remote --get-versions, relative to the remote home folder
+REMOTE_VERSIONS_REPORT = 'gerrit_backup_tool/versions_report.json'
+
+EXCLUDE_FILES = ['*.pyc', '.DS_Store']
+EXCLUDE_FOLDERS = ['.cache', '__pycahce__']
+
 
 class GerritRemote(object):
     """Gerrit SSH."""
@@ -20,6 +31,12 @@ class GerritRemote(object):
 
         self.file_copied_to_remote = False
 
+        # Ship the tool as one archive, only when it has changed
+        self.use_archive = False
+
+        # RemoteEnv to run the tool in, instead of pip installing the requirements on every command
+        self.remote_env = None
+
         self.verbose = False
         self.dry_run = False
 
@@ -28,6 +45,10 @@ class GerritRemote(object):
         if self.file_copied_to_remote:
             return
 
+        if self.use_archive:
+            self._copy_archive_to_remote()
+            return
+
         remote_path = '~/gerrit_backup_tool/'
 
         self.ssh.run_command("rm -rf %s" % remote_path)
@@ -35,14 +56,52 @@ class GerritRemote(object):
         script_path = os.path.dirname(os.path.realpath(__file__))
         self.ssh.copy_to_remote(script_path,
                                 remote_path,
-                                ['*.pyc', '.DS_Store'],
-                                ['.cache', '__pycahce__'])
+                                EXCLUDE_FILES,
+                                EXCLUDE_FOLDERS)
 
         requirements_remotes = os.path.join(script_path, 'requirements_remote.txt')
         gerrit_backup_repo = os.path.join(script_path, self.repo_list_filename)
 
-        self.ssh.copy_files_to_remote(
-            [self.config_filename, requirements_remotes, gerrit_backup_repo], remote_path)
+        files = [self.config_filename, requirements_remotes]
+        if os.path.exists(gerrit_backup_repo):
+            files.append(gerrit_backup_repo)
+
+        self.ssh.copy_files_to_remote(files, remote_path)
+
+        self.file_copied_to_remote = True
+
+    def _copy_archive_to_remote(self):
+        """Copy Script Files to Remote, as one archive.
+
+        The tool is only shipped when its hash differs from the stamp file on remote, the config
+        and repo list files are shipped every time.
+        """
+        remote_path = '~/gerrit_backup_tool'
+        stamp_file = "%s/%s" % (remote_path, ARCHIVE_STAMP_FILENAME)
+
+        script_path = os.path.dirname(os.path.realpath(__file__))
+        tool_files = Archive.list_files(script_path, EXCLUDE_FILES, EXCLUDE_FOLDERS)
+        tool_hash = Archive.files_hash(tool_files)
+
+        files = [(self.config_filename, os.path.basename(self.config_filename))]
+        gerrit_backup_repo = os.path.join(script_path, self.repo_list_filename)
+        if os.path.exists(gerrit_backup_repo):
+            files.append((gerrit_backup_repo, os.path.basename(gerrit_backup_repo)))
+
+        remote_hash, _ = self.ssh.run_command("cat %s 2>/dev/null" % stamp_file, False)
+
+        cmd = "mkdir -p %s && tar -xzf - -C %s" % (remote_path, remote_path)
+        if remote_hash.strip() == tool_hash:
+            log.print_log("Tool unchanged on remote: %s (%s)" % (self.ssh.hostname, tool_hash[:12]))
+        else:
+            log.print_log("Shipping tool to remote: %s (%s)" % (self.ssh.hostname, tool_hash[:12]))
+
+            # NOTE: The stamp is only written once the tool is extracted
+            files = tool_files + files
+            cmd = "rm -rf %s && %s && echo %s > %s" % (remote_path, cmd, tool_hash, stamp_file)
+
+        data = Archive.build_archive(files)
+        self.ssh.stream_to_remote(data, cmd)
 
         self.file_copied_to_remote = True
 
@@ -61,12 +120,31 @@ class GerritRemote(object):
         elif self.repo_list_filename:
             options += " --repo-list %s" % self.repo_list_filename
 
-        self.ssh.run_command("sudo pip install -r ./gerrit_backup_tool/requirements_remote.txt")
+        if self.config.has_option('cmd_arguments', 'jobs'):
+            options += " --jobs %s" % self.config.get('cmd_arguments', 'jobs')
 
-        cmd = "sudo python ./gerrit_backup_tool/%s %s %s%s" % (self.config.get('script', 'script_python_filename'),
-                                                               os.path.basename(
-                                                                   self.config_filename),
-                                                               command, options)
+        if self.config.has_option('cmd_arguments', 'discover_repos'):
+            options += " --discover-repos %s" % self.config.get('cmd_arguments', 'discover_repos')
+
+        if self.config.has_option('cmd_arguments', 'diff_repos') and \
+           self.config.getboolean('cmd_arguments', 'diff_repos'):
+            options += " --diff-repos"
+
+        if self.config.has_option('cmd_arguments', 'incremental') and \
+           self.config.getboolean('cmd_arguments', 'incremental'):
+            options += " --incremental"
+
+        python_path = 'python'
+        if self.remote_env is not None:
+            python_path = self.remote_env.prepare()
+        else:
+            self.ssh.run_command("sudo pip install -r ./gerrit_backup_tool/requirements_remote.txt")
+
+        cmd = "sudo %s ./gerrit_backup_tool/%s %s %s%s" % (python_path,
+                                                           self.config.get('script', 'script_python_filename'),
+                                                           os.path.basename(
+                                                               self.config_filename),
+                                                           command, options)
 
         self.ssh.run_command(cmd)
 
@@ -84,7 +162,15 @@ class GerritRemote(object):
                       self.config.get('backup', 'ssh_hostname'))
         self._copy_script_files_to_remote()
 
-        self.run_backup_cmd("--get-versions")
+        if not self.config.has_option('cmd_arguments', 'versions_report'):
+            self.run_backup_cmd("--get-versions")
+            return
+
+        self.run_backup_cmd("--get-versions --versions-report %s" % REMOTE_VERSIONS_REPORT)
+
+        versions_report = self.config.get('cmd_arguments', 'versions_report')
+        log.print_log("Copying versions report from remote: %s" % versions_report)
+        self.ssh.scp_get_file(REMOTE_VERSIONS_REPORT, versions_report)
 
     def backup_data(self, repos):
         """TAR remote repos."""
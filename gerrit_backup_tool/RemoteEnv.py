@@ -0,0 +1,138 @@
+
+"""RemoteEnv Class."""
+
+import hashlib
+import os
+import time
+
+import log
+
+from ssh import Archive
+
+ENVS_PATH = '~/.gerrit_backup_envs'
+
+# Marks a virtualenv / wheelhouse as complete, a failed build is rebuilt on the next run
+READY_FILENAME = '.ready'
+
+
+class RemoteEnv(object):
+    """Python virtualenv on remote, keyed by a hash of the requirements, reused across runs."""
+
+    def __init__(self, ssh, requirements_file, optional_requirements_file=None):
+        """Init."""
+        super(RemoteEnv, self).__init__()
+        self.ssh = ssh
+        self.requirements_file = requirements_file
+
+        # Installed one by one, a package that fails to install is logged, the tool runs without it
+        self.optional_requirements_file = optional_requirements_file
+
+        # Local folder of wheels, uploaded once, so the virtualenv is built without network on remote
+        self.wheelhouse = None
+        self.python = 'python2.7'
+
+        self.verbose = False
+
+        self._python_path = None
+
+    def get_key(self):
+        """Get key of the virtualenv: hash of the interpreter, requirements and optional requirements."""
+        sha = hashlib.sha256(self.python + '\0')
+        with open(self.requirements_file, 'rb') as input_file:
+            sha.update(input_file.read())
+
+        if self.optional_requirements_file:
+            sha.update('\0')
+            with open(self.optional_requirements_file, 'rb') as input_file:
+                sha.update(input_file.read())
+
+        return sha.hexdigest()[:16]
+
+    def get_optional_requirements(self):
+        """Get optional requirements, one per line, without comments."""
+        if not self.optional_requirements_file:
+            return []
+
+        with open(self.optional_requirements_file, 'r') as input_file:
+            lines = [line.split('#', 1)[0].strip() for line in input_file]
+
+        return [line for line in lines if line]
+
+    def _install_optional(self, env_path, pip_options):
+        """Install optional requirements into the virtualenv, one by one."""
+        for requirement in self.get_optional_requirements():
+            stdout, _ = self.ssh.run_command("%s/bin/pip install --quiet%s '%s' > /dev/null 2>&1 || echo failed" %
+                                             (env_path, pip_options, requirement), False)
+
+            if 'failed' in stdout:
+                log.warn("Optional requirement not installed on remote: %s" % requirement)
+            elif self.verbose:
+                log.verbose("Optional requirement installed on remote: %s" % requirement)
+
+    def _get_wheelhouse_files(self):
+        """Get wheelhouse files and their hash."""
+        if not os.path.isdir(self.wheelhouse):
+            raise RuntimeError("ERROR: Folder not found: %s" % self.wheelhouse)
+
+        files = Archive.list_files(self.wheelhouse)
+        return files, Archive.files_hash(files)[:16]
+
+    def _upload_wheelhouse(self, files, remote_path):
+        """Upload wheelhouse, as one archive."""
+        log.print_log("Uploading wheelhouse to remote: %s (%d files)" % (self.ssh.hostname, len(files)))
+
+        self.ssh.stream_to_remote(Archive.build_archive(files),
+                                  "rm -rf %s && mkdir -p %s && tar -xzf - -C %s && touch %s/%s" %
+                                  (remote_path, remote_path, remote_path, remote_path, READY_FILENAME))
+
+    def prepare(self):
+        """Prepare virtualenv on remote, if not already built. Returns its python path."""
+        if self._python_path is not None:
+            return self._python_path
+
+        started = time.time()
+
+        env_path = "%s/env-%s" % (ENVS_PATH, self.get_key())
+        remote_requirements = "%s/requirements.txt" % env_path
+
+        wheelhouse_path = None
+        if self.wheelhouse:
+            wheelhouse_files, wheelhouse_hash = self._get_wheelhouse_files()
+            wheelhouse_path = "%s/wheelhouse-%s" % (ENVS_PATH, wheelhouse_hash)
+
+        stdout, _ = self.ssh.run_command("test -f %s/%s && echo env; test -f %s/%s && echo wheelhouse" %
+                                         (env_path, READY_FILENAME, wheelhouse_path or env_path, READY_FILENAME),
+                                         False)
+        status = stdout.split()
+
+        if 'env' in status:
+            log.print_log("Remote environment cached: %s, in %.1fs" % (env_path, time.time() - started))
+        else:
+            log.print_log("Building remote environment: %s" % env_path)
+
+            pip_options = ''
+            if wheelhouse_path:
+                if 'wheelhouse' not in status:
+                    self._upload_wheelhouse(wheelhouse_files, wheelhouse_path)
+
+                pip_options = " --no-index --find-links %s" % wheelhouse_path
+
+            # NOTE: The requirements are piped in, so the virtualenv does not depend on the tool being copied
+            with open(self.requirements_file, 'rb') as input_file:
+                requirements = input_file.read()
+
+            self.ssh.stream_to_remote(
+                requirements,
+                "rm -rf %s && %s -m virtualenv --quiet %s && cat > %s && "
+                "%s/bin/pip install --quiet%s -r %s" %
+                (env_path, self.python, env_path, remote_requirements,
+                 env_path, pip_options, remote_requirements))
+
+            self._install_optional(env_path, pip_options)
+            self.ssh.run_command("touch %s/%s" % (env_path, READY_FILENAME), False)
+
+            log.print_log("Remote environment built: %s, in %.1fs" % (env_path, time.time() - started))
+
+        self._python_path = "%s/bin/python" % env_path
+
+        return self._python_path
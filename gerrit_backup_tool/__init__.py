@@ -1,4 +1,4 @@
 # flake8: noqa
 __author__ = 'John Paul Newman'
 
-__all__ = ['aws', 'gerrit', 'jenkins', 'mysql', 'ssh', 'tar']
+__all__ = ['aws', 'bundle', 'dedup', 'gerrit', 'jenkins', 'mysql', 'ssh', 'tar']
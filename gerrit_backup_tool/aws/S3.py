@@ -1,18 +1,365 @@
 
 """S3 Class."""
 
+import base64
+import hashlib
+import httplib
 import socket
 import os
+import threading
+import Queue
+
+from contextlib import contextmanager
+from cStringIO import StringIO
 
 try:
     import boto
+    import boto.s3.connection
+    import boto.s3.deletemarker
+    import boto.s3.multipart
 except ImportError:
     raise ImportError("Python module 'boto' needs to be installed on target box: %s" %
                       socket.getfqdn())
 
 import utils
+import workers
 import log
 
+MB = 1024 * 1024
+
+# Smallest part of a S3 multipart upload, but the last
+MIN_PART_SIZE = 5 * MB
+
+# Errors after which a pooled connection is closed and not reused
+CONNECTION_ERRORS = (socket.error, httplib.HTTPException)
+
+
+class S3CountingConnection(boto.s3.connection.S3Connection):
+    """S3 Connection, counting HTTP requests."""
+
+    def __init__(self, *args, **kwargs):
+        """Init."""
+        super(S3CountingConnection, self).__init__(*args, **kwargs)
+        self.on_request = None
+
+    def make_request(self, *args, **kwargs):
+        """Make request."""
+        if self.on_request:
+            self.on_request()
+
+        return super(S3CountingConnection, self).make_request(*args, **kwargs)
+
+
+class S3KeyReader(object):
+    """Readable stream of an S3 key, holding its pooled connection until closed."""
+
+    def __init__(self, key, release):
+        """Init."""
+        super(S3KeyReader, self).__init__()
+        self.key = key
+        self.release = release
+
+        self.key.open_read()
+
+    def read(self, size=-1):
+        """Read up to size bytes."""
+        if size < 0:
+            size = 0
+
+        return self.key.read(size)
+
+    def close(self):
+        """Close, and release connection."""
+        if self.release is not None:
+            self.key.close()
+            self.release()
+            self.release = None
+
+
+class S3UploadStream(object):
+    """S3 Multipart Upload Stream."""
+
+    def __init__(self, s3_bucket, s3_key, chunk_size, headers=None, metadata=None, release=None):
+        """Init."""
+        super(S3UploadStream, self).__init__()
+        self.s3_bucket = s3_bucket
+        self.release = release
+        self.version_id = None
+        self.s3_key = s3_key
+        self.chunk_size = max(chunk_size, MIN_PART_SIZE)
+        self.headers = headers or {}
+        self.metadata = metadata or {}
+
+        self.bytes_written = 0
+
+        self._buffer = StringIO()
+        self._multipart = None
+        self._part_num = 0
+
+    def _upload_part(self):
+        """Upload up to chunk_size of buffered data as the next part, keeping the rest buffered."""
+        if self._multipart is None:
+            self._multipart = self.s3_bucket.initiate_multipart_upload(self.s3_key,
+                                                                       headers=self.headers,
+                                                                       metadata=self.metadata,
+                                                                       encrypt_key=True)
+
+        data = self._buffer.getvalue()
+
+        # NOTE: Parts are exactly chunk_size, so the ETag can be checked with the same part size
+        part = StringIO()
+        part.write(data[:self.chunk_size])
+        part.seek(0)
+
+        self._part_num += 1
+        self._multipart.upload_part_from_file(part, self._part_num)
+
+        self._buffer = StringIO()
+        self._buffer.write(data[self.chunk_size:])
+
+    def write(self, data):
+        """Write data, uploading a part each time chunk_size is buffered."""
+        self._buffer.write(data)
+        self.bytes_written += len(data)
+
+        while self._buffer.tell() >= self.chunk_size:
+            self._upload_part()
+
+    def flush(self):
+        """Flush."""
+        pass
+
+    def _release(self):
+        """Release connection."""
+        if self.release is not None:
+            self.release()
+            self.release = None
+
+    def close(self):
+        """Upload remaining data and complete upload."""
+        try:
+            self._close()
+        finally:
+            self._release()
+
+    def _close(self):
+        """Upload remaining data and complete upload."""
+        if self._multipart is None:
+            key = self.s3_bucket.new_key(self.s3_key)
+            for name, value in self.metadata.items():
+                key.set_metadata(name, value)
+
+            key.set_contents_from_string(self._buffer.getvalue(),
+                                         headers=self.headers,
+                                         encrypt_key=True)
+        else:
+            if self._buffer.tell() > 0:
+                self._upload_part()
+
+            self._multipart.complete_upload()
+            self._multipart = None
+
+        self._buffer = StringIO()
+
+        key = self.s3_bucket.get_key(self.s3_key)
+        if key is None or key.size != self.bytes_written:
+            msg = "ERROR: Mismatch in bytes streamed to S3 bucket: " \
+                  "{0} != {1}".format(key.size if key else 0, self.bytes_written)
+            raise RuntimeError(msg)
+
+        self.version_id = key.version_id
+
+    def abort(self):
+        """Abort upload."""
+        self._buffer = StringIO()
+
+        try:
+            if self._multipart is not None:
+                self._multipart.cancel_upload()
+                self._multipart = None
+        finally:
+            self._release()
+
+
+class S3ETagHasher(object):
+    """Check data against an S3 ETag, for single and multipart uploads."""
+
+    def __init__(self, etag, part_size):
+        """Init."""
+        super(S3ETagHasher, self).__init__()
+        self.etag = (etag or '').strip('"')
+        self.part_size = part_size
+
+        self.parts = 0
+        if '-' in self.etag:
+            self.parts = int(self.etag.split('-', 1)[1])
+
+        self._md5 = hashlib.md5()
+        self._part_md5s = []
+        self._part_bytes = 0
+
+    def update(self, data):
+        """Update with next data."""
+        if self.parts == 0:
+            self._md5.update(data)
+            return
+
+        while data:
+            size = min(len(data), self.part_size - self._part_bytes)
+            self._md5.update(data[:size])
+            self._part_bytes += size
+            data = data[size:]
+
+            if self._part_bytes == self.part_size:
+                self._next_part()
+
+    def _next_part(self):
+        """Start next multipart part."""
+        self._part_md5s.append(self._md5.digest())
+        self._md5 = hashlib.md5()
+        self._part_bytes = 0
+
+    def check(self, name):
+        """Check ETag. Returns False if it can not be checked."""
+        if self.parts == 0:
+            digest = self._md5.hexdigest()
+        else:
+            if self._part_bytes > 0:
+                self._next_part()
+
+            if len(self._part_md5s) != self.parts:
+                # NOTE: Uploaded with a different part size
+                return False
+
+            digest = "%s-%d" % (hashlib.md5(''.join(self._part_md5s)).hexdigest(), self.parts)
+
+        if digest != self.etag:
+            msg = "ERROR: Mismatch in checksum of S3 key {0}: " \
+                  "{1} != {2}".format(name, digest, self.etag)
+            raise RuntimeError(msg)
+
+        return True
+
+
+class S3PartFetch(threading.Thread):
+    """Fetch a byte range of an S3 key."""
+
+    def __init__(self, s3, s3_key, offset, size, version_id=None):
+        """Init."""
+        super(S3PartFetch, self).__init__()
+        self.daemon = True
+
+        self.s3 = s3
+        self.s3_key = s3_key
+        self.offset = offset
+        self.size = size
+        self.version_id = version_id
+
+        self.data = None
+        self.error = None
+
+    def run(self):
+        """Run."""
+        try:
+            buffer = StringIO()
+            self.s3.download_range(self.s3_key, buffer, self.offset, self.size, self.version_id)
+            self.data = buffer.getvalue()
+        except Exception as err:
+            self.error = err
+
+    def result(self):
+        """Wait for and return data."""
+        self.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.data
+
+
+class S3RangeReader(object):
+    """Readable stream of an S3 key, prefetching byte ranges in parallel, in order."""
+
+    def __init__(self, s3, key, part_size, concurrency):
+        """Init."""
+        super(S3RangeReader, self).__init__()
+        self.s3 = s3
+        self.key = key
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+
+        self._next_offset = 0
+        self._fetches = []
+        self._buffer = ''
+        self._buffer_offset = 0
+        self._hasher = S3ETagHasher(key.etag, s3.get_part_size())
+
+        for _ in range(self.concurrency):
+            self._start_fetch()
+
+    def _start_fetch(self):
+        """Start fetch of next part."""
+        if self._next_offset >= self.key.size:
+            return
+
+        size = min(self.part_size, self.key.size - self._next_offset)
+        fetch = S3PartFetch(self.s3, self.key.name, self._next_offset, size, self.key.version_id)
+        fetch.start()
+
+        self._fetches.append(fetch)
+        self._next_offset += size
+
+    def _next_part(self):
+        """Get next part. Returns False at end of key."""
+        if len(self._fetches) == 0:
+            if not self._hasher.check(self.key.name):
+                log.error("Checksum of S3 key can not be verified, it was uploaded with a different part size: %s" %
+                          self.key.name)
+            return False
+
+        fetch = self._fetches.pop(0)
+        self._buffer = fetch.result()
+        self._buffer_offset = 0
+
+        if len(self._buffer) != fetch.size:
+            msg = "ERROR: Mismatch in bytes of S3 range at {0}: " \
+                  "{1} != {2}".format(fetch.offset, len(self._buffer), fetch.size)
+            raise RuntimeError(msg)
+
+        self._hasher.update(self._buffer)
+        self._start_fetch()
+
+        return True
+
+    def read(self, size=-1):
+        """Read up to size bytes."""
+        result = []
+        remaining = size
+
+        while remaining != 0:
+            if self._buffer_offset >= len(self._buffer):
+                if not self._next_part():
+                    break
+                continue
+
+            end = len(self._buffer)
+            if remaining > 0:
+                end = min(end, self._buffer_offset + remaining)
+
+            data = self._buffer[self._buffer_offset:end]
+            self._buffer_offset = end
+            result.append(data)
+
+            if remaining > 0:
+                remaining -= len(data)
+
+        return ''.join(result)
+
+    def close(self):
+        """Close."""
+        self._fetches = []
+        self._buffer = ''
+
 
 class S3(object):
     """S3."""
@@ -27,30 +374,126 @@ class S3(object):
         self.encrypt_files = False
         self.content_type = ''
 
+        self.multipart_threshold = 64 * MB
+        self.multipart_chunk_size = 8 * MB
+        self.max_concurrency = 4
+        self.part_retries = 3
+
+        self.download_chunk_size = 16 * MB
+        self.download_concurrency = 4
+
+        self.request_count = 0
+        self.connection_count = 0
+
+        self._lock = threading.Lock()
+        self._idle_buckets = Queue.LifoQueue()
+        self._bucket_validated = False
+
+    def get_part_size(self):
+        """Get size of multipart upload parts."""
+        return max(self.multipart_chunk_size, MIN_PART_SIZE)
+
+    def _count_request(self):
+        """Count HTTP request."""
+        with self._lock:
+            self.request_count += 1
+
     def get_connection(self):
         """Open S3 Connection."""
         # boto.set_stream_logger('boto')  # DEBUG
 
-        conn = boto.connect_s3(self.access_key,
-                               self.secret_key,
-                               is_secure=True)
+        conn = S3CountingConnection(self.access_key,
+                                    self.secret_key,
+                                    is_secure=True)
+        conn.on_request = self._count_request
+
+        with self._lock:
+            self.connection_count += 1
 
         return conn
 
+    def _acquire_bucket(self):
+        """Get an idle pooled bucket, or open a new connection."""
+        try:
+            return self._idle_buckets.get_nowait()
+        except Queue.Empty:
+            pass
+
+        conn = self.get_connection()
+
+        # NOTE: Only validate the bucket with the first connection
+        with self._lock:
+            validate = not self._bucket_validated
+
+        s3_bucket = conn.get_bucket(self.bucket, validate=validate)
+
+        with self._lock:
+            self._bucket_validated = True
+
+        return s3_bucket
+
+    def _release_bucket(self, s3_bucket, connection_error=False):
+        """Return bucket to the pool, or close its connection after an error."""
+        if connection_error:
+            log.warn("S3 connection error, reconnecting on next request")
+            s3_bucket.connection.close()
+            return
+
+        self._idle_buckets.put(s3_bucket)
+
+    @contextmanager
+    def _pooled_bucket(self):
+        """Use a pooled bucket, only used by one thread at a time."""
+        s3_bucket = self._acquire_bucket()
+        connection_error = False
+        try:
+            yield s3_bucket
+        except CONNECTION_ERRORS:
+            connection_error = True
+            raise
+        finally:
+            self._release_bucket(s3_bucket, connection_error)
+
+    def _with_bucket(self, func):
+        """Call func with a pooled bucket, retrying once on a new connection."""
+        try:
+            with self._pooled_bucket() as s3_bucket:
+                return func(s3_bucket)
+        except CONNECTION_ERRORS:
+            with self._pooled_bucket() as s3_bucket:
+                return func(s3_bucket)
+
+    def close(self):
+        """Close all pooled connections."""
+        while True:
+            try:
+                s3_bucket = self._idle_buckets.get_nowait()
+            except Queue.Empty:
+                break
+
+            s3_bucket.connection.close()
+
+    def log_stats(self):
+        """Log HTTP request stats."""
+        log.info("S3 HTTP Requests: %d, Connections: %d" % (self.request_count,
+                                                           self.connection_count))
+
     def list_bucket_keys(self):
         """List S3 buckets."""
-        conn = self.get_connection()
-        s3_bucket = conn.get_bucket(self.bucket)
+        with self._pooled_bucket() as s3_bucket:
+            log.print_log("Listing S3 Bucket Files: %s" % s3_bucket.name)
 
-        log.print_log("Listing S3 Bucket Files: %s" % s3_bucket.name)
+            for key in s3_bucket.list(delimiter="/"):
+                log.print_log(key.name)
 
-        for key in s3_bucket.list(delimiter="/"):
-            log.print_log(key.name)
+    def list_keys(self, prefix=''):
+        """List S3 key names with prefix."""
+        with self._pooled_bucket() as s3_bucket:
+            for key in s3_bucket.list(prefix=prefix):
+                yield key.name
 
-    def get_key(self, s3_key):
-        """Get S3 key."""
-        conn = self.get_connection()
-        s3_bucket = conn.get_bucket(self.bucket)
+    def _get_key(self, s3_bucket, s3_key):
+        """Get S3 key from bucket."""
         # log.print_log("Getting S3 file: %s" % (s3_key))
         key = s3_bucket.get_key(s3_key)
         if key is None:
@@ -58,11 +501,34 @@ class S3(object):
 
         return key
 
+    def get_key(self, s3_key):
+        """Get S3 key."""
+        return self._with_bucket(lambda s3_bucket: self._get_key(s3_bucket, s3_key))
+
+    def key_exists(self, s3_key):
+        """Test if S3 key exists, with one HEAD request."""
+        return self._with_bucket(lambda s3_bucket: s3_bucket.get_key(s3_key) is not None)
+
     def get_all_bucket_versions(self, prefix=''):
         """Get bucket version list."""
-        conn = self.get_connection()
-        s3_bucket = conn.get_bucket(self.bucket)
-        return s3_bucket.list_versions(prefix=prefix)
+        with self._pooled_bucket() as s3_bucket:
+            for version in s3_bucket.list_versions(prefix=prefix):
+                yield version
+
+    def get_versions_index(self, prefix=''):
+        """Get index of key name to version info, listing prefix once."""
+        index = {}
+        for version in self.get_all_bucket_versions(prefix=prefix):
+            deleted = isinstance(version, boto.s3.deletemarker.DeleteMarker)
+            index.setdefault(version.name, []).append({
+                'version_id': version.version_id,
+                'last_modified': version.last_modified,
+                'size': None if deleted else version.size,
+                'is_latest': version.is_latest,
+                'deleted': deleted
+            })
+
+        return index
 
     def get_key_versions(self, s3_key):
         """Get key version list."""
@@ -77,29 +543,139 @@ class S3(object):
         key = self.get_key(s3_key)
         return key.version_id
 
+    def _get_upload_headers(self):
+        """Get upload headers and metadata."""
+        headers = {}
+        if self.content_type:
+            headers['Content-Type'] = self.content_type
+
+        metadata = {}
+        if self.encrypt_files is True:
+            metadata['s3tools-gpgenc'] = 'gpg'  # FYI: For s3cmd
+
+        return headers, metadata
+
+    def _get_file_part_md5(self, file_path, offset, size):
+        """Get MD5 of file part, as hex and base64."""
+        md5 = hashlib.md5()
+
+        with open(file_path, 'rb') as input_file:
+            input_file.seek(offset)
+            remaining = size
+            while remaining > 0:
+                data = input_file.read(min(remaining, MB))
+                if not data:
+                    break
+                md5.update(data)
+                remaining -= len(data)
+
+        return md5.hexdigest(), base64.b64encode(md5.digest())
+
+    def _upload_file_part(self, multipart_id, s3_key, file_path, part):
+        """Upload a single file part, on a pooled connection. Retries on error."""
+        part_num, offset, size = part
+        md5 = self._get_file_part_md5(file_path, offset, size)
+
+        for attempt in range(1, self.part_retries + 1):
+            try:
+                with self._pooled_bucket() as s3_bucket:
+                    multipart = boto.s3.multipart.MultiPartUpload(s3_bucket)
+                    multipart.key_name = s3_key
+                    multipart.id = multipart_id
+
+                    with open(file_path, 'rb') as input_file:
+                        input_file.seek(offset)
+                        multipart.upload_part_from_file(input_file, part_num, md5=md5, size=size)
+
+                return md5[0]
+            except Exception as err:
+                if attempt >= self.part_retries:
+                    raise
+
+                log.warn("Retrying part %d of %s (%d/%d): %s" % (part_num, s3_key, attempt,
+                                                                  self.part_retries, err))
+
+    def _verify_parts(self, multipart, parts, part_md5s):
+        """Verify size and checksum of each uploaded part."""
+        uploaded_parts = {}
+        for uploaded_part in multipart:
+            uploaded_parts[uploaded_part.part_number] = uploaded_part
+
+        for part_num, _, size in parts:
+            uploaded_part = uploaded_parts.get(part_num)
+            if uploaded_part is None:
+                raise RuntimeError("ERROR: S3 part %d not uploaded" % part_num)
+
+            if uploaded_part.size != size:
+                msg = "ERROR: Mismatch in bytes of S3 part {0}: " \
+                      "{1} != {2}".format(part_num, uploaded_part.size, size)
+                raise RuntimeError(msg)
+
+            if uploaded_part.etag.strip('"') != part_md5s[part_num]:
+                msg = "ERROR: Mismatch in checksum of S3 part {0}: " \
+                      "{1} != {2}".format(part_num, uploaded_part.etag, part_md5s[part_num])
+                raise RuntimeError(msg)
+
+    def _upload_file_multipart(self, s3_bucket, s3_key, file_path, file_size):
+        """Upload a file to S3 as parts, in parallel. Returns uploaded key."""
+        chunk_size = self.get_part_size()
+
+        parts = []
+        for part_num, offset in enumerate(range(0, file_size, chunk_size), 1):
+            parts.append((part_num, offset, min(chunk_size, file_size - offset)))
+
+        log.print_log("Multipart upload: %d parts of %s, %d concurrent" % (len(parts),
+                                                                         utils.human_size(chunk_size),
+                                                                         self.max_concurrency))
+
+        headers, metadata = self._get_upload_headers()
+        multipart = s3_bucket.initiate_multipart_upload(s3_key,
+                                                        headers=headers,
+                                                        metadata=metadata,
+                                                        encrypt_key=True)
+
+        part_md5s = {}
+
+        def _upload_part(part):
+            part_md5s[part[0]] = self._upload_file_part(multipart.id, s3_key, file_path, part)
+
+        try:
+            pool = workers.WorkerPool(self.max_concurrency)
+            failures = pool.run(_upload_part, parts)
+            if len(failures) > 0:
+                raise RuntimeError("ERROR: Failed to upload %d of %d S3 parts" % (len(failures), len(parts)))
+
+            self._verify_parts(multipart, parts, part_md5s)
+            multipart.complete_upload()
+        except Exception:
+            multipart.cancel_upload()
+            raise
+
+        return s3_bucket.get_key(s3_key)
+
     def upload_file(self, s3_key, file_path):
-        """Upload a files to S3."""
+        """Upload a files to S3. Returns version id."""
         if not os.path.exists(file_path):
             raise RuntimeError("ERROR: File not found: %s" % file_path)
 
         log.print_log("Uploading file: %s" % file_path)
 
-        conn = self.get_connection()
-        s3_bucket = conn.get_bucket(self.bucket)
-
         file_size = os.stat(file_path).st_size
         file_human_size = utils.human_size(file_size)
         log.print_log("Uploading to S3 key: %s (%s)" % (s3_key, file_human_size))
 
-        key = s3_bucket.new_key(s3_key)
+        with self._pooled_bucket() as s3_bucket:
+            if file_size >= self.multipart_threshold:
+                key = self._upload_file_multipart(s3_bucket, s3_key, file_path, file_size)
+                bytes_written = key.size
+            else:
+                key = s3_bucket.new_key(s3_key)
 
-        if self.content_type:
-            key.set_metadata('Content-Type', self.content_type)
-
-        if self.encrypt_files is True:
-            key.set_metadata('x-amz-meta-s3tools-gpgenc', 'gpg')  # FYI: For s3cmd
+                headers, metadata = self._get_upload_headers()
+                for name, value in metadata.items():
+                    key.set_metadata(name, value)
 
-        bytes_written = key.set_contents_from_filename(file_path, encrypt_key=True)
+                bytes_written = key.set_contents_from_filename(file_path, headers=headers, encrypt_key=True)
 
         if bytes_written != file_size:
             msg = "ERROR: Mismatch in bytes synced to S3 bucket and local file: " \
@@ -108,6 +684,121 @@ class S3(object):
 
         # key.set_acl('private')
 
+        return key.version_id
+
+    def upload_data(self, s3_key, data):
+        """Upload data to S3. Returns version id."""
+        def _upload_data(s3_bucket):
+            key = s3_bucket.new_key(s3_key)
+            return key, key.set_contents_from_string(data, encrypt_key=True)
+
+        key, bytes_written = self._with_bucket(_upload_data)
+
+        if bytes_written != len(data):
+            msg = "ERROR: Mismatch in bytes synced to S3 bucket and data: " \
+                  "{0} != {1}".format(bytes_written, len(data))
+            raise RuntimeError(msg)
+
+        return key.version_id
+
+    def open_upload_stream(self, s3_key):
+        """Open a stream that uploads to S3 in chunks."""
+        s3_bucket = self._acquire_bucket()
+
+        headers, metadata = self._get_upload_headers()
+
+        log.print_log("Streaming to S3 key: %s (%s chunks)" % (s3_key,
+                                                              utils.human_size(self.get_part_size())))
+
+        return S3UploadStream(s3_bucket, s3_key, self.get_part_size(), headers, metadata,
+                              lambda: self._release_bucket(s3_bucket))
+
+    def open_download_stream(self, s3_key):
+        """Open S3 key as a readable stream."""
+        s3_bucket = self._acquire_bucket()
+        try:
+            key = self._get_key(s3_bucket, s3_key)
+
+            if key.size < self.multipart_threshold:
+                return S3KeyReader(key, lambda: self._release_bucket(s3_bucket))
+        except CONNECTION_ERRORS:
+            self._release_bucket(s3_bucket, True)
+            raise
+        except Exception:
+            self._release_bucket(s3_bucket)
+            raise
+
+        self._release_bucket(s3_bucket)
+        return S3RangeReader(self, key, self.download_chunk_size, self.download_concurrency)
+
+    def download_range(self, s3_key, fileobj, offset, size, version_id=None):
+        """Download a byte range of a S3 key to fileobj, on a pooled connection. Retries on error.
+
+        Each attempt is buffered, so only a complete range is written to fileobj. With version_id,
+        the range is of that version, so the ranges of a key are never of different versions.
+        """
+        headers = {'Range': 'bytes=%d-%d' % (offset, offset + size - 1)}
+
+        for attempt in range(1, self.part_retries + 1):
+            buffer = StringIO()
+            try:
+                with self._pooled_bucket() as s3_bucket:
+                    key = s3_bucket.new_key(s3_key)
+                    key.get_contents_to_file(buffer, headers=headers, version_id=version_id)
+
+                break
+            except Exception as err:
+                if attempt >= self.part_retries:
+                    raise
+
+                log.warn("Retrying range %d-%d of %s (%d/%d): %s" % (offset, offset + size - 1, s3_key,
+                                                                      attempt, self.part_retries, err))
+
+        data = buffer.getvalue()
+        fileobj.write(data)
+
+        return len(data)
+
+    def _download_file_ranged(self, key, to_file):
+        """Download a S3 key in parallel byte ranges, into a preallocated file."""
+        chunk_size = self.download_chunk_size
+
+        parts = []
+        for offset in range(0, key.size, chunk_size):
+            parts.append((offset, min(chunk_size, key.size - offset)))
+
+        log.print_log("Ranged download: %d parts of %s, %d concurrent" % (len(parts),
+                                                                        utils.human_size(chunk_size),
+                                                                        self.download_concurrency))
+
+        with open(to_file, 'wb') as output_file:
+            output_file.truncate(key.size)
+
+        def _download_part(part):
+            offset, size = part
+            with open(to_file, 'r+b') as output_file:
+                output_file.seek(offset)
+                bytes_written = self.download_range(key.name, output_file, offset, size, key.version_id)
+
+            if bytes_written != size:
+                msg = "ERROR: Mismatch in bytes of S3 range at {0}: " \
+                      "{1} != {2}".format(offset, bytes_written, size)
+                raise RuntimeError(msg)
+
+        pool = workers.WorkerPool(self.download_concurrency)
+        failures = pool.run(_download_part, parts)
+        if len(failures) > 0:
+            raise RuntimeError("ERROR: Failed to download %d of %d S3 ranges" % (len(failures), len(parts)))
+
+        hasher = S3ETagHasher(key.etag, self.get_part_size())
+        with open(to_file, 'rb') as input_file:
+            for data in iter(lambda: input_file.read(MB), ''):
+                hasher.update(data)
+
+        if not hasher.check(key.name):
+            log.error("Checksum of S3 key can not be verified, it was uploaded with a different part size: %s" %
+                      key.name)
+
     def download_file(self, s3_key, to_file, file_ext=''):
         """Download a files from S3."""
         file_ext = file_ext.lower()
@@ -119,8 +810,18 @@ class S3(object):
            self.encrypt_files is True:
             to_file += '.gpg'
 
-        log.print_log("  Downloading To: %s" % to_file)
-        key.get_contents_to_filename(to_file)
+        log.print_log("  Downloading To: %s (%s)" % (to_file, utils.human_size(key.size)))
+        if key.size >= self.multipart_threshold:
+            self._download_file_ranged(key, to_file)
+        else:
+            with self._pooled_bucket() as s3_bucket:
+                s3_bucket.new_key(key.name).get_contents_to_filename(to_file, version_id=key.version_id)
 
         if not os.path.exists(to_file):
             raise RuntimeError("ERROR: File not download: %s" % to_file)
+
+        file_size = os.stat(to_file).st_size
+        if file_size != key.size:
+            msg = "ERROR: Mismatch in bytes downloaded from S3 bucket and local file: " \
+                  "{0} != {1}".format(key.size, file_size)
+            raise RuntimeError(msg)
@@ -0,0 +1,187 @@
+
+"""Git Bundle Module."""
+
+import json
+
+from datetime import datetime
+
+import shell
+import log
+
+
+class BundleChain(object):
+    """Chain of a full bundle followed by incremental bundles."""
+
+    def __init__(self):
+        """Init."""
+        super(BundleChain, self).__init__()
+        self.bundles = []
+        self.refs = {}
+        self.head = None
+
+    def load(self, chain_file):
+        """Load chain file."""
+        with open(chain_file, 'r') as input_file:
+            data = json.load(input_file)
+
+        self.bundles = data.get('bundles', [])
+        self.refs = data.get('refs', {})
+        self.head = data.get('head')
+
+    def save(self, chain_file):
+        """Save chain file."""
+        data = {
+            'version': 1,
+            'bundles': self.bundles,
+            'refs': self.refs,
+            'head': self.head
+        }
+
+        with open(chain_file, 'w') as output_file:
+            json.dump(data, output_file, indent=2, sort_keys=True)
+
+    def needs_full(self, full_bundle_interval):
+        """Test if next bundle should be a full bundle."""
+        if len(self.bundles) == 0:
+            return True
+
+        return len(self.bundles) > full_bundle_interval
+
+    def add(self, bundle_type, refs, head, has_bundle=True):
+        """Add bundle to chain. Returns bundle filename."""
+        if bundle_type == 'full':
+            self.bundles = []
+
+        timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        filename = None
+        if has_bundle:
+            filename = "%04d-%s-%s.bundle" % (len(self.bundles), timestamp, bundle_type)
+
+        self.bundles.append({
+            'filename': filename,
+            'type': bundle_type,
+            'time': timestamp
+        })
+
+        self.refs = refs
+        self.head = head
+
+        return filename
+
+    def __eq__(self, other):
+        """Equal."""
+        return isinstance(other, BundleChain) and \
+            self.bundles == other.bundles and \
+            self.refs == other.refs
+
+    def __ne__(self, other):
+        """Not equal."""
+        return not self.__eq__(other)
+
+
+class Bundle(object):
+    """Git Bundle Class."""
+
+    def __init__(self, dry_run=False, verbose=False):
+        """Init."""
+        super(Bundle, self).__init__()
+        self.dry_run = dry_run
+        self.verbose = verbose
+
+    def _run_git(self, args, repo_path, input_data=None):
+        """Run git command, returning stdout."""
+        cmd = "git %s" % args
+        exit_code, stdout, stderr = shell.run_shell_cmd_output(cmd, repo_path, self.verbose, input_data)
+
+        if exit_code != 0:
+            raise RuntimeError("ERROR: '%s' returned exit code: %d\n%s" % (cmd, exit_code, stderr))
+
+        return stdout
+
+    def get_refs(self, repo_path):
+        """Get repo refs."""
+        stdout = self._run_git("for-each-ref --format='%(objectname) %(refname)'", repo_path)
+
+        refs = {}
+        for line in stdout.splitlines():
+            sha, ref = line.split(' ', 1)
+            refs[ref] = sha
+
+        return refs
+
+    def get_head(self, repo_path):
+        """Get repo HEAD symbolic ref."""
+        try:
+            return self._run_git("symbolic-ref HEAD", repo_path).strip()
+        except RuntimeError:
+            return None
+
+    def _existing_objects(self, repo_path, shas):
+        """Filter object ids that exist in repo."""
+        if len(shas) == 0:
+            return []
+
+        stdout = self._run_git("cat-file --batch-check", repo_path, '\n'.join(shas) + '\n')
+
+        existing = []
+        for line in stdout.splitlines():
+            parts = line.split()
+            if len(parts) == 3:
+                existing.append(parts[0])
+
+        return existing
+
+    def create(self, repo_path, bundle_file, prerequisite_refs=None):
+        """Create bundle. Thin if prerequisite refs are given. Returns False if empty."""
+        stdin = ''
+        if prerequisite_refs:
+            prerequisites = self._existing_objects(repo_path, sorted(set(prerequisite_refs.values())))
+            stdin = ''.join(["^%s\n" % sha for sha in prerequisites])
+
+        cmd = "bundle create %s --all --stdin" % bundle_file
+
+        if self.dry_run:
+            log.verbose("git %s" % cmd)
+            return True
+
+        exit_code, _, stderr = shell.run_shell_cmd_output("git %s" % cmd, repo_path, self.verbose, stdin)
+
+        if exit_code != 0:
+            if 'empty bundle' in stderr:
+                return False
+
+            raise RuntimeError("ERROR: Create bundle returned exit code: %d\n%s" % (exit_code, stderr))
+
+        return True
+
+    def init_repo(self, repo_path):
+        """Init bare repo for restore."""
+        if not self.dry_run:
+            self._run_git("init --bare %s" % repo_path, '.')
+
+    def fetch(self, repo_path, bundle_file):
+        """Fetch all refs from bundle into repo."""
+        if not self.dry_run:
+            self._run_git("fetch --quiet --update-head-ok %s '+refs/*:refs/*'" % bundle_file, repo_path)
+
+    def set_refs(self, repo_path, refs, head=None):
+        """Set repo refs to exactly match refs."""
+        if self.dry_run:
+            return
+
+        current_refs = self.get_refs(repo_path)
+
+        commands = []
+        for ref in sorted(current_refs):
+            if ref not in refs:
+                commands.append("delete %s\n" % ref)
+
+        for ref in sorted(refs):
+            if current_refs.get(ref) != refs[ref]:
+                commands.append("update %s %s\n" % (ref, refs[ref]))
+
+        if len(commands) > 0:
+            self._run_git("update-ref --stdin", repo_path, ''.join(commands))
+
+        if head:
+            self._run_git("symbolic-ref HEAD %s" % head, repo_path)
@@ -0,0 +1,280 @@
+
+"""Deduplicating Chunk Store Module."""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+import log
+import utils
+
+from dedup.Chunker import Chunker, KB
+
+
+class ChunkStore(object):
+    """Content-addressed chunk store, on top of a backup class."""
+
+    def __init__(self, backup_class, compress_level=6):
+        """Init."""
+        super(ChunkStore, self).__init__()
+        self.backup_class = backup_class
+        self.compress_level = compress_level
+
+        self.verbose = False
+
+        # Local index of known chunks, used instead of listing the store, until max age seconds old
+        self.index_file = None
+        self.index_max_age = 24 * 3600
+
+        self._known_chunks = None
+        self._listed = None
+        self._from_index = False
+        self._verified_chunks = set()
+        self._lock = threading.Lock()
+
+    def _load_index(self):
+        """Load known chunks from the local index. Returns None if there is none, or it is too old."""
+        if not self.index_file or not os.path.exists(self.index_file):
+            return None
+
+        try:
+            with open(self.index_file, 'r') as input_file:
+                index = json.load(input_file)
+        except (IOError, ValueError) as err:
+            log.warn("Chunk index not loaded: %s" % err)
+            return None
+
+        if time.time() - index.get('listed', 0) > self.index_max_age:
+            log.info("Chunk index too old, listing chunks again: %s" % self.index_file)
+            return None
+
+        self._listed = index['listed']
+        self._from_index = True
+        return set(index['chunks'])
+
+    def save_index(self):
+        """Save known chunks to the local index."""
+        with self._lock:
+            if not self.index_file or self._known_chunks is None:
+                return
+
+            index = {'version': 1, 'listed': self._listed, 'chunks': sorted(self._known_chunks)}
+
+        temp_file = self.index_file + '.part'
+        with open(temp_file, 'w') as output_file:
+            json.dump(index, output_file)
+
+        os.rename(temp_file, self.index_file)
+
+    def _get_known_chunks(self):
+        """Get ids of chunks already in the store, from the local index, or listed once."""
+        with self._lock:
+            if self._known_chunks is None:
+                self._known_chunks = self._load_index()
+
+                if self._known_chunks is None:
+                    chunks_path = self.backup_class.get_backup_chunks_path()
+                    log.info("Listing chunks: %s" % chunks_path)
+
+                    self._listed = time.time()
+                    self._known_chunks = set()
+                    for chunk_path in self.backup_class.list_files(chunks_path):
+                        self._known_chunks.add(chunk_path.rsplit('/', 1)[-1])
+
+                log.info("Known chunks: %d" % len(self._known_chunks))
+
+            return self._known_chunks
+
+    def _is_stored(self, chunk_id, known_chunks):
+        """Test if chunk is stored.
+
+        Chunks known from the index are checked in the store once per run, before a recipe uses them,
+        as they may have been removed since, e.g. by a lifecycle rule.
+        """
+        with self._lock:
+            if chunk_id not in known_chunks:
+                return False
+
+            if not self._from_index or chunk_id in self._verified_chunks:
+                return True
+
+        stored = self.backup_class.file_exists(self.backup_class.get_backup_chunk_path(chunk_id))
+
+        with self._lock:
+            if stored:
+                self._verified_chunks.add(chunk_id)
+            else:
+                log.warn("Chunk in index, not in store, storing it again: %s" % chunk_id)
+                known_chunks.discard(chunk_id)
+
+        return stored
+
+    def put_chunk(self, chunk_id, data):
+        """Store chunk, if not already stored. Returns bytes stored."""
+        known_chunks = self._get_known_chunks()
+
+        if self._is_stored(chunk_id, known_chunks):
+            return 0
+
+        # NOTE: Only known once uploaded. Parallel uploads of the same chunk are harmless.
+        compressed = zlib.compress(data, self.compress_level)
+        self.backup_class.upload_data(self.backup_class.get_backup_chunk_path(chunk_id),
+                                      compressed)
+
+        with self._lock:
+            known_chunks.add(chunk_id)
+            self._verified_chunks.add(chunk_id)
+
+        return len(compressed)
+
+    def get_chunk(self, chunk_id):
+        """Get chunk data."""
+        chunk_path = self.backup_class.get_backup_chunk_path(chunk_id)
+
+        stream = self.backup_class.open_download_stream(chunk_path)
+        try:
+            data = zlib.decompress(stream.read())
+        finally:
+            stream.close()
+
+        if hashlib.sha256(data).hexdigest() != chunk_id:
+            raise RuntimeError("ERROR: Chunk checksum mismatch: %s" % chunk_path)
+
+        return data
+
+    def save_recipe(self, recipe_path, recipe):
+        """Save recipe. Returns version id."""
+        return self.backup_class.upload_data(recipe_path, json.dumps(recipe))
+
+    def load_recipe(self, recipe_path):
+        """Load recipe."""
+        stream = self.backup_class.open_download_stream(recipe_path)
+        try:
+            return json.loads(stream.read())
+        finally:
+            stream.close()
+
+    def open_recipe(self, recipe_path):
+        """Open recipe as a readable stream."""
+        return RecipeReader(self, self.load_recipe(recipe_path))
+
+
+class DedupWriter(object):
+    """Write a stream as chunks to many chunk stores, and save its recipes."""
+
+    def __init__(self, chunk_stores, recipe_paths, avg_chunk_size=1024 * KB):
+        """Init."""
+        super(DedupWriter, self).__init__()
+        self.chunk_stores = chunk_stores
+        self.recipe_paths = recipe_paths
+
+        self.bytes_written = 0
+        self.bytes_stored = 0
+        self.chunks_new = 0
+        self.version_ids = []
+
+        self._sha = hashlib.sha256()
+        self._chunks = []
+        self._chunker = Chunker(self._on_chunk, avg_chunk_size)
+
+    def _on_chunk(self, data):
+        """Store chunk."""
+        chunk_id = hashlib.sha256(data).hexdigest()
+        self._chunks.append([chunk_id, len(data)])
+
+        stored = 0
+        for chunk_store in self.chunk_stores:
+            stored += chunk_store.put_chunk(chunk_id, data)
+
+        if stored > 0:
+            self.chunks_new += 1
+            self.bytes_stored += stored
+
+    def write(self, data):
+        """Write data."""
+        self._chunker.write(data)
+        self.bytes_written += len(data)
+        self._sha.update(data)
+
+    def checksum(self):
+        """Get SHA-256 of data written."""
+        return self._sha.hexdigest()
+
+    def flush(self):
+        """Flush."""
+        pass
+
+    def close(self):
+        """Store last chunk and save recipes."""
+        self._chunker.close()
+
+        recipe = {
+            'version': 1,
+            'compression': 'zlib',
+            'size': self.bytes_written,
+            'chunks': self._chunks
+        }
+
+        self.version_ids = [chunk_store.save_recipe(recipe_path, recipe)
+                            for chunk_store, recipe_path in zip(self.chunk_stores, self.recipe_paths)]
+
+    def abort(self):
+        """Abort. Stored chunks are kept, they may be used by later backups."""
+        self._chunks = []
+
+    def summary(self):
+        """Summary."""
+        return "%s in, %d of %d chunks new, %s stored" % (utils.human_size(self.bytes_written),
+                                                         self.chunks_new,
+                                                         len(self._chunks),
+                                                         utils.human_size(self.bytes_stored))
+
+
+class RecipeReader(object):
+    """Readable stream of a recipe's chunks."""
+
+    def __init__(self, chunk_store, recipe):
+        """Init."""
+        super(RecipeReader, self).__init__()
+        self.chunk_store = chunk_store
+        self.recipe = recipe
+
+        self._chunk_index = 0
+        self._buffer = ''
+        self._offset = 0
+
+    def read(self, size=-1):
+        """Read up to size bytes."""
+        result = []
+        remaining = size
+
+        while remaining != 0:
+            if self._offset >= len(self._buffer):
+                if self._chunk_index >= len(self.recipe['chunks']):
+                    break
+
+                chunk_id, _ = self.recipe['chunks'][self._chunk_index]
+                self._buffer = self.chunk_store.get_chunk(chunk_id)
+                self._offset = 0
+                self._chunk_index += 1
+                continue
+
+            end = len(self._buffer)
+            if remaining > 0:
+                end = min(end, self._offset + remaining)
+
+            data = self._buffer[self._offset:end]
+            self._offset = end
+            result.append(data)
+
+            if remaining > 0:
+                remaining -= len(data)
+
+        return ''.join(result)
+
+    def close(self):
+        """Close."""
+        self._buffer = ''
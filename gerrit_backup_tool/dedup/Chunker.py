@@ -0,0 +1,140 @@
+
+"""Content-Defined Chunker Module."""
+
+import hashlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KB = 1024
+
+MASK_64 = (1 << 64) - 1
+
+# Gear table, derived from SHA-256 so chunk boundaries never change between runs
+GEAR = [int(hashlib.sha256(str(i)).hexdigest()[:16], 16) for i in range(256)]
+
+# Bytes a Gear hash depends on, older bytes are shifted out of the 64 bits
+WINDOW = 64
+
+GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64) if numpy is not None else None
+
+
+class Chunker(object):
+    """Content-Defined Chunker, using a Gear rolling hash.
+
+    Data is written in, and chunks are passed to on_chunk as they are cut.
+    Boundaries depend only on the content near them, so an insert or delete
+    only changes the chunks around it.
+
+    With numpy the hash is computed for a whole buffer at once, at about
+    45 MB/s with 1 MB chunks, else byte by byte in Python, at about 2 MB/s.
+    Both cut the same boundaries.
+    """
+
+    def __init__(self, on_chunk, avg_size=1024 * KB):
+        """Init."""
+        super(Chunker, self).__init__()
+        self.on_chunk = on_chunk
+
+        bits = max(int(avg_size).bit_length() - 1, 8)
+        self.avg_size = 1 << bits
+        self.min_size = self.avg_size // 4
+        self.max_size = self.avg_size * 4
+
+        # Use the high bits of the hash, they depend on the most input bytes
+        self._cut_mask = ((1 << bits) - 1) << (64 - bits)
+
+        self._pending = bytearray()
+        self._hash = 0
+        self._scan_pos = 0
+
+    def _emit(self, size):
+        """Emit chunk of size bytes."""
+        chunk = bytes(self._pending[:size])
+        del self._pending[:size]
+
+        self._hash = 0
+        self._scan_pos = 0
+
+        self.on_chunk(chunk)
+
+    def _find_boundary(self):
+        """Find next chunk boundary in pending data. Returns -1 if not found."""
+        if GEAR_ARRAY is not None:
+            return self._find_boundary_numpy()
+
+        pending = self._pending
+        end = min(len(pending), self.max_size)
+        start = max(self._scan_pos, self.min_size)
+
+        gear = GEAR
+        cut_mask = self._cut_mask
+        h = self._hash
+
+        for i in xrange(start, end):
+            h = ((h << 1) + gear[pending[i]]) & MASK_64
+            if h & cut_mask == 0:
+                return i + 1
+
+        if end == self.max_size:
+            return end
+
+        self._hash = h
+        self._scan_pos = max(end, start)
+
+        return -1
+
+    def _find_boundary_numpy(self):
+        """Find next chunk boundary in pending data, hashing it as numpy arrays. Returns -1 if not found."""
+        end = min(len(self._pending), self.max_size)
+        start = max(self._scan_pos, self.min_size)
+
+        if start < end:
+            # NOTE: The hash at i is the sum of the gear values of the WINDOW bytes up to i,
+            # shifted by their distance to i. Bytes before min_size are not hashed.
+            context = max(start - (WINDOW - 1), self.min_size)
+            hashes = GEAR_ARRAY[numpy.frombuffer(self._pending, numpy.uint8, end - context, context)]
+
+            # Sums of 1, 2, 4 .. WINDOW bytes, each from two sums of half as many bytes
+            span = 1
+            while span < WINDOW and span < len(hashes):
+                shifted = hashes[:-span] << numpy.uint64(span)
+                hashes[span:] += shifted
+                span *= 2
+
+            cuts = numpy.flatnonzero(hashes[start - context:] & numpy.uint64(self._cut_mask) == 0)
+            if len(cuts) > 0:
+                return start + int(cuts[0]) + 1
+
+        if end == self.max_size:
+            return end
+
+        self._scan_pos = max(end, start)
+
+        return -1
+
+    def write(self, data):
+        """Write data."""
+        self._pending.extend(data)
+
+        while len(self._pending) > self.min_size:
+            boundary = self._find_boundary()
+            if boundary < 0:
+                break
+
+            self._emit(boundary)
+
+    def flush(self):
+        """Flush."""
+        pass
+
+    def close(self):
+        """Emit remaining data as the last chunk."""
+        while len(self._pending) > 0:
+            boundary = self._find_boundary()
+            if boundary < 0:
+                boundary = len(self._pending)
+
+            self._emit(boundary)
@@ -4,10 +4,86 @@
 import urllib2
 import httplib
 import json
+import os
+import re
 import ssl
 
 import log
 
+MAGIC_PREFIX = ")]}'"
+
+TOKENS_RE = re.compile(r'[\\"{}\[\],]')
+
+
+def iter_object_keys(fileobj, chunk_size=64 * 1024):
+    """Iterate the keys of a JSON object, read in chunks from fileobj, without loading it all.
+
+    Only the top level keys are decoded, the values are skipped.
+    """
+    depth = 0
+    in_string = False
+    escape = False
+    expect_key = False
+    key = None
+    key_start = 0
+
+    for data in iter(lambda: fileobj.read(chunk_size), ''):
+        # NOTE: Index of the character escaped by a backslash, it is not a token
+        skip = 0 if escape else -1
+        escape = False
+
+        for match in TOKENS_RE.finditer(data):
+            index = match.start()
+            if index == skip:
+                continue
+
+            char = match.group()
+            if in_string:
+                if char == '\\':
+                    skip = index + 1
+                    escape = skip == len(data)
+                elif char == '"':
+                    in_string = False
+                    if key is not None:
+                        key.append(data[key_start:index])
+                        yield json.loads('"%s"' % ''.join(key))
+                        key = None
+            elif char == '"':
+                in_string = True
+                if depth == 1 and expect_key:
+                    key = []
+                    key_start = index + 1
+                    expect_key = False
+            elif char in '{[':
+                depth += 1
+                expect_key = depth == 1 and char == '{'
+            elif char in '}]':
+                depth -= 1
+            elif char == ',' and depth == 1:
+                expect_key = True
+
+        if key is not None:
+            key.append(data[key_start:])
+            key_start = 0
+
+
+class PrefixReader(object):
+    """Reader, skipping the XSSI magic prefix of Gerrit JSON responses."""
+
+    def __init__(self, fileobj):
+        """Init."""
+        super(PrefixReader, self).__init__()
+        self.fileobj = fileobj
+
+        self._pending = fileobj.read(len(MAGIC_PREFIX))
+        if self._pending == MAGIC_PREFIX:
+            self._pending = ''
+
+    def read(self, size=-1):
+        """Read up to size bytes."""
+        data, self._pending = self._pending + self.fileobj.read(size), ''
+        return data
+
 
 class Api(object):
     """Api."""
@@ -20,19 +96,51 @@ class Api(object):
 
         self.verbose = False
 
-    def get_repos(self):
-        """Get Gerrit Repos via API."""
-        log.print_log("Getting Gerrit Repos via API")
-
-        api_url = self.url + '/projects/?t'
+        # Number of projects per request, 0 gets all projects in one request
+        self.page_size = 0
+        self.cache_file = None
 
-        if self.verbose:
-            extra_options = ''
+        self._cache = {}
 
-            if not self.verify_ssl:
-                extra_options += 'k'
+    def _load_cache(self):
+        """Load cached listing, with the ETag / Last-Modified of its first page."""
+        self._cache = {}
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
 
-            log.verbose("curl -L%s %s" % (extra_options, api_url))
+        try:
+            with open(self.cache_file, 'r') as input_file:
+                cache = json.load(input_file)
+        except (IOError, ValueError) as err:
+            log.warn("Project list cache not loaded: %s" % err)
+            return
+
+        if cache.get('version') == 2:
+            self._cache = cache
+
+    def _save_cache(self, api_url, headers, repos):
+        """Save listing, with the ETag / Last-Modified of its first page."""
+        if not self.cache_file:
+            return
+
+        temp_file = self.cache_file + '.part'
+        with open(temp_file, 'w') as output_file:
+            json.dump({'version': 2,
+                       'url': api_url,
+                       'etag': headers.getheader('ETag'),
+                       'last_modified': headers.getheader('Last-Modified'),
+                       'repos': repos}, output_file)
+
+        os.rename(temp_file, self.cache_file)
+
+    def _open(self, api_url, cached=None):
+        """Open API URL. Returns None if cached is not modified."""
+        request = urllib2.Request(api_url)
+        if cached is not None:
+            if cached.get('etag'):
+                request.add_header('If-None-Match', cached['etag'])
+            if cached.get('last_modified'):
+                request.add_header('If-Modified-Since', cached['last_modified'])
 
         try:
             context = ssl.create_default_context()
@@ -40,9 +148,11 @@ class Api(object):
             if not self.verify_ssl:
                 context = ssl._create_unverified_context()
 
-            response = urllib2.urlopen(api_url, context=context)
+            response = urllib2.urlopen(request, context=context)
 
         except urllib2.HTTPError as err:
+            if err.code == 304 and cached is not None:
+                return None
             raise RuntimeError("ERROR: (Gerrit API) HTTPError = %s (%s)" % (str(err.code), err.reason))
         except urllib2.URLError as err:
             raise RuntimeError("ERROR: (Gerrit API) URLError = %s (%s)" % (str(err.reason), err.reason))
@@ -55,16 +165,65 @@ class Api(object):
         if response.getcode() != 200:
             raise RuntimeError("ERROR: (Gerrit API) Did not get 200 response from: %s" % api_url)
 
-        magic_prefix = ")]}'"
-        response_body = response.read()
-        if response_body.startswith(magic_prefix):
-            response_body = response_body[len(magic_prefix):]
+        return response
+
+    def _get_page(self, api_url, cached=None):
+        """Get page of repos. Returns repos and response headers, or None if cached is not modified."""
+        if self.verbose:
+            extra_options = ''
+
+            if not self.verify_ssl:
+                extra_options += 'k'
+
+            log.verbose("curl -L%s %s" % (extra_options, api_url))
+
+        response = self._open(api_url, cached)
+        if response is None:
+            return None
+
+        repos = list(iter_object_keys(PrefixReader(response)))
+        response.close()
+
+        return repos, response.info()
+
+    def get_repos(self):
+        """Get Gerrit Repos via API.
+
+        The first page is requested with the cached listing's ETag / Last-Modified;
+        if it is not modified, the cached listing is used and no other page is requested.
+        """
+        log.print_log("Getting Gerrit Repos via API")
 
-        data = json.loads(response_body)
+        self._load_cache()
 
+        first_url = None
+        first_headers = None
         repos = []
-        for repo in data:
-            repos.append(repo)
+        while True:
+            api_url = self.url + '/projects/?t'
+            if self.page_size > 0:
+                api_url += '&n=%d&S=%d' % (self.page_size, len(repos))
+
+            cached = None
+            if first_url is None:
+                first_url = api_url
+                if self._cache.get('url') == api_url:
+                    cached = self._cache
+
+            page = self._get_page(api_url, cached)
+            if page is None:
+                log.info("Project list not modified: %s" % api_url)
+                return list(cached['repos'])
+
+            page_repos, headers = page
+            if first_headers is None:
+                first_headers = headers
+            repos += page_repos
+
+            if self.page_size <= 0 or len(page_repos) < self.page_size:
+                break
+
+        self._save_cache(first_url, first_headers, repos)
 
         return repos
 
@@ -1,14 +1,33 @@
 
 """Gerrit Backup."""
 
+import errno
+import grp
+import json
+import pwd
 import shutil
 import os
+import sqlite3
+import tempfile
+import time
 
 import shell
+import streams
+import utils
+import workers
 import log
+import scheduler
 
 from tar.Tar import Tar
+from tar.Compression import CompressWriter, DecompressReader, get_codec
 from mysql.Database import Database
+from mysql.Session import Session
+from gerrit.Manifest import Manifest, repo_fingerprint
+from gerrit.Catalog import Catalog, new_run_id
+from gerrit.DiskUsage import DiskUsage, add_usage, new_usage, save_csv, usage_summary
+from bundle.Bundle import Bundle, BundleChain
+from dedup.ChunkStore import ChunkStore, DedupWriter
+from dedup.Chunker import KB
 
 
 class Backup(object):
@@ -22,6 +41,36 @@ class Backup(object):
 
         self.verbose = False
         self.dry_run = False
+        self.stream = False
+        self.stream_database = False
+        self.database_table_jobs = 0
+        self.restore_tables = []
+        self.stream_restore_database = False
+        self.incremental = False
+
+        self.archive_format = 'tar'
+
+        self.compression = 'gzip'
+        self.compression_level = None
+        self.compression_threads = 1
+        self.store_incompressible = True
+        self.full_bundle_interval = 7
+
+        self.dedup = False
+        self.dedup_chunk_size = 1024 * KB
+        self.chunk_stores = [ChunkStore(backup_class) for backup_class in backup_classes]
+
+        self.versions_indexes = [None for _ in backup_classes]
+
+        self.catalog = True
+        self.catalogs = [Catalog() for _ in backup_classes]
+        self.catalog_format_warned = False
+        self.run_id = new_run_id()
+
+        self.manifests = [Manifest() for _ in backup_classes]
+        self.disk_usage = DiskUsage()
+        self.repo_disk_sizes = {}
+        self.skipped_repos = []
 
         if len(self.backup_classes) == 0:
             raise RuntimeError('ERROR: No Backup classes!')
@@ -35,33 +84,316 @@ class Backup(object):
 
         return repo_path
 
+    def _new_tar(self):
+        """Get Tar, with the configured compression."""
+        tar = Tar(self.dry_run, self.verbose)
+        tar.compression = self.compression
+        tar.compression_level = self.compression_level
+        tar.compression_threads = self.compression_threads
+        tar.store_incompressible = self.store_incompressible
+
+        return tar
+
+    def _new_database(self):
+        """Get Database, from the database config."""
+        database = Database(self.config.get('database', 'database_host'),
+                            self.config.get('database', 'database_username'),
+                            self.config.get('database', 'database_password'))
+        database.verbose = self.verbose
+        database.dry_run = self.dry_run
+
+        return database
+
     def _get_script_path(self):
         """Return Script Path."""
         return os.path.abspath(os.path.expanduser('~/gerrit_backup_tool'))
 
     def get_repo_disk_usage(self, repo):
-        """Get Repos Disk Uages."""
-        repo_path = self._get_repo_path(repo)
+        """Get Repo Disk Usage, in bytes and files."""
+        return self.disk_usage.scan_repo(self._get_repo_path(repo))
 
-        cmd = "du -sh %s" % repo_path
+    def _load_disk_usage_cache(self, cache_file):
+        """Load disk usage cache, if any."""
+        if cache_file and os.path.exists(cache_file):
+            try:
+                self.disk_usage.load(cache_file)
+            except (IOError, ValueError) as err:
+                log.warn("Disk usage cache not loaded: %s" % err)
 
-        if not self.dry_run:
-            return shell.run_shell_cmd(cmd, '.''', self.verbose)
+    def report_disk_usage(self, repos, jobs=1, csv_file=None, cache_file=None):
+        """Report Repos Disk Usage, largest first. Repos are scanned in parallel."""
+        self._load_disk_usage_cache(cache_file)
 
-        return 0
+        usages = {}
+
+        def _scan_repo(repo):
+            usages[repo] = self.get_repo_disk_usage(repo)
+
+        started = time.time()
+
+        pool = workers.WorkerPool(jobs, '')
+        pool.verbose = self.verbose
+        pool.run(_scan_repo, repos)
+
+        log.info("Scanned %d repo(s) in %.1fs: %d directories listed, %d unchanged" % (
+            len(usages), time.time() - started, self.disk_usage.scanned_dirs, self.disk_usage.cached_dirs))
+
+        sorted_usages = sorted(usages.items(), key=lambda item: (-item[1]['bytes'], item[0]))
+
+        total = new_usage()
+        for repo, usage in sorted_usages:
+            add_usage(total, usage)
+            log.print_log("%s: %s" % (repo, usage_summary(usage)))
+
+        log.print_log("Total: %d repo(s), %s" % (len(sorted_usages), usage_summary(total)))
+
+        if cache_file and not self.dry_run:
+            self.disk_usage.save(cache_file)
+
+        if csv_file:
+            save_csv(csv_file, sorted_usages)
+            log.info("Saved disk usage report: %s" % csv_file)
+
+        return pool.report_failures('scan')
+
+    def get_repo_costs(self, repos, jobs=1, cache_file=None):
+        """Get expected cost of backing up each repo.
+
+        Costs are the durations of the repos' previous whole backups, from the catalog, which also records
+        their on-disk size; only other repos are scanned, and costed by their on-disk size, at the catalog's
+        average seconds per byte. Without any previous durations, costs are the on-disk sizes. Returns costs
+        and whether they are in seconds.
+        """
+        durations = {}
+        sizes = {}
+
+        catalog = self.catalogs[0] if self.catalogs else None
+        if catalog is not None:
+            for repo in repos:
+                backup = catalog.get_latest_backup(repo)
+                if backup is not None and backup['duration']:
+                    durations[repo] = backup['duration']
+                    if backup['disk_size']:
+                        sizes[repo] = backup['disk_size']
+
+        def _scan_repo(repo):
+            sizes[repo] = self.get_repo_disk_usage(repo)['bytes']
+
+        scan_repos = [repo for repo in repos if repo not in sizes]
+        if len(scan_repos) > 0:
+            self._load_disk_usage_cache(cache_file)
+
+            pool = workers.WorkerPool(jobs, '')
+            pool.run(_scan_repo, scan_repos)
+
+            if cache_file and not self.dry_run:
+                self.disk_usage.save(cache_file)
+
+        log.info("Schedule: %d repo(s) with previous durations, %d repo(s) scanned" % (len(durations),
+                                                                                      len(scan_repos)))
+
+        self.repo_disk_sizes.update(sizes)
+
+        known = [repo for repo in durations if sizes.get(repo)]
+        if len(known) == 0:
+            return dict([(repo, sizes.get(repo, 0)) for repo in repos]), False
+
+        seconds_per_byte = sum([durations[repo] for repo in known]) / sum([sizes[repo] for repo in known])
+
+        costs = {}
+        for repo in repos:
+            costs[repo] = durations.get(repo, sizes.get(repo, 0) * seconds_per_byte)
+
+        return costs, True
+
+    def schedule_repos(self, repos, jobs=1, priority_repos=None, cache_file=None):
+        """Order repos largest first, priority repos first. Returns repos and predicted makespan, in seconds or None."""
+        costs, in_seconds = self.get_repo_costs(repos, jobs, cache_file)
+
+        scheduled = scheduler.lpt_order(repos, costs, priority_repos)
+        makespan = scheduler.predict_makespan(scheduled, costs, jobs)
+
+        priority = [repo for repo in priority_repos or [] if repo in costs]
+        if len(priority) > 0:
+            log.info("Schedule: priority repos first: %s" % ', '.join(priority))
+
+        if in_seconds:
+            log.info("Schedule: %d repo(s), largest first, %d jobs, predicted makespan: %.1fs" % (len(scheduled),
+                                                                                                  jobs,
+                                                                                                  makespan))
+            return scheduled, makespan
+
+        log.info("Schedule: %d repo(s), largest first, %d jobs, no previous durations, "
+                 "busiest job: %s of %s" % (len(scheduled), jobs, utils.human_size(makespan),
+                                            utils.human_size(sum(costs.values()))))
+        return scheduled, None
+
+    def load_versions_indexes(self):
+        """Load versions of all repos, listing each backup class once."""
+        self.versions_indexes = [backup_class.get_versions_index() for backup_class in self.backup_classes]
 
     def get_versions(self, repo):
-        """Get version."""
+        """Get version. Returns versions by backup class description.
+
+        Versions in the catalog come first, followed by versions the catalog has not recorded,
+        e.g. uploaded before the catalog existed.
+        """
 
         # TODO: Implement in all backup classes
 
-        for backup_class in self.backup_classes:
+        repo_versions = {}
+        for backup_class, catalog, index in zip(self.backup_classes, self.catalogs, self.versions_indexes):
             backup_path = backup_class.get_backup_repo_path(repo)
-            versions = backup_class.get_all_versions(backup_path)
+            log.info(backup_path)
+
+            if index is None:
+                stored_versions = [{'version_id': version_id}
+                                   for version_id in backup_class.get_all_versions(backup_path)]
+            else:
+                stored_versions = index.get(backup_path, [])
+
+            versions = []
+            if catalog.has_uploads():
+                versions = catalog.get_versions(['repo', 'bundle'], repo)
+
+            cataloged = set(version['version_id'] for version in versions)
+            versions += [version for version in stored_versions if version['version_id'] not in cataloged]
+
             for version in versions:
-                log.print_log("- %s" % version)
+                log.print_log("- %s" % (version['version_id'] or version.get('time')))
+
+            repo_versions[backup_class.description()] = versions
+
+        return repo_versions
+
+    def load_catalogs(self):
+        """Load catalogs from backup classes, to record this run's uploads."""
+        if not self.catalog:
+            return
+
+        for backup_class, catalog in zip(self.backup_classes, self.catalogs):
+            backup_path = backup_class.get_backup_catalog_path()
+            fd, catalog_file = tempfile.mkstemp(suffix='.sqlite')
+            os.close(fd)
+
+            try:
+                backup_class.download_file(backup_path, catalog_file)
+                log.info("Loaded catalog: %s" % backup_path)
+            except (RuntimeError, IOError, OSError) as err:
+                log.warn("No catalog loaded, starting a new catalog: %s" % err)
+                open(catalog_file, 'wb').close()
+
+            try:
+                catalog.open(catalog_file)
+            except sqlite3.DatabaseError as err:
+                log.warn("Catalog not loaded, starting a new catalog: %s" % err)
+                catalog.close()
+                open(catalog_file, 'wb').close()
+                catalog.open(catalog_file)
+
+            catalog.start_run(self.run_id, self.config.get('backup', 'ssh_hostname'))
+
+    def save_chunk_indexes(self):
+        """Save local indexes of known dedup chunks."""
+        for chunk_store in self.chunk_stores:
+            try:
+                chunk_store.save_index()
+            except (IOError, OSError) as err:
+                log.warn("Chunk index not saved: %s" % err)
+
+    def save_catalogs(self, status):
+        """Save catalogs, with this run's uploads, to backup classes and close them."""
+        for backup_class, catalog in zip(self.backup_classes, self.catalogs):
+            if not catalog.is_open():
+                continue
+
+            try:
+                if not self.dry_run and catalog.upload_count > 0:
+                    catalog.finish_run(status)
+                    log.info("Saving catalog: %d uploads recorded (%s)" % (catalog.upload_count, status))
+                    backup_class.upload_file(backup_class.get_backup_catalog_path(), catalog.db_file)
+            finally:
+                catalog.close()
+                os.remove(catalog.db_file)
+
+    def log_restore_plan(self, repos):
+        """Log size of latest backups of repos, from the catalog."""
+        catalog = self.catalogs[0]
+        if not catalog.has_uploads():
+            return
+
+        total_size, missing = catalog.estimate('repo', repos)
+        log.info("Restore plan: %d repo(s), %s" % (len(repos) - len(missing), utils.human_size(total_size)))
+
+        if len(missing) > 0:
+            log.warn("Repo(s) not in catalog: %d" % len(missing))
+            for repo in missing:
+                log.verbose("- %s" % repo)
+
+    def log_backup_estimate(self, repos):
+        """Log size of previous backups of repos, from the catalog."""
+        catalog = self.catalogs[0]
+        if not catalog.has_uploads():
+            return
+
+        total_size, missing = catalog.estimate('repo', repos)
+        log.info("Backup estimate: %s, from previous backups of %d repo(s), %d new" % (utils.human_size(total_size),
+                                                                                     len(repos) - len(missing),
+                                                                                     len(missing)))
+
+    def _record_uploads(self, kind, name, backup_paths, version_ids, size, checksum, started):
+        """Record upload in the catalogs of all backup classes."""
+        duration = time.time() - started
+
+        for catalog, backup_path, version_id in zip(self.catalogs, backup_paths, version_ids):
+            catalog.record(kind, name, backup_path, version_id, size, checksum, duration)
+
+    def _upload_file(self, kind, name, get_backup_path, file_path):
+        """Upload file to all backup classes, and record it in their catalogs."""
+        started = time.time()
+
+        backup_paths = [get_backup_path(backup_class) for backup_class in self.backup_classes]
+        version_ids = [backup_class.upload_file(backup_path, file_path)
+                       for backup_class, backup_path in zip(self.backup_classes, backup_paths)]
+
+        self._record_uploads(kind, name, backup_paths, version_ids,
+                             os.stat(file_path).st_size, streams.file_sha256(file_path), started)
+
+    def _get_recipe_path(self, backup_path):
+        """Get dedup recipe path of a backup path. Recipes rebuild an uncompressed TAR."""
+        if backup_path.endswith('.gz'):
+            backup_path = backup_path[:-len('.gz')]
+
+        return backup_path + '.recipe'
+
+    def _create_dedup(self, kind, name, file_path, get_backup_path):
+        """Create TAR of file_path, stored as chunks in all backup classes."""
+        started = time.time()
+
+        recipe_paths = [self._get_recipe_path(get_backup_path(backup_class))
+                        for backup_class in self.backup_classes]
+
+        writer = DedupWriter(self.chunk_stores, recipe_paths, self.dedup_chunk_size)
+
+        tar = self._new_tar()
+        tar.create_stream(file_path, writer, compress=False)
+        writer.close()
+
+        self._record_uploads(kind, name, recipe_paths, writer.version_ids,
+                             writer.bytes_written, writer.checksum(), started)
+
+        log.print_log("Dedup: %s (%s)" % (os.path.basename(file_path), writer.summary()))
+
+    def _extract_dedup(self, backup_path, path, owner=None):
+        """Extract TAR rebuilt from chunks of the first backup class into path."""
+        chunk_store = self.chunk_stores[0]
+        reader = chunk_store.open_recipe(self._get_recipe_path(backup_path))
 
-        return 0
+        log.print_log("Extracting %s from %d chunks..." % (backup_path, len(reader.recipe['chunks'])))
+
+        tar = self._new_tar()
+        tar.extract_stream(reader, path, owner)
+        reader.close()
 
     def backup_database(self):
         """Backup Database."""
@@ -70,29 +402,386 @@ class Backup(object):
         if not self.dry_run:
             path = '.'
 
-            database = Database(self.config.get('database', 'database_host'),
-                                self.config.get('database', 'database_username'),
-                                self.config.get('database', 'database_password'))
+            database = self._new_database()
 
             sql_dump_file = os.path.join(path, self.config.get('database', 'database_dump_file'))
             sql_dump_file = os.path.abspath(sql_dump_file)
 
+            if self.database_table_jobs > 0:
+                self._backup_database_tables(database)
+                del database
+                return exit_code
+
+            if self.stream_database and not self.dedup:
+                self._backup_database_stream(database)
+                del database
+                return exit_code
+
             exit_code = database.dump([self.config.get('database', 'databases_name')], sql_dump_file)
 
-            tar = Tar(self.dry_run, self.verbose)
-            tar_file_path = tar.create(sql_dump_file)
+            if self.dedup:
+                self._create_dedup('database', self.config.get('database', 'databases_name'), sql_dump_file,
+                                   lambda backup_class: backup_class.get_backup_database_path())
+            else:
+                tar = self._new_tar()
+                tar_file_path = tar.create(sql_dump_file)
 
-            for backup_class in self.backup_classes:
-                backup_path = backup_class.get_backup_database_path()
-                backup_class.upload_file(backup_path, tar_file_path)
+                self._upload_file('database', self.config.get('database', 'databases_name'),
+                                  lambda backup_class: backup_class.get_backup_database_path(),
+                                  tar_file_path)
 
-            if os.path.exists(tar_file_path):
-                os.remove(os.path.abspath(tar_file_path))
+                if os.path.exists(tar_file_path):
+                    os.remove(os.path.abspath(tar_file_path))
 
             del database
 
         return exit_code
 
+    def _upload_dump_stream(self, kind, name, get_backup_path, dump):
+        """Upload output of dump(fileobj), compressed, to all backup classes.
+
+        Returns the bytes dumped, and the size and checksum of the compressed dump.
+        """
+        codec = get_codec(self.compression)
+        started = time.time()
+
+        backup_paths = []
+        writers = []
+        compressor = None
+        try:
+            for backup_class in self.backup_classes:
+                backup_path = get_backup_path(backup_class)
+                backup_paths.append(backup_path)
+                writers.append(backup_class.open_upload_stream(backup_path))
+
+            stream = streams.MultiWriter(writers)
+            upload = streams.MeteredWriter(stream)
+            compressor = CompressWriter(upload, codec, self.compression_level, self.compression_threads)
+            compress = streams.MeteredWriter(compressor)
+
+            bytes_dumped, dump_seconds = dump(compress)
+            compress.close()
+            upload.close()
+        except Exception:
+            if compressor is not None:
+                compressor.abort()
+            streams.MultiWriter(writers).abort()
+            raise
+
+        # NOTE: Stages run in one thread, so each stage's time excludes the stages it writes to
+        log.print_log("Dumped: %s (%s)" % (name, utils.throughput_string(bytes_dumped, dump_seconds)))
+        log.print_log("Compressed: %s (%s, %s out)" % (name,
+                                                      utils.throughput_string(compressor.bytes_in,
+                                                                              compress.seconds - upload.seconds),
+                                                      utils.human_size(compressor.bytes_out)))
+        log.print_log("Uploaded: %s (%s)" % (name, utils.throughput_string(upload.bytes_written, upload.seconds)))
+
+        self._record_uploads(kind, name, backup_paths,
+                             [getattr(writer, 'version_id', None) for writer in writers],
+                             stream.bytes_written, stream.checksum(), started)
+
+        log.print_log("Streamed: %s (%s in %.1fs)" % (name,
+                                                      utils.human_size(stream.bytes_written),
+                                                      time.time() - started))
+
+        return bytes_dumped, stream.bytes_written, stream.checksum()
+
+    def _backup_database_stream(self, database):
+        """Backing up Database, streaming mysqldump output, compressed, to all backup classes."""
+        databases_name = self.config.get('database', 'databases_name')
+
+        self._upload_dump_stream('database', databases_name,
+                                 lambda backup_class: backup_class.get_backup_database_stream_path(),
+                                 lambda fileobj: database.dump_stream([databases_name], fileobj))
+
+    def _backup_database_table(self, database, database_name, table_name):
+        """Backing up Table, streaming mysqldump output, compressed, to all backup classes."""
+        table_file = "%s.%s.sql.gz" % (database_name, table_name)
+
+        bytes_dumped, size, checksum = self._upload_dump_stream(
+            'database_table', "%s.%s" % (database_name, table_name),
+            lambda backup_class: '/'.join([backup_class.get_backup_database_tables_path(), table_file]),
+            lambda fileobj: database.dump_table_stream(database_name, table_name, fileobj))
+
+        return {'database': database_name,
+                'table': table_name,
+                'file': table_file,
+                'bytes_dumped': bytes_dumped,
+                'size': size,
+                'checksum': checksum}
+
+    def _backup_database_schema(self, database, database_name):
+        """Backing up Schema of Database, with views, routines and triggers, streamed compressed."""
+        schema_file = "%s.schema.sql.gz" % database_name
+
+        bytes_dumped, size, checksum = self._upload_dump_stream(
+            'database_schema', "%s (schema)" % database_name,
+            lambda backup_class: '/'.join([backup_class.get_backup_database_tables_path(), schema_file]),
+            lambda fileobj: database.dump_schema_stream(database_name, fileobj))
+
+        return {'database': database_name,
+                'file': schema_file,
+                'bytes_dumped': bytes_dumped,
+                'size': size,
+                'checksum': checksum}
+
+    def _backup_database_tables(self, database):
+        """Backing up Database, each table to its own compressed dump, in parallel.
+
+        All tables are dumped under a global read lock, held by a session for the whole dump,
+        so the table dumps are one consistent snapshot. The schema, with the views, is dumped once, first.
+        """
+        databases_name = self.config.get('database', 'databases_name')
+        started = time.time()
+
+        entries = {}
+
+        def _backup_table(table):
+            database_name, table_name = table.split('.', 1)
+            entries[table] = self._backup_database_table(database, database_name, table_name)
+
+        pool = workers.WorkerPool(self.database_table_jobs, 'Dumping table')
+        pool.verbose = self.verbose
+
+        session = Session(database)
+        session.open()
+        try:
+            session.lock_tables()
+
+            schema = self._backup_database_schema(database, databases_name)
+
+            tables = ["%s.%s" % (databases_name, table_name) for table_name in database.get_tables(databases_name)]
+            log.info("Dumping %d table(s), %d jobs" % (len(tables), pool.jobs))
+
+            pool.run(_backup_table, tables)
+        finally:
+            session.close()
+
+        if pool.report_failures('dump') > 0:
+            raise RuntimeError("ERROR: Failed to dump tables of database: %s" % databases_name)
+
+        manifest = {'version': 1,
+                    'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started)),
+                    'schema': schema,
+                    'tables': [entries[table] for table in tables]}
+        data = json.dumps(manifest, indent=2, sort_keys=True)
+
+        for backup_class in self.backup_classes:
+            backup_class.upload_data('/'.join([backup_class.get_backup_database_tables_path(), 'manifest.json']),
+                                     data)
+
+        log.print_log("Dumped: %s (%d tables, %s, read lock held %.1fs, %.1fs)" % (
+            databases_name, len(tables),
+            utils.human_size(sum([entry['size'] for entry in manifest['tables']])),
+            session.lock_seconds, time.time() - started))
+
+    def _download_database_stream(self, database_dump_file):
+        """Download streamed Database dump, decompressed into database_dump_file."""
+        backup_path = self.backup_classes[0].get_backup_database_stream_path()
+
+        reader = DecompressReader(self.backup_classes[0].open_download_stream(backup_path))
+        writer = streams.AtomicFileWriter(database_dump_file)
+        try:
+            for data in iter(lambda: reader.read(1024 * 1024), ''):
+                writer.write(data)
+        except Exception:
+            writer.abort()
+            raise
+        finally:
+            reader.fileobj.close()
+
+        writer.close()
+
+    def _get_backup_format(self, name, formats, config_format):
+        """Get format of the latest backup of name, from the catalog of the first backup class.
+
+        formats are (format, backup paths, folder paths). A config changed since the backup would
+        otherwise restore an older backup, stored in another format. Without a catalog, config_format is used.
+        """
+        catalog = self.catalogs[0]
+        if not catalog.has_uploads():
+            if not self.catalog_format_warned:
+                log.warn("No catalog, backup format not checked, from config: %s" % config_format)
+                self.catalog_format_warned = True
+            return config_format
+
+        latest_format = None
+        latest_id = None
+        for backup_format, backup_paths, folder_paths in formats:
+            upload = catalog.get_latest_upload(backup_paths, folder_paths)
+            if upload is not None and (latest_id is None or upload['id'] > latest_id):
+                latest_format, latest_id = backup_format, upload['id']
+
+        if latest_format is None:
+            raise RuntimeError("ERROR: No backup of '%s' in catalog, format unknown" % name)
+
+        if latest_format != config_format:
+            log.warn("Backup of '%s' is %s, not %s as configured, restoring %s" % (name, latest_format,
+                                                                                config_format, latest_format))
+
+        return latest_format
+
+    def _get_database_format(self):
+        """Get format of the latest Database backup: tables, dedup, stream or tar."""
+        backup_class = self.backup_classes[0]
+        backup_path = backup_class.get_backup_database_path()
+
+        config_format = 'tar'
+        if self.database_table_jobs > 0:
+            config_format = 'tables'
+        elif self.dedup:
+            config_format = 'dedup'
+        elif self.stream_database:
+            config_format = 'stream'
+
+        return self._get_backup_format(self.config.get('database', 'databases_name'),
+                                       [('tables', [], [backup_class.get_backup_database_tables_path()]),
+                                        ('dedup', [self._get_recipe_path(backup_path)], []),
+                                        ('stream', [backup_class.get_backup_database_stream_path()], []),
+                                        ('tar', [backup_path], [])],
+                                       config_format)
+
+    def _get_repo_format(self, repo):
+        """Get format of the latest Repo backup: bundle, dedup or tar."""
+        backup_class = self.backup_classes[0]
+        backup_path = backup_class.get_backup_repo_path(repo)
+
+        config_format = 'tar'
+        if self.archive_format == 'bundle':
+            config_format = 'bundle'
+        elif self.dedup:
+            config_format = 'dedup'
+
+        return self._get_backup_format(repo,
+                                       [('bundle', [], [backup_class.get_backup_repo_bundle_path(repo, '')]),
+                                        ('dedup', [self._get_recipe_path(backup_path)], []),
+                                        ('tar', [backup_path], [])],
+                                       config_format)
+
+    def _restore_database_stream(self, database, backup_format):
+        """Restoring Database, streaming the dump from the first backup class into mysql. Nothing is written to disk."""
+        backup_class = self.backup_classes[0]
+        database_dump_file = os.path.basename(self.config.get('database', 'database_dump_file'))
+        started = time.time()
+
+        if backup_format == 'stream':
+            input_file = backup_class.open_download_stream(backup_class.get_backup_database_stream_path())
+            reader = DecompressReader(input_file)
+        else:
+            backup_path = backup_class.get_backup_database_path()
+            if backup_format == 'dedup':
+                input_file = self.chunk_stores[0].open_recipe(self._get_recipe_path(backup_path))
+            else:
+                input_file = backup_class.open_download_stream(backup_path)
+
+            reader = self._new_tar().open_member_stream(input_file, database_dump_file)
+
+        progress = streams.ProgressReader(reader, "Restoring database")
+        try:
+            database.load_stream(progress)
+        finally:
+            input_file.close()
+
+        log.print_log("Restored: %s (%s, %.1fs)" % (database_dump_file, progress.summary(), time.time() - started))
+
+        return 0
+
+    def _load_database_tables_manifest(self):
+        """Load table manifest of the Database backup."""
+        backup_class = self.backup_classes[0]
+        backup_path = '/'.join([backup_class.get_backup_database_tables_path(), 'manifest.json'])
+
+        input_file = backup_class.open_download_stream(backup_path)
+        try:
+            return json.loads(input_file.read())
+        finally:
+            input_file.close()
+
+    def _select_restore_tables(self, entries):
+        """Select tables to restore, all tables or the restore_tables, as table or database.table."""
+        if not self.restore_tables:
+            return entries
+
+        wanted = set(self.restore_tables)
+        selected = []
+        found = set()
+        for entry in entries:
+            names = set([entry['table'], "%s.%s" % (entry['database'], entry['table'])])
+            if wanted & names:
+                selected.append(entry)
+                found |= names
+
+        unknown = wanted - found
+        if unknown:
+            raise RuntimeError("ERROR: Tables not in backup: %s" % ', '.join(sorted(unknown)))
+
+        return selected
+
+    def _restore_database_schema(self, database, entry):
+        """Restoring Schema, empty tables, views, routines and triggers, before the tables are loaded."""
+        backup_class = self.backup_classes[0]
+        backup_path = '/'.join([backup_class.get_backup_database_tables_path(), entry['file']])
+        started = time.time()
+
+        input_file = backup_class.open_download_stream(backup_path)
+        try:
+            bytes_loaded = database.load_stream(DecompressReader(input_file), entry['database'])
+        finally:
+            input_file.close()
+
+        log.print_log("Restored: %s (schema) (%s)" % (entry['database'],
+                                                      utils.throughput_string(bytes_loaded, time.time() - started)))
+
+    def _restore_database_table(self, database, entry):
+        """Restoring Table, streaming its compressed dump into mysql, with bulk load settings."""
+        backup_class = self.backup_classes[0]
+        backup_path = '/'.join([backup_class.get_backup_database_tables_path(), entry['file']])
+        started = time.time()
+
+        input_file = backup_class.open_download_stream(backup_path)
+        try:
+            bytes_loaded = database.load_stream(DecompressReader(input_file), entry['database'], bulk_load=True)
+        finally:
+            input_file.close()
+
+        log.print_log("Restored: %s.%s (%s)" % (entry['database'], entry['table'],
+                                                utils.throughput_string(bytes_loaded, time.time() - started)))
+
+    def _restore_database_tables(self, database):
+        """Restoring Database tables in parallel, largest first. Returns number of failed tables."""
+        manifest = self._load_database_tables_manifest()
+        entries = self._select_restore_tables(manifest['tables'])
+        entries = dict([("%s.%s" % (entry['database'], entry['table']), entry) for entry in entries])
+
+        log.info("Restoring %d of %d table(s), backup created: %s" % (len(entries),
+                                                                     len(manifest['tables']),
+                                                                     manifest['created']))
+
+        # NOTE: The schema recreates every table empty, so it is only restored with all tables
+        schema = manifest.get('schema')
+        if schema and self.restore_tables:
+            log.info("Schema not restored, restoring only: %s" % ', '.join(self.restore_tables))
+            schema = None
+
+        databases_names = set([entry['database'] for entry in entries.values()])
+        if schema:
+            databases_names.add(schema['database'])
+
+        for database_name in sorted(databases_names):
+            if database.run_sql_cmd("CREATE DATABASE IF NOT EXISTS `%s`" % database_name) != 0:
+                raise RuntimeError("ERROR: Failed to create database: %s" % database_name)
+
+        if schema:
+            self._restore_database_schema(database, schema)
+
+        tables = sorted(entries.keys(), key=lambda table: entries[table]['bytes_dumped'], reverse=True)
+
+        pool = workers.WorkerPool(self.database_table_jobs, 'Restoring table')
+        pool.verbose = self.verbose
+        pool.run(lambda table: self._restore_database_table(database, entries[table]), tables)
+
+        return pool.report_failures('restore')
+
     def restore_database(self):
         """Restoring Database."""
         # database_folder = self.config.get('backup_structure', 'database_folder')
@@ -103,20 +792,37 @@ class Backup(object):
         if not self.dry_run:
             path = '.'
 
-            tar = Tar(self.dry_run, self.verbose)
+            backup_format = self._get_database_format()
 
-            log.print_log("Getting File...")
-            for backup_class in self.backup_classes:
-                backup_path = backup_class.get_backup_repo_list_path()
-                backup_class.download_file(backup_path, tar_file)
+            if backup_format == 'tables':
+                log.print_log("Restoring Database Tables...")
+                return self._restore_database_tables(self._new_database())
 
-            chown_cmd = "sudo chown %s:%s %s" % (self.config.get('restore', 'ssh_username'),
-                                                 self.config.get('restore', 'ssh_username'),
-                                                 tar_file)
-            shell.run_shell_cmd(chown_cmd, path, self.verbose)
+            if self.stream_restore_database:
+                log.print_log("Restoring Database, streamed...")
+                return self._restore_database_stream(self._new_database(), backup_format)
 
-            log.print_log("Extracting TAR File...")
-            tar.extract(tar_file)
+            tar = self._new_tar()
+
+            if backup_format == 'dedup':
+                backup_path = self.backup_classes[0].get_backup_database_path()
+                self._extract_dedup(backup_path, path)
+            elif backup_format == 'stream':
+                log.print_log("Getting Database Dump...")
+                self._download_database_stream(database_dump_file)
+            else:
+                log.print_log("Getting File...")
+                for backup_class in self.backup_classes:
+                    backup_path = backup_class.get_backup_database_path()
+                    backup_class.download_file(backup_path, tar_file)
+
+                chown_cmd = "sudo chown %s:%s %s" % (self.config.get('restore', 'ssh_username'),
+                                                     self.config.get('restore', 'ssh_username'),
+                                                     tar_file)
+                shell.run_shell_cmd(chown_cmd, path, self.verbose)
+
+                log.print_log("Extracting TAR File...")
+                tar.extract(tar_file)
 
             chown_cmd = "sudo chown %s:%s %s" % (self.config.get('restore', 'ssh_username'),
                                                  self.config.get('restore', 'ssh_username'),
@@ -125,9 +831,7 @@ class Backup(object):
 
             log.print_log("Restoring Database...")
 
-            database = Database(self.config.get('database', 'database_host'),
-                                self.config.get('database', 'database_username'),
-                                self.config.get('database', 'database_password'))
+            database = self._new_database()
 
             database.run_file_cmd(self.config.get('database', 'database_dump_file'))
 
@@ -135,13 +839,201 @@ class Backup(object):
 
         return 0  # TODO: Error handling
 
+    def _backup_repo_stream(self, repo):
+        """Backing up Repo, streaming TAR to all backup classes."""
+        repo_path = self._get_repo_path(repo)
+        started = time.time()
+
+        backup_paths = []
+        writers = []
+        try:
+            for backup_class in self.backup_classes:
+                backup_path = backup_class.get_backup_repo_path(repo)
+                backup_paths.append(backup_path)
+                writers.append(backup_class.open_upload_stream(backup_path))
+
+            stream = streams.MultiWriter(writers)
+
+            tar = self._new_tar()
+            tar.create_stream(repo_path, stream)
+            stream.close()
+        except Exception:
+            streams.MultiWriter(writers).abort()
+            raise
+
+        log.print_log("Archived: %s (%s)" % (repo, tar.summary()))
+
+        self._record_uploads('repo', repo, backup_paths,
+                             [getattr(writer, 'version_id', None) for writer in writers],
+                             stream.bytes_written, stream.checksum(), started)
+
+        log.print_log("Streamed: %s (%s)" % (repo, utils.human_size(stream.bytes_written)))
+
+    def load_manifests(self):
+        """Load repo manifests from backup classes."""
+        for backup_class, manifest in zip(self.backup_classes, self.manifests):
+            backup_path = backup_class.get_backup_manifest_path()
+            fd, manifest_file = tempfile.mkstemp(suffix='.json')
+            os.close(fd)
+
+            try:
+                backup_class.download_file(backup_path, manifest_file)
+                manifest.load(manifest_file)
+                log.info("Loaded manifest: %s (%d repos)" % (backup_path, len(manifest.repos)))
+            except (RuntimeError, IOError, OSError, ValueError) as err:
+                log.warn("No manifest loaded, all repos will be backed up: %s" % err)
+            finally:
+                if os.path.exists(manifest_file):
+                    os.remove(manifest_file)
+
+    def save_manifests(self):
+        """Save repo manifests to backup classes."""
+        if self.dry_run:
+            return
+
+        for backup_class, manifest in zip(self.backup_classes, self.manifests):
+            backup_path = backup_class.get_backup_manifest_path()
+            fd, manifest_file = tempfile.mkstemp(suffix='.json')
+            os.close(fd)
+
+            try:
+                manifest.save(manifest_file)
+                backup_class.upload_file(backup_path, manifest_file)
+            finally:
+                os.remove(manifest_file)
+
+    def _get_archive_settings(self):
+        """Get settings the repo archives are created with. A change means repos are backed up again."""
+        return {'archive_format': self.archive_format,
+                'dedup': self.dedup,
+                'stream': self.stream,
+                'compression': self.compression}
+
+    def _repo_unchanged(self, repo, fingerprint):
+        """Test if repo is unchanged in all backup classes, and archived with the same settings."""
+        settings = self._get_archive_settings()
+        for manifest in self.manifests:
+            if not manifest.unchanged(repo, fingerprint, settings):
+                return False
+
+        return True
+
     def backup_repo(self, repo):
         """Backing up Repo."""
         repo_path = self._get_repo_path(repo)
 
+        fingerprint = repo_fingerprint(repo_path)
+        if self.verbose:
+            log.verbose("Repo fingerprint: %s %s" % (repo, fingerprint))
+
+        if self.incremental and self._repo_unchanged(repo, fingerprint):
+            log.skipping("Repo '%s' unchanged since last backup" % repo)
+            self.skipped_repos.append(repo)
+            return
+
+        started = time.time()
+        self._backup_repo(repo)
+
+        if not self.dry_run:
+            for catalog in self.catalogs:
+                catalog.record_backup(repo, time.time() - started, self.repo_disk_sizes.get(repo))
+
+        for manifest in self.manifests:
+            manifest.set_fingerprint(repo, fingerprint, self._get_archive_settings())
+
+    def _load_bundle_chain(self, backup_class, repo):
+        """Load repo bundle chain from backup class."""
+        chain = BundleChain()
+
+        backup_path = backup_class.get_backup_repo_bundle_path(repo, 'chain.json')
+        fd, chain_file = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+
+        try:
+            backup_class.download_file(backup_path, chain_file)
+            chain.load(chain_file)
+        except (RuntimeError, IOError, OSError, ValueError) as err:
+            log.warn("No bundle chain loaded for repo '%s': %s" % (repo, err))
+        finally:
+            os.remove(chain_file)
+
+        return chain
+
+    def _backup_repo_bundle(self, repo):
+        """Backing up Repo as full or incremental git bundle."""
+        repo_path = self._get_repo_path(repo)
+        bundle = Bundle(self.dry_run, self.verbose)
+
+        chains = [self._load_bundle_chain(backup_class, repo) for backup_class in self.backup_classes]
+        chain = chains[0]
+
+        # NOTE: A full bundle is also needed if backup classes are out of step
+        full = chain.needs_full(self.full_bundle_interval) or \
+            any([other_chain != chain for other_chain in chains[1:]])
+
+        refs = bundle.get_refs(repo_path)
+        head = bundle.get_head(repo_path)
+
+        if not full and refs == chain.refs:
+            log.skipping("Repo '%s' has no new refs since last bundle" % repo)
+            return
+
+        bundle_type = 'incremental'
+        prerequisite_refs = chain.refs
+        if full:
+            bundle_type = 'full'
+            prerequisite_refs = None
+
+        temp_path = tempfile.mkdtemp()
+        try:
+            bundle_file = os.path.join(temp_path, 'repo.bundle')
+            has_bundle = bundle.create(repo_path, bundle_file, prerequisite_refs)
+            filename = chain.add(bundle_type, refs, head, has_bundle)
+
+            chain_file = os.path.join(temp_path, 'chain.json')
+            chain.save(chain_file)
+
+            bundle_size = 0
+            if has_bundle:
+                bundle_size = os.stat(bundle_file).st_size
+
+            log.print_log("Bundle: %s (%s, %s)" % (repo, bundle_type, utils.human_size(bundle_size)))
+
+            if filename:
+                self._upload_file('bundle', repo,
+                                  lambda backup_class: backup_class.get_backup_repo_bundle_path(repo, filename),
+                                  bundle_file)
+
+            for backup_class in self.backup_classes:
+                backup_path = backup_class.get_backup_repo_bundle_path(repo, 'chain.json')
+                backup_class.upload_file(backup_path, chain_file)
+        finally:
+            shutil.rmtree(temp_path)
+
+    def _backup_repo(self, repo):
+        """Backing up Repo archive."""
+        repo_path = self._get_repo_path(repo)
+
+        if self.archive_format == 'bundle':
+            if not self.dry_run:
+                self._backup_repo_bundle(repo)
+            return
+
+        if self.dedup:
+            if not self.dry_run:
+                self._create_dedup('repo', repo, repo_path,
+                                   lambda backup_class: backup_class.get_backup_repo_path(repo))
+            return
+
+        if self.stream:
+            if not self.dry_run:
+                self._backup_repo_stream(repo)
+            return
+
         if not self.dry_run:
-            tar = Tar(self.dry_run, self.verbose)
+            tar = self._new_tar()
             tar_file_path = tar.create(repo_path)
+            log.print_log("Archived: %s (%s)" % (repo, tar.summary()))
 
             # repos_folder = os.path.join(self.config.get('backup_structure', 'repos_folder'), os.path.dirname(repo))
 
@@ -149,9 +1041,9 @@ class Backup(object):
             #                         repos_folder.strip('/'),
             #                         os.path.basename(tar_file_path)])
 
-            for backup_class in self.backup_classes:
-                backup_path = backup_class.get_backup_repo_path(repo)
-                backup_class.upload_file(backup_path, tar_file_path)
+            self._upload_file('repo', repo,
+                              lambda backup_class: backup_class.get_backup_repo_path(repo),
+                              tar_file_path)
 
             if os.path.exists(tar_file_path):
                 os.remove(os.path.abspath(tar_file_path))
@@ -166,52 +1058,178 @@ class Backup(object):
         repo_list_file = os.path.join(script_path, repo_list_filename)
 
         if not self.dry_run:
-            for backup_class in self.backup_classes:
-                backup_path = backup_class.get_backup_repo_list_path()
-                backup_class.upload_file(backup_path, repo_list_file)
+            self._upload_file('repo_list', repo_list_filename,
+                              lambda backup_class: backup_class.get_backup_repo_list_path(),
+                              repo_list_file)
+
+    def _get_repo_owner(self):
+        """Get (uid, gid) of gerrit user and group. None if ownership can not be set."""
+        username = self.config.get('gerrit', 'gerrit_username')
+        group = self.config.get('gerrit', 'gerrit_group')
+
+        try:
+            uid = pwd.getpwnam(username).pw_uid
+            gid = grp.getgrnam(group).gr_gid
+        except KeyError:
+            raise RuntimeError("ERROR: Gerrit user or group not found: %s:%s" % (username, group))
+
+        if os.geteuid() != 0 and uid != os.geteuid():
+            log.warn("Not running as root, ownership not set: %s:%s" % (username, group))
+            return None
+
+        return (uid, gid)
+
+    def _make_repo_folder(self, path, owner=None):
+        """Make folder, and its missing parents, owned by owner (uid, gid)."""
+        missing = []
+        parent = path
+        while parent and not os.path.exists(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+
+        try:
+            os.makedirs(path)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+        if owner:
+            for folder in missing:
+                os.chown(folder, owner[0], owner[1])
+
+    def _chown_repo(self, repo_path, owner):
+        """Set owner (uid, gid) of all files in repo."""
+        os.chown(repo_path, owner[0], owner[1])
+        for root, dirnames, filenames in os.walk(repo_path):
+            for name in dirnames + filenames:
+                os.lchown(os.path.join(root, name), owner[0], owner[1])
+
+    def _restore_repo_bundle(self, repo):
+        """Restoring Repo by replaying its bundle chain."""
+        repo_path = self._get_repo_path(repo)
+        bundle = Bundle(self.dry_run, self.verbose)
+
+        backup_class = self.backup_classes[0]
+        chain = self._load_bundle_chain(backup_class, repo)
+        if len(chain.bundles) == 0:
+            raise RuntimeError("ERROR: No bundle chain found for repo: %s" % repo)
+
+        if os.path.exists(repo_path):
+            log.print_log("Deleting Pervious Repo: %s" % repo_path)
+            shutil.rmtree(repo_path)
+
+        owner = self._get_repo_owner()
+        self._make_repo_folder(os.path.dirname(repo_path), owner)
+
+        bundle.init_repo(repo_path)
+
+        temp_path = tempfile.mkdtemp()
+        try:
+            for bundle_entry in chain.bundles:
+                if not bundle_entry['filename']:
+                    continue
+
+                log.print_log("Applying %s bundle: %s" % (bundle_entry['type'], bundle_entry['filename']))
+
+                bundle_file = os.path.join(temp_path, bundle_entry['filename'])
+                backup_path = backup_class.get_backup_repo_bundle_path(repo, bundle_entry['filename'])
+                backup_class.download_file(backup_path, bundle_file)
+
+                bundle.fetch(repo_path, bundle_file)
+                os.remove(bundle_file)
+        finally:
+            shutil.rmtree(temp_path)
+
+        bundle.set_refs(repo_path, chain.refs, chain.head)
+
+        if owner:
+            self._chown_repo(repo_path, owner)
+
+    def _restore_repo_download(self, repo):
+        """Restore stage: Download repo TAR file, next to where it is extracted."""
+        job = {'repo': repo, 'format': None, 'tar_file_path': None, 'owner': None}
+
+        if self.dry_run:
+            return job
+
+        job['format'] = self._get_repo_format(repo)
+        if job['format'] == 'bundle':
+            return job
 
-    def restore_repo(self, repo):
-        """Restoring Repo."""
         repo_path = os.path.dirname(self._get_repo_path(repo))
 
-        tar_ext = '.git.tar.gz'
-        repo_name = os.path.basename(repo)
-        tar_filename = repo_name + tar_ext
-        tar_file_path = os.path.join(repo_path, tar_filename)
+        job['owner'] = self._get_repo_owner()
+        self._make_repo_folder(repo_path, job['owner'])
 
-        tar_extracted_path = os.path.join(repo_path, repo_name) + '.git'
+        if job['format'] == 'dedup':
+            return job
 
-        path = '.'
+        tar_file_path = os.path.join(repo_path, os.path.basename(repo) + '.git.tar.gz')
 
-        if not self.dry_run:
+        log.print_log("Downloading File: %s" % repo)
+
+        backup_class = self.backup_classes[0]
+        try:
+            backup_class.download_file(backup_class.get_backup_repo_path(repo), tar_file_path)
+        except Exception:
+            if os.path.exists(tar_file_path):
+                os.remove(tar_file_path)
+            raise
+
+        job['tar_file_path'] = tar_file_path
+        return job
+
+    def _restore_repo_extract(self, job):
+        """Restore stage: Replace repo with the extracted TAR file, owned by the gerrit user."""
+        repo = job['repo']
+
+        if self.dry_run:
+            return job
+
+        if job['format'] == 'bundle':
+            self._restore_repo_bundle(repo)
+            return job
+
+        repo_path = os.path.dirname(self._get_repo_path(repo))
+        tar_extracted_path = self._get_repo_path(repo)
+
+        try:
             if os.path.exists(tar_extracted_path):
+                log.print_log("Deleting Pervious Repo: %s" % tar_extracted_path)
                 shutil.rmtree(tar_extracted_path)
 
-            if not os.path.exists(tar_extracted_path):
-                log.print_log("Deleting Pervious Repo: %s" % tar_extracted_path)
-                os.makedirs(tar_extracted_path)
-                os.rmdir(tar_extracted_path)
+            if job['format'] == 'dedup':
+                backup_path = self.backup_classes[0].get_backup_repo_path(repo)
+                self._extract_dedup(backup_path, repo_path, job['owner'])
+            else:
+                log.print_log("Extracting TAR File: %s" % repo)
 
-            log.print_log("Downloading File...")
+                tar = self._new_tar()
+                with open(job['tar_file_path'], 'rb') as tar_file:
+                    tar.extract_stream(tar_file, repo_path, job['owner'])
+        finally:
+            if job['tar_file_path'] and os.path.exists(job['tar_file_path']):
+                os.remove(os.path.abspath(job['tar_file_path']))
 
-            for backup_class in self.backup_classes:
-                backup_path = backup_class.get_backup_repo_path(repo)
-                backup_class.download_file(backup_path, tar_file_path)
+        return job
 
-            chown_cmd = "sudo chown %s:%s %s" % (self.config.get('gerrit', 'gerrit_username'),
-                                                 self.config.get('gerrit', 'gerrit_group'),
-                                                 tar_file_path)
-            shell.run_shell_cmd(chown_cmd, path, self.verbose)
+    def restore_repo(self, repo):
+        """Restoring Repo."""
+        job = self._restore_repo_download(repo)
+        self._restore_repo_extract(job)
 
-            log.print_log("Extracting TAR File...")
+    def restore_repos(self, repos, jobs=1, prefetch=2):
+        """Restoring Repos, downloading and extracting concurrently.
 
-            tar = Tar(self.dry_run, self.verbose)
-            tar.extract(tar_file_path)
+        Up to prefetch TAR files are downloaded ahead of the repos being extracted.
+        Returns the number of repos that failed.
+        """
+        pipeline = workers.Pipeline("Restoring Repos", prefetch)
+        pipeline.verbose = self.verbose
+        pipeline.add_stage("Downloading", self._restore_repo_download, jobs)
+        pipeline.add_stage("Extracting", self._restore_repo_extract, jobs)
 
-            chown_cmd = "sudo chown -R %s:%s %s" % (self.config.get('gerrit', 'gerrit_username'),
-                                                    self.config.get('gerrit', 'gerrit_group'),
-                                                    repo_path)
-            shell.run_shell_cmd(chown_cmd, path, self.verbose)
+        log.info("Restore Jobs: %d, Prefetch: %d" % (jobs, prefetch))
 
-            if os.path.exists(tar_file_path):
-                os.remove(os.path.abspath(tar_file_path))
+        pipeline.run(repos)
+        return pipeline.report_failures('restore')
@@ -1,10 +1,12 @@
 
 """Gerrit Backup Folder."""
 
+import errno
 import os
 import shutil
 
 import log
+import streams
 
 
 class BackupFolder(object):
@@ -38,6 +40,14 @@ class BackupFolder(object):
         backup_path += '.tar.gz'
         return backup_path
 
+    def get_backup_database_stream_path(self):
+        """Get streamed Database dump backup path. Named .gz, whatever the compression."""
+        return self.get_backup_database_path()[:-len('.tar.gz')] + '.gz'
+
+    def get_backup_database_tables_path(self):
+        """Get Database table dumps backup path."""
+        return self.get_backup_database_path()[:-len('.tar.gz')] + '.tables'
+
     # TODO: Versioning
     def get_backup_repo_path(self, repo):
         """Get Repo backup path."""
@@ -48,6 +58,35 @@ class BackupFolder(object):
         backup_path += '.git.tar.gz'
         return backup_path
 
+    def get_backup_repo_bundle_path(self, repo, filename):
+        """Get Repo bundle backup path."""
+        repos_folder = self.config.get('backup_structure', 'repos_folder')
+        return '/'.join([self.config.get('backup', 'ssh_hostname'),
+                         repos_folder.strip('/'),
+                         repo + '.git.bundles',
+                         filename])
+
+    def get_backup_chunks_path(self):
+        """Get dedup chunks backup path."""
+        return '/'.join([self.config.get('backup', 'ssh_hostname'), 'chunks'])
+
+    def get_backup_chunk_path(self, chunk_id):
+        """Get dedup chunk backup path."""
+        return '/'.join([self.get_backup_chunks_path(), chunk_id[:2], chunk_id])
+
+    def get_backup_manifest_path(self):
+        """Get Repo Manifest backup path."""
+        repos_folder = self.config.get('backup_structure', 'repos_folder')
+
+        return '/'.join([self.config.get('backup', 'ssh_hostname'),
+                         repos_folder.strip('/'),
+                         'manifest.json'])
+
+    def get_backup_catalog_path(self):
+        """Get Catalog backup path."""
+        return '/'.join([self.config.get('backup', 'ssh_hostname'),
+                         'catalog.sqlite'])
+
     # TODO: Versioning
     def get_backup_repo_list_path(self):
         """Get Repo List backup path."""
@@ -65,19 +104,70 @@ class BackupFolder(object):
         log.todo("Implement: %s" % full_path)
         return ['0']
 
-    def upload_file(self, trg_file, src_file):
-        """Upload file from folder."""
-        backup_file = self._get_back_file_path(trg_file)
+    def get_versions_index(self):
+        """Get index of backup path to versions. Not supported, use get_all_versions."""
+        return None
+
+    def _make_backup_folder(self, backup_file):
+        """Make backup folder for file."""
         backup_folder = os.path.dirname(backup_file)
 
         if not os.path.exists(backup_folder):
-            os.makedirs(backup_folder)
+            try:
+                os.makedirs(backup_folder)
+            except OSError as err:
+                # NOTE: Parallel backup jobs may create the same folder
+                if err.errno != errno.EEXIST:
+                    raise
+
+    def list_files(self, trg_path):
+        """List files in folder."""
+        backup_path = self._get_back_file_path(trg_path)
+
+        for root, _, filenames in os.walk(backup_path):
+            for filename in filenames:
+                file_path = os.path.join(root, filename)
+                yield '/'.join([trg_path.rstrip('/'),
+                                os.path.relpath(file_path, backup_path).replace(os.sep, '/')])
+
+    def file_exists(self, trg_file):
+        """Test if file exists in folder."""
+        return os.path.isfile(self._get_back_file_path(trg_file))
+
+    def upload_data(self, trg_file, data):
+        """Upload data to folder."""
+        backup_file = self._get_back_file_path(trg_file)
+        self._make_backup_folder(backup_file)
+
+        if self.verbose:
+            log.verbose("Uploading data to: %s" % backup_file)
+
+        writer = streams.AtomicFileWriter(backup_file)
+        writer.write(data)
+        writer.close()
+
+    def open_download_stream(self, trg_file):
+        """Open download stream from folder."""
+        return open(self._get_back_file_path(trg_file), 'rb')
+
+    def upload_file(self, trg_file, src_file):
+        """Upload file from folder."""
+        backup_file = self._get_back_file_path(trg_file)
+        self._make_backup_folder(backup_file)
 
         log.print_log("Uploading file: -")
         log.print_log("  From: %s" % src_file)
         log.print_log("  To: %s" % backup_file)
         shutil.copy(src_file, backup_file)
 
+    def open_upload_stream(self, trg_file):
+        """Open upload stream to folder."""
+        backup_file = self._get_back_file_path(trg_file)
+        self._make_backup_folder(backup_file)
+
+        log.print_log("Streaming to file: %s" % backup_file)
+        return streams.AtomicFileWriter(backup_file)
+
     def download_file(self, trg_file, src_file):
         """Download file from folder."""
         backup_file = self._get_back_file_path(trg_file)
@@ -32,6 +32,14 @@ class BackupS3(object):
         backup_path += '.tar.gz'
         return backup_path
 
+    def get_backup_database_stream_path(self):
+        """Get streamed Database dump backup path. Named .gz, whatever the compression."""
+        return self.get_backup_database_path()[:-len('.tar.gz')] + '.gz'
+
+    def get_backup_database_tables_path(self):
+        """Get Database table dumps backup path."""
+        return self.get_backup_database_path()[:-len('.tar.gz')] + '.tables'
+
     def get_backup_repo_path(self, repo):
         """Get Repo backup path."""
         repos_folder = self.config.get('backup_structure', 'repos_folder')
@@ -41,6 +49,35 @@ class BackupS3(object):
         backup_path += '.git.tar.gz'
         return backup_path
 
+    def get_backup_repo_bundle_path(self, repo, filename):
+        """Get Repo bundle backup path."""
+        repos_folder = self.config.get('backup_structure', 'repos_folder')
+        return '/'.join([self.config.get('backup', 'ssh_hostname'),
+                         repos_folder.strip('/'),
+                         repo + '.git.bundles',
+                         filename])
+
+    def get_backup_chunks_path(self):
+        """Get dedup chunks backup path."""
+        return '/'.join([self.config.get('backup', 'ssh_hostname'), 'chunks'])
+
+    def get_backup_chunk_path(self, chunk_id):
+        """Get dedup chunk backup path."""
+        return '/'.join([self.get_backup_chunks_path(), chunk_id[:2], chunk_id])
+
+    def get_backup_manifest_path(self):
+        """Get Repo Manifest backup path."""
+        repos_folder = self.config.get('backup_structure', 'repos_folder')
+
+        return '/'.join([self.config.get('backup', 'ssh_hostname'),
+                         repos_folder.strip('/'),
+                         'manifest.json'])
+
+    def get_backup_catalog_path(self):
+        """Get Catalog backup path."""
+        return '/'.join([self.config.get('backup', 'ssh_hostname'),
+                         'catalog.sqlite'])
+
     def get_backup_repo_list_path(self):
         """Get Repo List backup path."""
         repos_list_folder = self.config.get('backup_structure', 'repos_list_folder')
@@ -56,10 +93,45 @@ class BackupS3(object):
         bucket_versions = self.s3.get_key_versions(full_path)
         return bucket_versions
 
+    def get_versions_index(self):
+        """Get index of backup path to versions, for all repos."""
+        repos_folder = self.config.get('backup_structure', 'repos_folder')
+        prefix = '/'.join([self.config.get('backup', 'ssh_hostname'),
+                           repos_folder.strip('/')]) + '/'
+
+        log.info("Listing versions: %s" % prefix)
+        index = self.s3.get_versions_index(prefix)
+        log.info("Indexed versions of %d keys" % len(index))
+
+        return index
+
+    def list_files(self, full_path):
+        """List files in S3 with path prefix."""
+        return self.s3.list_keys(full_path.rstrip('/') + '/')
+
+    def file_exists(self, full_path):
+        """Test if file exists in S3."""
+        return self.s3.key_exists(full_path)
+
+    def upload_data(self, full_path, data):
+        """Upload data to S3."""
+        if self.verbose:
+            log.verbose("Uploading data to S3: %s" % full_path)
+        return self.s3.upload_data(full_path, data)
+
+    def open_download_stream(self, full_path):
+        """Open download stream from S3."""
+        return self.s3.open_download_stream(full_path)
+
     def upload_file(self, full_path, filename):
         """Upload file to S3."""
         log.print_log("Uploading file to S3")
-        self.s3.upload_file(full_path, filename)
+        return self.s3.upload_file(full_path, filename)
+
+    def open_upload_stream(self, full_path):
+        """Open upload stream to S3."""
+        log.print_log("Streaming file to S3")
+        return self.s3.open_upload_stream(full_path)
 
     def download_file(self, full_path, filename):
         """Download file from S3."""
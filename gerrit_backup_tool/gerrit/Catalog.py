@@ -0,0 +1,196 @@
+
+"""Gerrit Backup Catalog."""
+
+import socket
+import sqlite3
+import threading
+import uuid
+
+from datetime import datetime
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS runs (
+           run_id TEXT PRIMARY KEY,
+           hostname TEXT,
+           started TEXT,
+           finished TEXT,
+           status TEXT)""",
+    """CREATE TABLE IF NOT EXISTS uploads (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           run_id TEXT NOT NULL,
+           kind TEXT NOT NULL,
+           name TEXT NOT NULL,
+           backup_path TEXT NOT NULL,
+           version_id TEXT,
+           size INTEGER,
+           checksum TEXT,
+           duration REAL,
+           time TEXT NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS backups (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           run_id TEXT NOT NULL,
+           name TEXT NOT NULL,
+           duration REAL,
+           disk_size INTEGER,
+           time TEXT NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS uploads_kind_name ON uploads (kind, name)",
+    "CREATE INDEX IF NOT EXISTS uploads_backup_path ON uploads (backup_path)",
+    "CREATE INDEX IF NOT EXISTS uploads_run_id ON uploads (run_id)",
+    "CREATE INDEX IF NOT EXISTS backups_name ON backups (name)"
+]
+
+
+def _now():
+    """Get UTC time string."""
+    return datetime.utcnow().replace(microsecond=0).isoformat()
+
+
+def new_run_id():
+    """Get new run id."""
+    return "%s-%s" % (datetime.utcnow().strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+
+
+class Catalog(object):
+    """Backup Catalog of uploads, in a SQLite database."""
+
+    def __init__(self):
+        """Init."""
+        super(Catalog, self).__init__()
+        self.db_file = None
+        self.run_id = None
+        self.upload_count = 0
+
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Test if catalog is open."""
+        return self._conn is not None
+
+    def open(self, db_file):
+        """Open catalog database, creating tables if needed."""
+        self.db_file = db_file
+
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+
+        with self._lock:
+            for sql in SCHEMA:
+                self._conn.execute(sql)
+            self._conn.commit()
+
+    def close(self):
+        """Close catalog database. Uncommitted changes are discarded."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def start_run(self, run_id, hostname=None):
+        """Start run."""
+        self.run_id = run_id
+
+        with self._lock:
+            self._conn.execute("INSERT INTO runs (run_id, hostname, started) VALUES (?, ?, ?)",
+                               (run_id, hostname or socket.getfqdn(), _now()))
+
+    def finish_run(self, status):
+        """Finish run, and commit."""
+        with self._lock:
+            self._conn.execute("UPDATE runs SET finished = ?, status = ? WHERE run_id = ?",
+                               (_now(), status, self.run_id))
+            self._conn.commit()
+
+    def record(self, kind, name, backup_path, version_id=None, size=None, checksum=None, duration=None):
+        """Record upload. Ignored if catalog is not open."""
+        if self._conn is None:
+            return
+
+        with self._lock:
+            self._conn.execute("INSERT INTO uploads (run_id, kind, name, backup_path, version_id, "
+                               "size, checksum, duration, time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (self.run_id, kind, name, backup_path, version_id,
+                                size, checksum, duration, _now()))
+            self.upload_count += 1
+
+    def record_backup(self, name, duration, disk_size=None):
+        """Record whole backup of repo, its duration and size on disk. Ignored if catalog is not open."""
+        if self._conn is None:
+            return
+
+        with self._lock:
+            self._conn.execute("INSERT INTO backups (run_id, name, duration, disk_size, time) VALUES (?, ?, ?, ?, ?)",
+                               (self.run_id, name, duration, disk_size, _now()))
+
+    def get_latest_backup(self, name):
+        """Get latest whole backup of repo. Returns None if not found."""
+        if self._conn is None:
+            return None
+
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM backups WHERE name = ? ORDER BY id DESC LIMIT 1",
+                                     (name,)).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(row)
+
+    def has_uploads(self):
+        """Test if catalog has any uploads."""
+        if self._conn is None:
+            return False
+
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM uploads LIMIT 1").fetchone() is not None
+
+    def get_versions(self, kinds, name):
+        """Get uploads of any of kinds and name, newest first."""
+        sql = "SELECT * FROM uploads WHERE kind IN (%s) AND name = ? ORDER BY id DESC" % \
+            ', '.join(['?'] * len(kinds))
+
+        with self._lock:
+            rows = self._conn.execute(sql, list(kinds) + [name]).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def get_latest(self, kind, name):
+        """Get latest upload of kind and name. Returns None if not found."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM uploads WHERE kind = ? AND name = ? "
+                                     "ORDER BY id DESC LIMIT 1", (kind, name)).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(row)
+
+    def get_latest_upload(self, backup_paths, folder_paths=()):
+        """Get latest upload to any of backup_paths, or under any of folder_paths. Returns None if not found."""
+        clauses = ['backup_path = ?'] * len(backup_paths) + ['substr(backup_path, 1, ?) = ?'] * len(folder_paths)
+        params = list(backup_paths)
+        for folder_path in folder_paths:
+            folder_path = folder_path.rstrip('/') + '/'
+            params += [len(folder_path), folder_path]
+
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM uploads WHERE %s ORDER BY id DESC LIMIT 1" %
+                                     ' OR '.join(clauses), params).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(row)
+
+    def estimate(self, kind, names):
+        """Estimate size of latest uploads of names. Returns (size, names not found)."""
+        total_size = 0
+        missing = []
+
+        for name in names:
+            upload = self.get_latest(kind, name)
+            if upload is None:
+                missing.append(name)
+            else:
+                total_size += upload['size'] or 0
+
+        return total_size, missing
@@ -0,0 +1,203 @@
+
+"""Gerrit Repo Disk Usage."""
+
+import csv
+import json
+import os
+import stat
+import threading
+
+import utils
+
+CATEGORIES = ['packs', 'loose', 'refs', 'other']
+
+CACHE_VERSION = 2
+
+CSV_FIELDS = ['repo', 'bytes', 'files'] + ['%s_%s' % (category, field)
+                                           for category in CATEGORIES
+                                           for field in ['files', 'bytes']]
+
+
+def get_category(rel_path):
+    """Get category of file, by its path relative to the repo."""
+    parts = rel_path.split(os.sep)
+
+    if parts[0] == 'objects' and len(parts) == 3:
+        if parts[1] == 'pack':
+            return 'packs'
+        if len(parts[1]) == 2:
+            return 'loose'
+    elif parts[0] == 'refs' or rel_path == 'packed-refs':
+        return 'refs'
+
+    return 'other'
+
+
+def is_immutable_dir(rel_path):
+    """Test if the files of directory, by its path relative to the repo, are never changed in place.
+
+    Packs and loose objects are only added and removed, logs/, config, FETCH_HEAD etc. are rewritten in place.
+    """
+    parts = rel_path.split(os.sep)
+
+    return len(parts) == 2 and parts[0] == 'objects' and (parts[1] == 'pack' or len(parts[1]) == 2)
+
+
+def new_usage():
+    """Get empty usage."""
+    usage = {'bytes': 0, 'files': 0}
+    for category in CATEGORIES:
+        usage['%s_files' % category] = 0
+        usage['%s_bytes' % category] = 0
+
+    return usage
+
+
+def add_usage(usage, other):
+    """Add other usage to usage."""
+    for key, value in other.items():
+        usage[key] = usage.get(key, 0) + value
+
+
+def add_file_usage(usage, category, size):
+    """Add file of category and size to usage."""
+    usage['bytes'] += size
+    usage['files'] += 1
+    usage['%s_bytes' % category] += size
+    usage['%s_files' % category] += 1
+
+
+def usage_summary(usage):
+    """Usage summary string."""
+    return "%s, %d files (packs: %d, %s; loose: %d, %s; refs: %d)" % (
+        utils.human_size(usage['bytes']), usage['files'],
+        usage['packs_files'], utils.human_size(usage['packs_bytes']),
+        usage['loose_files'], utils.human_size(usage['loose_bytes']),
+        usage['refs_files'])
+
+
+class DiskUsage(object):
+    """Disk usage of repos, scanned in-process.
+
+    The listing of each directory is cached by the directory's mtime, so a repeated scan
+    only lists directories that have changed. Files changed in place do not change the mtime:
+    the usage of object and pack directories is cached, their files are never changed in place,
+    the files of all other directories are stat'ed on every scan.
+    """
+
+    def __init__(self):
+        """Init."""
+        super(DiskUsage, self).__init__()
+        self.directories = {}
+
+        self.scanned_dirs = 0
+        self.cached_dirs = 0
+
+        self._lock = threading.Lock()
+        self._visited = set()
+        self._repo_paths = set()
+
+    def load(self, cache_file):
+        """Load cache file."""
+        with open(cache_file, 'r') as input_file:
+            data = json.load(input_file)
+
+        if data.get('version') != CACHE_VERSION:
+            return
+
+        with self._lock:
+            self.directories = data.get('directories', {})
+
+    def save(self, cache_file):
+        """Save cache file. Directories no longer in scanned repos are dropped."""
+        with self._lock:
+            directories = {}
+            for path, entry in self.directories.items():
+                if path in self._visited or not self._in_scanned_repo(path):
+                    directories[path] = entry
+
+            data = {'version': CACHE_VERSION, 'directories': directories}
+
+        with open(cache_file, 'w') as output_file:
+            json.dump(data, output_file, sort_keys=True)
+
+    def _in_scanned_repo(self, path):
+        """Test if path is in a scanned repo."""
+        for repo_path in self._repo_paths:
+            if path == repo_path or path.startswith(repo_path + os.sep):
+                return True
+
+        return False
+
+    def scan_repo(self, repo_path):
+        """Scan repo, returning its usage."""
+        repo_path = os.path.abspath(repo_path)
+        with self._lock:
+            self._repo_paths.add(repo_path)
+
+        if not os.path.isdir(repo_path):
+            raise RuntimeError("ERROR: Repo not found: %s" % repo_path)
+
+        usage = new_usage()
+        self._scan_dir(repo_path, repo_path, usage)
+
+        return usage
+
+    def _scan_dir(self, repo_path, path, usage):
+        """Scan directory, adding the usage of its files and sub directories to usage."""
+        mtime = os.lstat(path).st_mtime
+
+        with self._lock:
+            self._visited.add(path)
+            entry = self.directories.get(path)
+
+        if entry is not None and entry['mtime'] == mtime:
+            with self._lock:
+                self.cached_dirs += 1
+        else:
+            immutable = is_immutable_dir(os.path.relpath(path, repo_path))
+            entry = {'mtime': mtime, 'dirs': [], 'files': [], 'usage': new_usage()}
+
+            for name in os.listdir(path):
+                file_path = os.path.join(path, name)
+                try:
+                    file_stat = os.lstat(file_path)
+                except OSError:
+                    continue
+
+                if stat.S_ISDIR(file_stat.st_mode):
+                    entry['dirs'].append(name)
+                elif immutable:
+                    add_file_usage(entry['usage'], get_category(os.path.relpath(file_path, repo_path)),
+                                   file_stat.st_size)
+                else:
+                    entry['files'].append(name)
+
+            with self._lock:
+                self.directories[path] = entry
+                self.scanned_dirs += 1
+
+        add_usage(usage, entry['usage'])
+
+        for name in entry['files']:
+            file_path = os.path.join(path, name)
+            try:
+                file_stat = os.lstat(file_path)
+            except OSError:
+                continue
+
+            add_file_usage(usage, get_category(os.path.relpath(file_path, repo_path)), file_stat.st_size)
+
+        for name in entry['dirs']:
+            dir_path = os.path.join(path, name)
+            if os.path.isdir(dir_path):
+                self._scan_dir(repo_path, dir_path, usage)
+
+
+def save_csv(csv_file, usages):
+    """Save usages, a list of (repo, usage), as CSV."""
+    with open(csv_file, 'wb') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(CSV_FIELDS)
+        for repo, usage in usages:
+            writer.writerow([repo] + [usage[field] for field in CSV_FIELDS[1:]])
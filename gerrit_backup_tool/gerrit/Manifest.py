@@ -0,0 +1,86 @@
+
+"""Gerrit Backup Manifest."""
+
+import hashlib
+import json
+import os
+import threading
+
+from datetime import datetime
+
+
+def repo_fingerprint(repo_path):
+    """Get fingerprint of repo refs and packs."""
+    sha = hashlib.sha1()
+
+    for filename in ['HEAD', 'config', 'packed-refs']:
+        file_path = os.path.join(repo_path, filename)
+        if os.path.isfile(file_path):
+            sha.update(filename + '\0')
+            with open(file_path, 'rb') as ref_file:
+                sha.update(ref_file.read())
+
+    refs_path = os.path.join(repo_path, 'refs')
+    for root, dirnames, filenames in os.walk(refs_path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            sha.update(os.path.relpath(file_path, repo_path) + '\0')
+            with open(file_path, 'rb') as ref_file:
+                sha.update(ref_file.read())
+
+    pack_path = os.path.join(repo_path, 'objects', 'pack')
+    if os.path.isdir(pack_path):
+        for filename in sorted(os.listdir(pack_path)):
+            if filename.endswith('.pack'):
+                sha.update(filename + '\0')
+
+    return sha.hexdigest()
+
+
+class Manifest(object):
+    """Backup Manifest of repo fingerprints."""
+
+    def __init__(self):
+        """Init."""
+        super(Manifest, self).__init__()
+        self.repos = {}
+
+        self._lock = threading.Lock()
+
+    def load(self, manifest_file):
+        """Load manifest file."""
+        with open(manifest_file, 'r') as input_file:
+            data = json.load(input_file)
+
+        with self._lock:
+            self.repos = data.get('repos', {})
+
+    def save(self, manifest_file):
+        """Save manifest file."""
+        with self._lock:
+            data = {'version': 1, 'repos': self.repos}
+
+            with open(manifest_file, 'w') as output_file:
+                json.dump(data, output_file, indent=2, sort_keys=True)
+
+    def get_fingerprint(self, repo):
+        """Get repo fingerprint."""
+        with self._lock:
+            return self.repos.get(repo, {}).get('fingerprint')
+
+    def set_fingerprint(self, repo, fingerprint, settings=None):
+        """Set repo fingerprint, and the archive settings it was backed up with."""
+        with self._lock:
+            self.repos[repo] = {
+                'fingerprint': fingerprint,
+                'settings': settings,
+                'time': datetime.utcnow().replace(microsecond=0).isoformat()
+            }
+
+    def unchanged(self, repo, fingerprint, settings=None):
+        """Test if repo is unchanged, and was backed up with the same archive settings."""
+        with self._lock:
+            entry = self.repos.get(repo, {})
+
+        return entry.get('fingerprint') == fingerprint and entry.get('settings') == settings
@@ -10,30 +10,145 @@ This script does the following : -
 """
 
 import argparse
+import json
 import sys
 import os
+import time
 
 from imp import reload
 
 import repoList
 import utils
 import tasks
+import workers
 import log
 
-from aws.S3 import S3
+from aws.S3 import S3, MB
 
 from gerrit.Backup import Backup
 from gerrit.BackupS3 import BackupS3
 from gerrit.BackupFolder import BackupFolder
+from dedup.Chunker import KB
+from tar.Compression import get_codec
 
 reload(sys)
 sys.setdefaultencoding('utf-8')
 
 
+def _get_jobs(config, args):
+    """Get number of parallel jobs."""
+    if args.jobs:
+        return args.jobs
+
+    if config.has_option('backup', 'jobs'):
+        return config.getint('backup', 'jobs')
+
+    return 1
+
+
+def _get_schedule(config):
+    """Get repo backup schedule, size (largest first) or none."""
+    schedule = 'size'
+    if config.has_option('backup', 'schedule'):
+        schedule = config.get('backup', 'schedule').strip().lower()
+
+    if schedule not in ['size', 'none']:
+        raise RuntimeError("ERROR: Unknown schedule: %s (size|none)" % schedule)
+
+    return schedule
+
+
+def _get_priority_repos(config):
+    """Get repos backed up first, whatever their size."""
+    if not config.has_option('backup', 'priority_repos'):
+        return []
+
+    return [repo.strip() for repo in config.get('backup', 'priority_repos').split(',') if repo.strip()]
+
+
+def _get_compression(config):
+    """Get archive compression codec name."""
+    if config.has_option('backup', 'compression'):
+        return config.get('backup', 'compression')
+
+    return 'gzip'
+
+
+def _get_prefetch(config):
+    """Get number of repo TAR files to download ahead of extraction."""
+    if config.has_option('restore', 'prefetch'):
+        return config.getint('restore', 'prefetch')
+
+    return 2
+
+
+def _get_diskusage_cache_file(config):
+    """Get disk usage cache file, next to the script."""
+    cache_filename = 'diskusage_cache.json'
+    if config.has_option('script', 'diskusage_cache_filename'):
+        cache_filename = config.get('script', 'diskusage_cache_filename')
+
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(script_path, cache_filename)
+
+
+def _get_dedup_index_file(backup_class):
+    """Get local index file of the dedup chunks of backup class, next to the script."""
+    index_filename = 'dedup_index_%s.json' % backup_class.__class__.__name__
+
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(script_path, index_filename)
+
+
+def _discover_repos(config, args, repo_list_file):
+    """Discover repos in gerrit_path/git, diffing them against the repo list file, and save them as the repo list."""
+    if args.restore or args.restore_repos:
+        raise RuntimeError("ERROR: Repos can not be discovered from the filesystem on restore")
+
+    git_path = os.path.join(config.get('gerrit', 'gerrit_path'), 'git')
+    started = time.time()
+
+    repos = repoList.discover_repos(git_path, _get_jobs(config, args))
+    log.info("Discovered %d repo(s) in %s, in %.1fs" % (len(repos), git_path, time.time() - started))
+
+    if args.diff_repos:
+        if not os.path.exists(repo_list_file):
+            raise RuntimeError("ERROR: File not found: %s" % repo_list_file)
+
+        orphaned, missing = repoList.diff_repo_lists(repos, repoList.parse_repo_list(repo_list_file))
+        log.info("Repos not in the repo list (orphaned): %d" % len(orphaned))
+        for repo in orphaned:
+            log.warn("- Orphaned: %s" % repo)
+
+        log.info("Repos not found on disk (missing): %d" % len(missing))
+        for repo in missing:
+            log.warn("- Missing: %s" % repo)
+
+    if not args.dry_run:
+        repoList.write_repo_list(repos, repo_list_file)
+
+    return repos
+
+
+def _save_versions_report(config, report_file, versions_report):
+    """Save versions report as JSON."""
+    report = {
+        'version': 1,
+        'hostname': config.get('backup', 'ssh_hostname'),
+        'repos': versions_report
+    }
+
+    with open(report_file, 'w') as output_file:
+        json.dump(report, output_file, indent=2, sort_keys=True)
+
+    log.info("Saved versions report: %s" % report_file)
+
+
 def process(config, args):
     """Processing."""
     backup_classes = []
 
+    s3 = None
     if config.has_section('backup_s3cfg'):
         s3 = S3(config.get('backup_s3cfg', 'access_key'),
                 config.get('backup_s3cfg', 'secret_key'),
@@ -42,7 +157,22 @@ def process(config, args):
         if config.has_section('gpg'):
             s3.encrypt_files = config.getboolean('gpg', 'encrypt_files')
 
-        s3.content_type = 'application/tar+gzip'
+        s3.content_type = get_codec(_get_compression(config)).content_type
+
+        if config.has_option('backup_s3cfg', 'multipart_threshold'):
+            s3.multipart_threshold = config.getint('backup_s3cfg', 'multipart_threshold') * MB
+
+        if config.has_option('backup_s3cfg', 'multipart_chunk_size'):
+            s3.multipart_chunk_size = config.getint('backup_s3cfg', 'multipart_chunk_size') * MB
+
+        if config.has_option('backup_s3cfg', 'max_concurrency'):
+            s3.max_concurrency = config.getint('backup_s3cfg', 'max_concurrency')
+
+        if config.has_option('backup_s3cfg', 'download_chunk_size'):
+            s3.download_chunk_size = config.getint('backup_s3cfg', 'download_chunk_size') * MB
+
+        if config.has_option('backup_s3cfg', 'download_concurrency'):
+            s3.download_concurrency = config.getint('backup_s3cfg', 'download_concurrency')
 
         backup_classes.append(BackupS3(config, s3))
 
@@ -58,6 +188,56 @@ def process(config, args):
     gerrit.verbose = args.verbose
     gerrit.dry_run = args.dry_run
 
+    gerrit.incremental = args.incremental
+
+    if config.has_option('backup', 'stream'):
+        gerrit.stream = config.getboolean('backup', 'stream')
+
+    if config.has_option('database', 'stream_dump'):
+        gerrit.stream_database = config.getboolean('database', 'stream_dump')
+
+    if config.has_option('database', 'stream_restore'):
+        gerrit.stream_restore_database = config.getboolean('database', 'stream_restore')
+
+    if config.has_option('database', 'table_jobs'):
+        gerrit.database_table_jobs = config.getint('database', 'table_jobs')
+
+    if config.has_option('database', 'restore_tables'):
+        gerrit.restore_tables = config.get('database', 'restore_tables').replace(',', ' ').split()
+
+    if config.has_option('backup', 'archive_format'):
+        gerrit.archive_format = config.get('backup', 'archive_format').strip().lower()
+
+    if config.has_option('backup', 'full_bundle_interval'):
+        gerrit.full_bundle_interval = config.getint('backup', 'full_bundle_interval')
+
+    if config.has_option('backup', 'dedup'):
+        gerrit.dedup = config.getboolean('backup', 'dedup')
+
+    if config.has_option('backup', 'dedup_chunk_size'):
+        gerrit.dedup_chunk_size = config.getint('backup', 'dedup_chunk_size') * KB
+
+    for backup_class, chunk_store in zip(backup_classes, gerrit.chunk_stores):
+        chunk_store.index_file = _get_dedup_index_file(backup_class)
+
+        if config.has_option('backup', 'dedup_index_max_age'):
+            chunk_store.index_max_age = config.getint('backup', 'dedup_index_max_age') * 3600
+
+    gerrit.compression = get_codec(_get_compression(config)).name
+
+    if config.has_option('backup', 'compression_level'):
+        gerrit.compression_level = config.getint('backup', 'compression_level')
+
+    if config.has_option('backup', 'compression_threads'):
+        gerrit.compression_threads = config.getint('backup', 'compression_threads')
+
+    if config.has_option('backup', 'store_incompressible'):
+        gerrit.store_incompressible = config.getboolean('backup', 'store_incompressible')
+
+    if config.has_option('backup', 'catalog'):
+        gerrit.catalog = config.getboolean('backup', 'catalog')
+
+    run_status = 'failed'
     try:
         if not args.post_tasks_only:
             tasks.pre_tasks(config, True, args.dry_run, args.verbose)
@@ -66,6 +246,11 @@ def process(config, args):
             return
 
         if not args.post_tasks_only:
+            if args.backup or args.backup_database or args.backup_repos \
+               or args.restore or args.restore_database or args.restore_repos \
+               or args.get_versions:
+                gerrit.load_catalogs()
+
             if args.backup or args.backup_database:
                 log.print_log("Backing up Database")
                 gerrit.backup_database()
@@ -73,17 +258,20 @@ def process(config, args):
             if args.restore or args.restore_database:
                 log.print_log("Restoring Database")
                 # s3.list_bucket_keys(config)
-                gerrit.restore_database()
+                if gerrit.restore_database() > 0:
+                    raise RuntimeError("ERROR: Failed to restore database")
 
             repo_list_filename = config.get('script', 'repo_list_filename')
             script_path = os.path.dirname(os.path.realpath(__file__))
             repo_list_file = os.path.join(script_path, repo_list_filename)
 
-            if not os.path.exists(repo_list_file):
+            if not os.path.exists(repo_list_file) and args.discover_repos != 'filesystem':
                 raise RuntimeError("ERROR: File not found: %s" % repo_list_file)
 
             repos = []
-            if config.has_option('cmd_arguments', 'repo_list'):
+            if args.discover_repos == 'filesystem':
+                repos = _discover_repos(config, args, repo_list_file)
+            elif config.has_option('cmd_arguments', 'repo_list'):
                 repos = repoList.parse_repo_list(repo_list_file)
             else:
                 for backup_class in backup_classes:
@@ -95,37 +283,88 @@ def process(config, args):
 
                 repos = list(set(repos))
 
+            if args.restore or args.restore_repos:
+                gerrit.log_restore_plan(repos)
+
+            if args.dry_run and (args.backup or args.backup_repos):
+                gerrit.log_backup_estimate(repos)
+
+            versions_report = {}
+            if args.get_versions:
+                gerrit.load_versions_indexes()
+
             total_repos = len(repos)
             repo_cnt = 0
             for repo in repos:
                 repo_cnt += 1
-                repo_percentage = (float(repo_cnt) / total_repos) * 100
-                progress = " [{0:d}/{1:d}] {2:.2f}%".format(repo_cnt,
-                                                            total_repos,
-                                                            repo_percentage)
-
-                if args.diskusage:
-                    log.print_log("Reporting Repo Disk Usage%s" % progress)
-                    gerrit.get_repo_disk_usage(repo)
+                progress = workers.progress_string(repo_cnt, total_repos)
 
                 if args.get_versions:
-                    gerrit.get_versions(repo)
+                    log.print_log("Getting Repo Versions%s: %s" % (progress, repo))
+                    versions_report[repo] = gerrit.get_versions(repo)
+
+            if args.diskusage:
+                log.print_log("Reporting Repo Disk Usage")
+                gerrit.report_disk_usage(repos, _get_jobs(config, args), args.diskusage_report,
+                                         _get_diskusage_cache_file(config))
 
-                if args.backup or args.backup_repos:
-                    log.info("Backing up Repos%s" % progress)
-                    gerrit.backup_repo(repo)
+            if args.get_versions and args.versions_report:
+                _save_versions_report(config, args.versions_report, versions_report)
 
-                if args.restore or args.restore_repos:
-                    tasks.pre_tasks(config, False, args.dry_run, args.verbose)
-                    log.print_log("Restoring Repos%s" % progress)
-                    gerrit.restore_repo(repo)
+            if args.restore or args.restore_repos:
+                tasks.pre_tasks(config, False, args.dry_run, args.verbose)
 
+                log.print_log("Restoring Repos")
+                failed_repos = gerrit.restore_repos(repos, _get_jobs(config, args), _get_prefetch(config))
+
+                if failed_repos > 0:
+                    raise RuntimeError("ERROR: Failed to restore %d repo(s)" % failed_repos)
+
+            failed_repos = 0
             if args.backup or args.backup_repos:
+                pool = workers.WorkerPool(_get_jobs(config, args), "Backing up Repos")
+                pool.verbose = args.verbose
+                log.info("Backup Jobs: %d" % pool.jobs)
+
+                gerrit.load_manifests()
+
+                predicted_makespan = None
+                if _get_schedule(config) == 'size':
+                    repos, predicted_makespan = gerrit.schedule_repos(repos, pool.jobs, _get_priority_repos(config),
+                                                                      _get_diskusage_cache_file(config))
+
+                started = time.time()
+                pool.run(gerrit.backup_repo, repos)
+                failed_repos = pool.report_failures('backup')
+
+                if predicted_makespan is not None:
+                    log.info("Backup makespan: %.1fs, predicted: %.1fs" % (time.time() - started, predicted_makespan))
+                else:
+                    log.info("Backup makespan: %.1fs" % (time.time() - started))
+
+                if args.incremental:
+                    log.info("Skipped %d unchanged repo(s)" % len(gerrit.skipped_repos))
+
+                gerrit.save_manifests()
                 gerrit.backup_repo_list()
 
+            if failed_repos > 0:
+                raise RuntimeError("ERROR: Failed to backup %d repo(s)" % failed_repos)
+
+        run_status = 'ok'
+
     finally:
-        if not args.pre_tasks_only:
-            tasks.post_tasks(config, True, args.dry_run, args.verbose)
+        try:
+            if not args.pre_tasks_only:
+                tasks.post_tasks(config, True, args.dry_run, args.verbose)
+        finally:
+            tasks.close_database_session()
+            gerrit.save_catalogs(run_status)
+            gerrit.save_chunk_indexes()
+
+            if s3 is not None:
+                s3.log_stats()
+                s3.close()
 
 
 def _parse_args():
@@ -165,10 +404,30 @@ def _parse_args():
                         help='restore-repos: Download, Extract TAR and restore repos')
     parser.add_argument('--repo-list',
                         help='File containing a list of repos to backup')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=0,
+                        help='Number of repos to backup / restore / scan in parallel. Default: [backup] jobs or 1')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        default=False,
+                        help='Skip repos whose refs have not changed since the last backup')
     parser.add_argument('--get-versions',
                         action='store_true',
                         default=False,
                         help='Get backup versions')
+    parser.add_argument('--versions-report',
+                        help='Save --get-versions report as JSON to this file')
+    parser.add_argument('--discover-repos',
+                        choices=['api', 'filesystem'],
+                        default='api',
+                        help='Get repos from the repo list (api), or by scanning gerrit_path/git (filesystem). Default: api')
+    parser.add_argument('--diff-repos',
+                        action='store_true',
+                        default=False,
+                        help='With --discover-repos filesystem, report repos not in the repo list and repos not on disk')
+    parser.add_argument('--diskusage-report',
+                        help='Save --diskusage report as CSV to this file')
     parser.add_argument('--pre-tasks-only',
                         action='store_true',
                         default=False,
@@ -23,12 +23,42 @@ import log
 
 from ssh.SSH import SSH
 from GerritRemote import GerritRemote
+from RemoteEnv import RemoteEnv
 from gerrit.Api import Api
 
 reload(sys)
 sys.setdefaultencoding('utf-8')
 
 
+def _get_api(config, args, verify_ssl):
+    """Get Gerrit API, shared by all repo listings of a run."""
+    gerrit_api = Api(config.get('backup_api', 'api_url'), verify_ssl)
+    gerrit_api.verbose = args.verbose
+
+    if config.has_option('backup_api', 'api_page_size'):
+        gerrit_api.page_size = config.getint('backup_api', 'api_page_size')
+
+    if not config.has_option('backup_api', 'api_cache') or config.getboolean('backup_api', 'api_cache'):
+        gerrit_api.cache_file = config.get('script', 'repo_list_filename') + '.cache.json'
+
+    return gerrit_api
+
+
+def _get_remote_env(config, ssh):
+    """Get RemoteEnv, to run the tool in on remote."""
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    remote_env = RemoteEnv(ssh, os.path.join(script_path, 'requirements_remote.txt'),
+                           os.path.join(script_path, 'requirements_remote_optional.txt'))
+
+    if config.has_option('script', 'wheelhouse') and config.get('script', 'wheelhouse'):
+        remote_env.wheelhouse = os.path.expanduser(config.get('script', 'wheelhouse'))
+
+    if config.has_option('script', 'remote_python') and config.get('script', 'remote_python'):
+        remote_env.python = config.get('script', 'remote_python')
+
+    return remote_env
+
+
 def process(config, args):
     """Processing."""
     repos = []
@@ -38,19 +68,28 @@ def process(config, args):
     if config.has_option('backup_api', 'api_verify_ssl'):
         verify_ssl = config.getboolean('backup_api', 'api_verify_ssl')
 
+    # NOTE: With filesystem discovery the remote scans for repos; the API listing is only needed to diff against
+    use_api = args.discover_repos != 'filesystem' or args.diff_repos
+
+    gerrit_api = None
+    if (args.backup and use_api) or args.get_repo_list:
+        gerrit_api = _get_api(config, args, verify_ssl)
+
     if args.repo_list:
         log.print_log("Getting repo list from file: %s" % args.repo_list)
 
         repos = repoList.parse_repo_list(args.repo_list)
 
-    elif args.backup or args.get_repo_list:
-        gerrit_api = Api(config.get('backup_api', 'api_url'), verify_ssl)
-        gerrit_api.verbose = args.verbose
+    elif (args.backup and use_api) or args.get_repo_list:
         repos = gerrit_api.get_repos()
 
+    if args.backup and args.diff_repos and not args.repo_list:
+        # NOTE: Copied to remote, to diff the discovered repos against
+        script_path = os.path.dirname(os.path.realpath(__file__))
+        gerrit_api.output_repo_list_to_file(
+            repos, os.path.join(script_path + '/..', config.get('script', 'repo_list_filename')))
+
     if args.get_repo_list:
-        gerrit_api = Api(config.get('backup_api', 'api_url'), verify_ssl)
-        gerrit_api.verbose = args.verbose
         script_repo_file = gerrit_api.output_repo_list_to_file(
             repos, config.get('script', 'repo_list_filename'))
         log.print_log("Script Repo File: %s" % script_repo_file)
@@ -71,6 +110,13 @@ def process(config, args):
             ssh.key_file_path = ssh_key_file
 
         ssh.port = config.getint(config_key, 'ssh_port')
+
+        if config.has_option(config_key, 'ssh_max_channels'):
+            ssh.max_channels = config.getint(config_key, 'ssh_max_channels')
+
+        if config.has_option(config_key, 'ssh_keepalive'):
+            ssh.keepalive = config.getint(config_key, 'ssh_keepalive')
+
         ssh.use_screen = args.use_screen
         ssh.verbose = args.verbose
         ssh.dry_run = args.dry_run
@@ -82,6 +128,12 @@ def process(config, args):
         gerrit_remote.verbose = args.verbose
         gerrit_remote.dry_run = args.dry_run
 
+        if config.has_option('script', 'ship_archive'):
+            gerrit_remote.use_archive = config.getboolean('script', 'ship_archive')
+
+        if config.has_option('script', 'remote_env') and config.getboolean('script', 'remote_env'):
+            gerrit_remote.remote_env = _get_remote_env(config, ssh)
+
         if not args.post_tasks_only:
             tasks.pre_tasks(config, False, args.dry_run, args.verbose)
 
@@ -107,6 +159,7 @@ def process(config, args):
     finally:
         if not args.pre_tasks_only:
             tasks.post_tasks(config, False, args.dry_run, args.verbose)
+            tasks.close_database_session()
 
         if args.post_tasks_only:
             gerrit_remote.run_backup_cmd("--post-tasks-only")
@@ -140,10 +193,29 @@ def _parse_args():
                         help='diskusage: Gets repo disk usage')
     parser.add_argument('--repo-list',
                         help='File containing a list of repos to backup')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=0,
+                        help='Number of repos to backup / restore / scan in parallel on remote. Default: [backup] jobs or 1')
+    parser.add_argument('--discover-repos',
+                        choices=['api', 'filesystem'],
+                        default='api',
+                        help='Get repos from the Gerrit API (api), or by scanning gerrit_path/git on remote (filesystem). '
+                             'Default: api')
+    parser.add_argument('--diff-repos',
+                        action='store_true',
+                        default=False,
+                        help='With --discover-repos filesystem, report repos not in the API listing and repos not on disk')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        default=False,
+                        help='Skip repos whose refs have not changed since the last backup')
     parser.add_argument('--get-versions',
                         action='store_true',
                         default=False,
                         help='Get backup versions')
+    parser.add_argument('--versions-report',
+                        help='Save --get-versions report as JSON to this file, copied back from remote')
     parser.add_argument('--pre-tasks-only',
                         action='store_true',
                         default=False,
@@ -232,6 +304,17 @@ def _set_config(args, config, config_file_path):
     if args.repo_list:
         config.set('cmd_arguments', 'repo_list', args.repo_list)
 
+    if args.jobs:
+        config.set('cmd_arguments', 'jobs', str(args.jobs))
+
+    if args.versions_report:
+        config.set('cmd_arguments', 'versions_report', os.path.abspath(args.versions_report))
+
+    config.set('cmd_arguments', 'discover_repos', args.discover_repos)
+    config.set('cmd_arguments', 'diff_repos', str(args.diff_repos))
+
+    config.set('cmd_arguments', 'incremental', str(args.incremental))
+
 
 def main():
     """Main function."""
@@ -3,6 +3,7 @@
 
 import socket
 import sys
+import threading
 
 from datetime import datetime
 
@@ -28,6 +29,9 @@ def __has_colors(stream, allow_piping=False):
 # Has Color Init
 has_colors = __has_colors(sys.stdout, True)
 
+# Keep lines whole when logging from worker threads
+_print_lock = threading.RLock()
+
 
 def printout(text, color=WHITE):
     """Print Color Text."""
@@ -44,14 +48,15 @@ def colorText(text, color=WHITE):
 
 def print_log(msg, print_date=True, print_hostname=True):
     """Print message with time and host."""
-    if print_date:
-        printout("[%s] " % datetime.now().replace(microsecond=0), WHITE)
+    with _print_lock:
+        if print_date:
+            printout("[%s] " % datetime.now().replace(microsecond=0), WHITE)
 
-    if print_hostname:
-        printout("(%s) " % socket.getfqdn(), BLUE)
+        if print_hostname:
+            printout("(%s) " % socket.getfqdn(), BLUE)
 
-    print(msg)
-    sys.stdout.flush()
+        print(msg)
+        sys.stdout.flush()
 
 
 def header(msg, max_width=80, print_date=False, print_hostname=False):
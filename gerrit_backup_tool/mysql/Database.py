@@ -1,11 +1,21 @@
 
 """Database Class."""
 
+import errno
 import re
+import subprocess as sp
+import time
 
 import log
 import shell
 
+# Session settings for bulk loading a table dump
+BULK_LOAD_START_SQL = "SET SESSION foreign_key_checks = 0;\n" \
+                      "SET SESSION unique_checks = 0;\n" \
+                      "SET SESSION autocommit = 0;\n"
+
+BULK_LOAD_END_SQL = "\nCOMMIT;\n"
+
 
 class Database(object):
     """Database."""
@@ -58,18 +68,30 @@ class Database(object):
 
         return 0
 
+    def get_mysql_cmd(self, options=''):
+        """Get mysql CMD."""
+        return "mysql" \
+            + " --host=%s" % self.host \
+            + " --user=%s" % self.username \
+            + " --password=%s" % self.password \
+            + options
+
+    def _get_dump_cmd(self, dump_args):
+        """Get mysqldump CMD."""
+        return "mysqldump" \
+            + " --host=%s" % self.host \
+            + " --user=%s" % self.username \
+            + " --password=%s" % self.password \
+            + " --opt" \
+            + " --quote-names" \
+            + " --single-transaction" \
+            + " --quick" \
+            + " %s" % dump_args
+
     def dump(self, databases_names, database_dump_file):
         """Dump Database."""
-        cmd = "mysqldump" \
-              + " --host=%s" % self.host \
-              + " --user=%s" % self.username \
-              + " --password=%s" % self.password \
-              + " --opt" \
-              + " --quote-names" \
-              + " --single-transaction" \
-              + " --quick" \
-              + " --databases %s" % ' '.join(databases_names) \
-              + " > %s" % database_dump_file
+        cmd = self._get_dump_cmd("--databases %s" % ' '.join(databases_names)) \
+            + " > %s" % database_dump_file
 
         if self.verbose:
             log_cmd = re.sub(r" --password=.*? ", " --password=******** ", cmd)
@@ -83,3 +105,133 @@ class Database(object):
             return exit_code
 
         return 0
+
+    def _dump_cmd_stream(self, cmd, fileobj, chunk_size):
+        """Run dump CMD, writing its output in chunks to fileobj.
+
+        Returns the bytes dumped and the seconds spent waiting on the CMD.
+        """
+        if self.verbose:
+            log_cmd = re.sub(r" --password=.*? ", " --password=******** ", cmd)
+            log.verbose("%s | (stream)" % log_cmd)
+
+        if self.dry_run:
+            return 0, 0.0
+
+        bytes_dumped = 0
+        seconds = 0.0
+
+        process = sp.Popen(cmd, shell=True, stdout=sp.PIPE, cwd='.')
+        try:
+            while True:
+                started = time.time()
+                data = process.stdout.read(chunk_size)
+                seconds += time.time() - started
+
+                if not data:
+                    break
+
+                fileobj.write(data)
+                bytes_dumped += len(data)
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+
+        exit_code = process.wait()
+        if exit_code != 0:
+            raise RuntimeError("ERROR: mysqldump failed, exit code: %d" % exit_code)
+
+        return bytes_dumped, seconds
+
+    def dump_stream(self, databases_names, fileobj, chunk_size=1024 * 1024):
+        """Dump Database, writing mysqldump output in chunks to fileobj.
+
+        Returns the bytes dumped and the seconds spent waiting on mysqldump.
+        """
+        cmd = self._get_dump_cmd("--databases %s" % ' '.join(databases_names))
+        return self._dump_cmd_stream(cmd, fileobj, chunk_size)
+
+    def dump_table_stream(self, database_name, table_name, fileobj, chunk_size=1024 * 1024):
+        """Dump Table, writing mysqldump output in chunks to fileobj.
+
+        Returns the bytes dumped and the seconds spent waiting on mysqldump.
+        """
+        cmd = self._get_dump_cmd("%s %s" % (database_name, table_name))
+        return self._dump_cmd_stream(cmd, fileobj, chunk_size)
+
+    def dump_schema_stream(self, database_name, fileobj, chunk_size=1024 * 1024):
+        """Dump Schema, no rows: tables, views, routines and triggers, writing mysqldump output to fileobj.
+
+        Returns the bytes dumped and the seconds spent waiting on mysqldump.
+        """
+        cmd = self._get_dump_cmd("--no-data --routines %s" % database_name)
+        return self._dump_cmd_stream(cmd, fileobj, chunk_size)
+
+    def get_tables(self, database_name):
+        """Get names of the base tables, not views, of database."""
+        cmd = self.get_mysql_cmd(" --batch --skip-column-names" +
+                                  " -e 'SHOW FULL TABLES WHERE Table_type = \"BASE TABLE\"'" +
+                                  " %s" % database_name)
+
+        if self.verbose:
+            log_cmd = re.sub(r" --password=.*? ", " --password=******** ", cmd)
+            log.verbose("%s" % log_cmd)
+
+        exit_code, stdout, stderr = shell.run_shell_cmd_output(cmd)
+        if exit_code != 0:
+            raise RuntimeError("ERROR: Failed to list tables of database '%s': %s" % (database_name,
+                                                                                     stderr.strip()))
+
+        return [line.split('\t')[0] for line in stdout.splitlines() if line.strip()]
+
+    def load_stream(self, reader, database_name=None, bulk_load=False, chunk_size=1024 * 1024):
+        """Load SQL, read in chunks from reader, with the mysql CLI. Returns the bytes loaded.
+
+        With bulk_load, foreign key and unique checks are deferred, and the SQL is loaded in one transaction.
+        """
+        cmd = self.get_mysql_cmd()
+        if database_name:
+            cmd += " %s" % database_name
+
+        if self.verbose:
+            log_cmd = re.sub(r" --password=.*? ", " --password=******** ", cmd + " ")
+            log.verbose("(stream) | %s" % log_cmd.strip())
+
+        if self.dry_run:
+            return 0
+
+        bytes_loaded = 0
+
+        process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, cwd='.')
+        try:
+            if bulk_load:
+                process.stdin.write(BULK_LOAD_START_SQL)
+
+            for data in iter(lambda: reader.read(chunk_size), ''):
+                process.stdin.write(data)
+                bytes_loaded += len(data)
+
+            if bulk_load:
+                process.stdin.write(BULK_LOAD_END_SQL)
+        except IOError as err:
+            # NOTE: Broken pipe, mysql exited early, e.g. on an SQL error, its exit code is raised below
+            if err.errno != errno.EPIPE:
+                process.kill()
+                process.wait()
+                raise
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except IOError:
+                pass
+
+        exit_code = process.wait()
+        if exit_code != 0:
+            raise RuntimeError("ERROR: mysql failed, exit code: %d" % exit_code)
+
+        return bytes_loaded
@@ -0,0 +1,123 @@
+
+"""Database Session Class."""
+
+import re
+import subprocess as sp
+import time
+
+import log
+
+# Selected after each statement, its output marks the end of the statement's output
+END_MARKER = 'gerrit_backup_end_of_statement'
+
+LOCK_TABLES_RE = re.compile(r'\bFLUSH\s+TABLES\s+WITH\s+READ\s+LOCK\b', re.IGNORECASE)
+UNLOCK_TABLES_RE = re.compile(r'\bUNLOCK\s+TABLES\b', re.IGNORECASE)
+
+
+class Session(object):
+    """Long-lived mysql CLI session. Session state, e.g. table locks, lasts until it is closed."""
+
+    def __init__(self, database):
+        """Init."""
+        super(Session, self).__init__()
+        self.database = database
+
+        self.verbose = database.verbose
+        self.dry_run = database.dry_run
+
+        self.lock_started = None
+        self.lock_seconds = 0.0
+
+        self._process = None
+        self._marker_cnt = 0
+
+    def is_open(self):
+        """Test if session is open."""
+        return self._process is not None
+
+    def open(self):
+        """Open session."""
+        cmd = self.database.get_mysql_cmd(" --batch --skip-column-names --unbuffered")
+
+        if self.verbose:
+            log_cmd = re.sub(r" --password=.*? ", " --password=******** ", cmd)
+            log.verbose("%s (session)" % log_cmd)
+
+        if not self.dry_run:
+            self._process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, cwd='.')
+
+    def execute(self, sql):
+        """Execute SQL statement(s), returning output lines."""
+        if self.verbose:
+            log.verbose("SQL (session): %s" % sql)
+
+        if self.dry_run:
+            return []
+
+        if not self.is_open():
+            raise RuntimeError("ERROR: Database session is not open")
+
+        self._marker_cnt += 1
+        marker = "%s_%d" % (END_MARKER, self._marker_cnt)
+
+        try:
+            self._process.stdin.write("%s;\nSELECT '%s';\n" % (sql.strip().rstrip(';'), marker))
+            self._process.stdin.flush()
+        except IOError:
+            pass
+
+        lines = []
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                exit_code = self._process.wait()
+                self._process = None
+                self._lock_released()
+                raise RuntimeError("ERROR: Database session failed, exit code: %d: %s" % (exit_code, sql))
+
+            line = line.rstrip('\n')
+            if line == marker:
+                break
+
+            lines.append(line)
+
+        if UNLOCK_TABLES_RE.search(sql):
+            self._lock_released()
+        if LOCK_TABLES_RE.search(sql) and self.lock_started is None:
+            self.lock_started = time.time()
+            log.info("Database read lock acquired")
+
+        return lines
+
+    def _lock_released(self):
+        """Record read lock released."""
+        if self.lock_started is None:
+            return
+
+        self.lock_seconds = time.time() - self.lock_started
+        self.lock_started = None
+        log.info("Database read lock released, held for %.1fs" % self.lock_seconds)
+
+    def lock_tables(self):
+        """Lock all tables for reading, until unlocked or the session is closed."""
+        self.execute("FLUSH TABLES WITH READ LOCK")
+
+    def unlock_tables(self):
+        """Unlock tables. Returns the seconds the read lock was held."""
+        self.execute("UNLOCK TABLES")
+        return self.lock_seconds
+
+    def close(self):
+        """Close session, releasing any locks."""
+        self._lock_released()
+
+        if self._process is None:
+            return
+
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+
+        process.wait()
@@ -1,7 +1,19 @@
-
 """Repo List Module."""
 
+import os
 import re
+import threading
+
+import log
+import workers
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 def parse_repo_list(repo_list_file):
@@ -21,3 +33,69 @@ def parse_repo_list(repo_list_file):
             repos.append(line)
 
     return repos
+
+
+def write_repo_list(repos, repo_list_file):
+    """Write Repo List, sorted."""
+    with open(repo_list_file, 'w') as output_file:
+        output_file.write('\n'.join(sorted(repos)))
+
+    return repo_list_file
+
+
+def _list_sub_dirs(path):
+    """List names of sub directories of path, not following symlinks."""
+    if scandir is not None:
+        return [entry.name for entry in scandir(path) if entry.is_dir(follow_symlinks=False)]
+
+    return [name for name in os.listdir(path)
+            if os.path.isdir(os.path.join(path, name)) and not os.path.islink(os.path.join(path, name))]
+
+
+def discover_repos(git_path, jobs=1):
+    """Discover repos, *.git directories, under git_path. Repos are not descended into.
+
+    Directories of each level are listed by a worker pool of jobs threads.
+    """
+    repos = []
+    sub_paths = []
+    lock = threading.Lock()
+
+    def _scan(rel_path):
+        try:
+            names = _list_sub_dirs(os.path.join(git_path, rel_path))
+        except OSError as err:
+            log.warn("Not scanned: %s" % err)
+            return
+
+        for name in names:
+            sub_path = os.path.join(rel_path, name) if rel_path else name
+            with lock:
+                if name.endswith('.git'):
+                    repos.append(sub_path[:-len('.git')])
+                else:
+                    sub_paths.append(sub_path)
+
+    if not os.path.isdir(git_path):
+        raise RuntimeError("ERROR: Folder not found: %s" % git_path)
+
+    pool = workers.WorkerPool(jobs)
+    level = ['']
+    while level:
+        sub_paths = []
+        failures = pool.run(_scan, level)
+        if failures:
+            pool.report_failures('scan')
+            raise RuntimeError("ERROR: Discovering repos failed")
+
+        level = sub_paths
+
+    return sorted(repos)
+
+
+def diff_repo_lists(discovered_repos, listed_repos):
+    """Compare discovered and listed repos. Returns repos not listed (orphaned) and repos not discovered (missing)."""
+    discovered_repos = set(discovered_repos)
+    listed_repos = set(listed_repos)
+
+    return sorted(discovered_repos - listed_repos), sorted(listed_repos - discovered_repos)
@@ -0,0 +1,31 @@
+
+"""Scheduler Module."""
+
+import heapq
+
+
+def lpt_order(items, costs, priority_items=None):
+    """Order items longest processing time (cost) first. Priority items come first, in their given order."""
+    item_set = set(items)
+    priority = []
+    for item in priority_items or []:
+        if item in item_set and item not in priority:
+            priority.append(item)
+
+    priority_set = set(priority)
+    others = sorted([item for item in items if item not in priority_set],
+                    key=lambda item: (-costs.get(item, 0), item))
+
+    return priority + others
+
+
+def predict_makespan(items, costs, jobs):
+    """Predict makespan of items taken in order by jobs workers, each taking the next item when free."""
+    jobs = max(1, min(int(jobs), len(items)))
+    loads = [0.0] * jobs
+
+    for item in items:
+        load = heapq.heappop(loads)
+        heapq.heappush(loads, load + costs.get(item, 0))
+
+    return max(loads) if loads else 0.0
@@ -21,3 +21,19 @@ def run_shell_cmd(cmd, path='.', verbose=False):
                 log.print_log(line.strip('\n'))
 
     return exit_code
+
+
+def run_shell_cmd_output(cmd, path='.', verbose=False, input_data=None):
+    """Run Shell Command, returning exit code, stdout and stderr."""
+    if verbose:
+        log.verbose(cmd)
+
+    stdin = None
+    if input_data is not None:
+        stdin = sp.PIPE
+
+    process = sp.Popen(cmd, shell=True, cwd=path, stdin=stdin, stdout=sp.PIPE, stderr=sp.PIPE)
+    stdout, stderr = process.communicate(input_data)
+    exit_code = process.wait()
+
+    return exit_code, stdout, stderr
@@ -0,0 +1,62 @@
+
+"""Archive of files, shipped to remote in one stream."""
+
+import fnmatch
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+
+
+def list_files(local_path, exclude_files=[], exclude_folders=[]):
+    """List files under local_path, as sorted (path, arcname) tuples."""
+    files = []
+    for root, dirnames, filenames in os.walk(local_path, topdown=True):
+        dirnames[:] = [d for d in dirnames if d not in exclude_folders]
+
+        for filename in filenames:
+            if any(fnmatch.fnmatch(filename, exclude_file) for exclude_file in exclude_files):
+                continue
+
+            path = os.path.join(root, filename)
+            files.append((path, os.path.relpath(path, local_path)))
+
+    return sorted(files, key=lambda item: item[1])
+
+
+def files_hash(files):
+    """SHA-256 of the names, modes and contents of files, a list of (path, arcname)."""
+    sha = hashlib.sha256()
+    for path, arcname in files:
+        sha.update("%s\0%o\0" % (arcname, os.stat(path).st_mode & 0o777))
+
+        with open(path, 'rb') as input_file:
+            for data in iter(lambda: input_file.read(64 * 1024), ''):
+                sha.update(data)
+
+        sha.update('\0')
+
+    return sha.hexdigest()
+
+
+def build_archive(files):
+    """Build gzipped TAR of files, a list of (path, arcname). Returns the TAR data.
+
+    Owners and times are not archived, so the same files always give the same TAR.
+    """
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode='wb', mtime=0) as gzip_file:
+        tar_file = tarfile.open(fileobj=gzip_file, mode='w')
+        for path, arcname in files:
+            tarinfo = tar_file.gettarinfo(path, arcname)
+            tarinfo.mtime = 0
+            tarinfo.uid = tarinfo.gid = 0
+            tarinfo.uname = tarinfo.gname = ''
+
+            with open(path, 'rb') as input_file:
+                tar_file.addfile(tarinfo, input_file)
+
+        tar_file.close()
+
+    return output.getvalue()
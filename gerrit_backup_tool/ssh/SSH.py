@@ -3,6 +3,10 @@
 
 import os
 import scp
+import select
+import threading
+import time
+import Queue
 
 import log
 
@@ -12,6 +16,51 @@ import fnmatch
 from  binascii import hexlify
 
 
+class Future(object):
+    """Result of a remote operation, run concurrently."""
+
+    def __init__(self, description=''):
+        """Init."""
+        super(Future, self).__init__()
+        self.description = description
+
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def set_result(self, result):
+        """Set result."""
+        self._result = result
+        self._event.set()
+
+    def set_exception(self, exception):
+        """Set exception."""
+        self._exception = exception
+        self._event.set()
+
+    def done(self):
+        """Test if done."""
+        return self._event.is_set()
+
+    def exception(self, timeout=None):
+        """Wait until done, returning the exception raised, if any."""
+        # NOTE: Wait with timeout, so KeyboardInterrupt is still delivered.
+        started = time.time()
+        while not self._event.wait(0.5):
+            if timeout is not None and time.time() - started >= timeout:
+                raise RuntimeError("ERROR: Timed out waiting for: %s" % self.description)
+
+        return self._exception
+
+    def result(self, timeout=None):
+        """Wait until done, returning the result, or raising the exception raised."""
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+
+        return self._result
+
+
 class SSH(object):
     """SSH Connection."""
 
@@ -33,6 +82,14 @@ class SSH(object):
 
         self.ssh_client = None
 
+        # Concurrent channels, each running a remote command or a file copy, over the one connection
+        self.max_channels = 8
+        self.keepalive = 30
+
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._channel_workers = []
+
     @property
     def key_file_path(self):
         """key_file_path property."""
@@ -51,10 +108,21 @@ class SSH(object):
         self.ssh_client = self.get_client()
 
     def get_client(self):
-        """Get SSH Client."""
-        if self.ssh_client is not None:
+        """Get SSH Client. The client set is reused, and reconnected if its connection was lost."""
+        if self.ssh_client is None:
+            return self._connect()
+
+        with self._lock:
+            transport = self.ssh_client.get_transport()
+            if transport is None or not transport.is_active():
+                log.warn("SSH connection lost, reconnecting: %s" % self.hostname)
+                self.ssh_client.close()
+                self.ssh_client = self._connect()
+
             return self.ssh_client
 
+    def _connect(self):
+        """Connect SSH Client."""
         keys = []
         if self._key_file_path:
             keys.append(paramiko.RSAKey.from_private_key_file(self._key_file_path))
@@ -90,6 +158,9 @@ class SSH(object):
                                pkey=key,
                                timeout=self.timeout)
 
+                if self.keepalive > 0:
+                    client.get_transport().set_keepalive(self.keepalive)
+
                 return client
             except paramiko.SSHException, e:
                 saved_exception = e
@@ -98,8 +169,112 @@ class SSH(object):
 
     def close_client(self):
         """Close SSH Client."""
-        if self.ssh_client is not None:
-            self.ssh_client.close()
+        with self._lock:
+            workers, self._channel_workers = self._channel_workers, []
+
+        for _ in workers:
+            self._queue.put(None)
+
+        # NOTE: Join with timeout, so KeyboardInterrupt is still delivered.
+        for thread in workers:
+            while thread.is_alive():
+                thread.join(0.5)
+
+        with self._lock:
+            ssh_client, self.ssh_client = self.ssh_client, None
+
+        if ssh_client is not None:
+            ssh_client.close()
+
+    def _channel_worker(self):
+        """Channel worker thread, running submitted operations."""
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+
+            future, func, args = entry
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+
+    def submit(self, description, func, *args):
+        """Submit func(*args), run by up to max_channels workers concurrently. Returns a Future.
+
+        The connection is set, so all workers share it, each on its own channel.
+        """
+        if self.ssh_client is None:
+            self.set_client()
+
+        with self._lock:
+            if len(self._channel_workers) < max(1, int(self.max_channels)):
+                thread = threading.Thread(target=self._channel_worker)
+                thread.daemon = True
+                thread.start()
+                self._channel_workers.append(thread)
+
+        future = Future(description)
+        self._queue.put((future, func, args))
+
+        return future
+
+    def _exec_channel(self, cmd, data=None, ssh_client=None):
+        """Run remote command on a new channel, with data piped to its stdin. Returns exit code, stdout and stderr.
+
+        Waits on the channel until stdout data or the exit status arrives; a lost connection raises.
+        """
+        transport = (ssh_client or self.get_client()).get_transport()
+        channel = transport.open_session()
+        try:
+            channel.exec_command(cmd)
+
+            data = data or ''
+            sent = 0
+            if data == '':
+                channel.shutdown_write()
+
+            stdout = []
+            stderr = []
+            while True:
+                # NOTE: Send stdin while reading stdout and stderr, so the command never waits on a full window.
+                sending = sent < len(data) and not channel.exit_status_ready()
+                if sending and channel.send_ready():
+                    sent += channel.send(data[sent:sent + 32 * 1024])
+                    if sent == len(data):
+                        channel.shutdown_write()
+                else:
+                    # NOTE: Only stdout wakes select, stderr is drained at least every 0.5s.
+                    select.select([channel], [], [], 0.01 if sending else 0.5)
+
+                # NOTE: Read stdout and stderr as they arrive, so neither fills the channel window.
+                while channel.recv_ready():
+                    stdout.append(channel.recv(32 * 1024))
+                while channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(32 * 1024))
+
+                if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+
+                if not transport.is_active():
+                    raise RuntimeError("ERROR: SSH connection lost, running: %s" % cmd)
+
+            return channel.recv_exit_status(), ''.join(stdout), ''.join(stderr)
+        finally:
+            channel.close()
+
+    def submit_command(self, cmd):
+        """Submit remote command, run on its own channel. Returns a Future of (exit code, stdout, stderr)."""
+        if self.verbose:
+            log.verbose("Submitting remote command: %s" % cmd)
+
+        return self.submit(cmd, self._exec_channel, cmd)
+
+    def run_commands(self, cmds):
+        """Run remote commands concurrently. Returns their (exit code, stdout, stderr), in order."""
+        futures = [self.submit_command(cmd) for cmd in cmds]
+
+        return [future.result() for future in futures]
 
     def run_command(self, cmd, log_output=True):
         """SSH Command."""
@@ -124,6 +299,26 @@ class SSH(object):
 
         return ret_stdout, ret_stderr
 
+    def stream_to_remote(self, data, cmd):
+        """Run remote command, with data piped to its stdin over one channel."""
+        if self.verbose:
+            log.verbose("Streaming %d bytes to remote command: %s" % (len(data), cmd))
+
+        ssh_client = self.get_client()
+
+        try:
+            exit_code, stdout, stderr = self._exec_channel(cmd, data, ssh_client)
+        finally:
+            if self.ssh_client is None:
+                ssh_client.close()
+
+        for output in [stdout, stderr]:
+            for line in output.splitlines():
+                log.print_log(line, False, False)
+
+        if exit_code != 0:
+            raise RuntimeError("ERROR: Remote command failed, exit code: %d: %s" % (exit_code, cmd))
+
     def scp_copy_file(self, local_file_path, remote_file_path):
         """Copy file to remote via SCP."""
         ssh_client = self.get_client()
@@ -139,11 +334,27 @@ class SSH(object):
         if self.ssh_client is None:
             ssh_client.close()
 
+    def scp_get_file(self, remote_file_path, local_file_path):
+        """Copy file from remote via SCP."""
+        ssh_client = self.get_client()
+
+        if self.verbose:
+            log.verbose("Copy file from remote: -")
+            log.verbose("  %s" % remote_file_path)
+            log.verbose("  %s" % local_file_path)
+
+        with scp.SCPClient(ssh_client.get_transport()) as scp_client:
+            scp_client.get(remote_file_path, local_file_path)
+
+        if self.ssh_client is None:
+            ssh_client.close()
+
     def copy_to_remote(self, local_path, remote_path, exclude_files=[], exclude_folders=[]):
         """Copy Folders to Remote."""
         log.print_log("Copy path to remote: %s" % self.hostname)
 
-        created_remote_directories = []
+        remote_directories = []
+        copies = []
         for root, dirnames, filenames in os.walk(local_path, topdown=True):
             dirnames[:] = [d for d in dirnames if d not in exclude_folders]
 
@@ -161,16 +372,35 @@ class SSH(object):
                 remote_file_path = remote_path.rstrip('/') + '/' + remote_file_path.lstrip('/')
 
                 remote_file_dir = os.path.dirname(remote_file_path)
-                if remote_file_dir not in created_remote_directories:
+                if remote_file_dir not in remote_directories:
 
                     if self.verbose:
                         log.verbose("Creating remote path: %s" % remote_file_dir)
 
-                    self.run_command("mkdir -p %s" % remote_file_dir)
-                    created_remote_directories.append(remote_file_dir)
+                    remote_directories.append(remote_file_dir)
 
                 local_filename = os.path.join(root, filename)
-                self.scp_copy_file(local_filename, remote_file_path)
+                copies.append((local_filename, remote_file_path))
+
+        if remote_directories:
+            self.run_command("mkdir -p %s" % ' '.join(remote_directories))
+
+        self._copy_files_concurrently(copies)
+
+    def _copy_files_concurrently(self, copies):
+        """Copy files, a list of (local path, remote path), each over its own channel."""
+        futures = [self.submit(remote_file_path, self.scp_copy_file, local_file_path, remote_file_path)
+                   for local_file_path, remote_file_path in copies]
+
+        failures = 0
+        for future in futures:
+            err = future.exception()
+            if err is not None:
+                log.error("%s: %s" % (future.description, err))
+                failures += 1
+
+        if failures:
+            raise RuntimeError("ERROR: %d of %d file(s) failed to copy to remote" % (failures, len(futures)))
 
     def copy_files_to_remote(self, files, remote_path):
         """Copy Files to Remote."""
@@ -178,10 +408,13 @@ class SSH(object):
 
         self.run_command("mkdir -p %s" % remote_path)
 
+        copies = []
         for local_file_path in files:
             remote_file_path = os.path.join(remote_path, os.path.basename(local_file_path))
 
             if not os.path.exists(local_file_path):
                 raise RuntimeError("ERROR: File not found: %s" % local_file_path)
 
-            self.scp_copy_file(local_file_path, remote_file_path)
+            copies.append((local_file_path, remote_file_path))
+
+        self._copy_files_concurrently(copies)
@@ -0,0 +1,165 @@
+
+"""Streams Module."""
+
+import hashlib
+import os
+import time
+
+import log
+import utils
+
+
+class MultiWriter(object):
+    """Write a single stream to many writers."""
+
+    def __init__(self, writers):
+        """Init."""
+        super(MultiWriter, self).__init__()
+        self.writers = writers
+        self.bytes_written = 0
+
+        self._sha = hashlib.sha256()
+
+    def write(self, data):
+        """Write data to all writers."""
+        for writer in self.writers:
+            writer.write(data)
+
+        self.bytes_written += len(data)
+        self._sha.update(data)
+
+    def checksum(self):
+        """Get SHA-256 of data written."""
+        return self._sha.hexdigest()
+
+    def flush(self):
+        """Flush."""
+        pass
+
+    def close(self):
+        """Close all writers. If one fails, it and the writers not closed yet are aborted."""
+        for index, writer in enumerate(self.writers):
+            try:
+                writer.close()
+            except Exception:
+                MultiWriter(self.writers[index:]).abort()
+                raise
+
+    def abort(self):
+        """Abort all writers."""
+        for writer in self.writers:
+            try:
+                writer.abort()
+            except Exception:
+                pass
+
+
+class MeteredWriter(object):
+    """Writer, counting bytes written and seconds spent writing, including in writer."""
+
+    def __init__(self, writer):
+        """Init."""
+        super(MeteredWriter, self).__init__()
+        self.writer = writer
+        self.bytes_written = 0
+        self.seconds = 0.0
+
+    def write(self, data):
+        """Write data."""
+        started = time.time()
+        self.writer.write(data)
+        self.seconds += time.time() - started
+        self.bytes_written += len(data)
+
+    def flush(self):
+        """Flush."""
+        self.writer.flush()
+
+    def close(self):
+        """Close writer."""
+        started = time.time()
+        self.writer.close()
+        self.seconds += time.time() - started
+
+    def abort(self):
+        """Abort writer."""
+        self.writer.abort()
+
+
+class ProgressReader(object):
+    """Reader, logging the bytes read and throughput at intervals."""
+
+    def __init__(self, reader, description, interval=10.0):
+        """Init."""
+        super(ProgressReader, self).__init__()
+        self.reader = reader
+        self.description = description
+        self.interval = interval
+        self.bytes_read = 0
+
+        self.started = time.time()
+        self._last_log = self.started
+
+    def read(self, size=-1):
+        """Read up to size bytes."""
+        data = self.reader.read(size)
+        self.bytes_read += len(data)
+
+        now = time.time()
+        if now - self._last_log >= self.interval:
+            self._last_log = now
+            log.info("%s: %s" % (self.description, self.summary()))
+
+        return data
+
+    def summary(self):
+        """Bytes read and throughput so far."""
+        return utils.throughput_string(self.bytes_read, time.time() - self.started)
+
+    def close(self):
+        """Close reader."""
+        self.reader.close()
+
+
+class AtomicFileWriter(object):
+    """Write to a temporary file, renamed into place on close."""
+
+    def __init__(self, file_path):
+        """Init."""
+        super(AtomicFileWriter, self).__init__()
+        self.file_path = file_path
+        self.temp_file_path = file_path + '.part'
+        self.bytes_written = 0
+
+        self._file = open(self.temp_file_path, 'wb')
+
+    def write(self, data):
+        """Write data."""
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def flush(self):
+        """Flush."""
+        self._file.flush()
+
+    def close(self):
+        """Close and rename into place."""
+        self._file.close()
+        os.rename(self.temp_file_path, self.file_path)
+
+    def abort(self):
+        """Close and remove temporary file."""
+        self._file.close()
+        if os.path.exists(self.temp_file_path):
+            os.remove(self.temp_file_path)
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """Get SHA-256 of file."""
+    sha = hashlib.sha256()
+
+    with open(file_path, 'rb') as input_file:
+        for data in iter(lambda: input_file.read(chunk_size), ''):
+            sha.update(data)
+
+    return sha.hexdigest()
@@ -0,0 +1,573 @@
+
+"""Compression Codecs Module."""
+
+import collections
+import socket
+import struct
+import threading
+import zlib
+import Queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Size of blocks compressed in parallel, by codecs without their own threads
+BLOCK_SIZE = 1024 * 1024
+
+MAGIC_SIZE = 4
+
+# Largest raw block, of a zstd frame with a 128 KB window
+ZSTD_RAW_BLOCK_SIZE = 128 * 1024
+
+# zstd frame header: no checksum or content size, 128 KB window
+ZSTD_RAW_FRAME_HEADER = '\x28\xb5\x2f\xfd\x00\x38'
+
+# Largest uncompressed block, of an lz4 frame with 4 MB blocks
+LZ4_RAW_BLOCK_SIZE = 4 * 1024 * 1024
+
+# lz4 frame header: independent blocks, 4 MB blocks, no checksums; the last byte is the header checksum
+LZ4_RAW_FRAME_HEADER = '\x04\x22\x4d\x18\x60\x70\x73'
+
+
+class GzipCodec(object):
+    """Gzip codec. Blocks are compressed as separate gzip members, so they can be compressed in parallel."""
+
+    name = 'gzip'
+    default_level = 6
+    store_level = 0
+    can_store = True
+    magic = '\x1f\x8b'
+    content_type = 'application/tar+gzip'
+    parallel_blocks = True
+
+    def compressobj(self, level, threads):
+        """Get compressor."""
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def storeobj(self):
+        """Get compressor, storing data without compression."""
+        return self.compressobj(self.store_level, 1)
+
+    def compress_block(self, data, level):
+        """Compress block, as a complete gzip member."""
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompressobj(self):
+        """Get decompressor."""
+        return MultiMemberDecompressor(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+
+
+class ZstdCodec(object):
+    """Zstandard codec, using its own compression threads."""
+
+    name = 'zstd'
+    default_level = 3
+    can_store = True
+    magic = '\x28\xb5\x2f\xfd'
+    content_type = 'application/zstd'
+    parallel_blocks = False
+
+    def compressobj(self, level, threads):
+        """Get compressor."""
+        _require(zstandard, 'zstandard')
+        return zstandard.ZstdCompressor(level=level, threads=threads if threads > 1 else 0).compressobj()
+
+    def storeobj(self):
+        """Get compressor, storing data in raw blocks."""
+        return RawFrameCompressor(ZSTD_RAW_FRAME_HEADER, ZSTD_RAW_BLOCK_SIZE, _zstd_raw_block, _zstd_raw_block('', True))
+
+    def decompressobj(self):
+        """Get decompressor."""
+        _require(zstandard, 'zstandard')
+        return ZstdFramesDecompressor(lambda: zstandard.ZstdDecompressor().decompressobj())
+
+
+class Lz4Codec(object):
+    """LZ4 frame codec."""
+
+    name = 'lz4'
+    default_level = 0
+    can_store = True
+    magic = '\x04\x22\x4d\x18'
+    content_type = 'application/x-lz4'
+    parallel_blocks = False
+
+    def compressobj(self, level, threads):
+        """Get compressor."""
+        _require(lz4, 'lz4')
+        return Lz4Compressor(level)
+
+    def storeobj(self):
+        """Get compressor, storing data in uncompressed blocks."""
+        return RawFrameCompressor(LZ4_RAW_FRAME_HEADER, LZ4_RAW_BLOCK_SIZE, _lz4_raw_block, struct.pack('<I', 0))
+
+    def decompressobj(self):
+        """Get decompressor."""
+        _require(lz4, 'lz4')
+        return MultiMemberDecompressor(lz4.frame.LZ4FrameDecompressor)
+
+
+class NoneCodec(object):
+    """No compression."""
+
+    name = 'none'
+    default_level = 0
+    can_store = False
+    magic = None
+    content_type = 'application/x-tar'
+    parallel_blocks = False
+
+    def compressobj(self, level, threads):
+        """Get compressor."""
+        return NoneCompressor()
+
+    def decompressobj(self):
+        """Get decompressor."""
+        return NoneCompressor()
+
+
+CODECS = collections.OrderedDict([(codec.name, codec) for codec in [GzipCodec(),
+                                                                     ZstdCodec(),
+                                                                     Lz4Codec(),
+                                                                     NoneCodec()]])
+
+
+def _require(module, module_name):
+    """Raise if optional module is not installed."""
+    if module is None:
+        raise RuntimeError("ERROR: Python module '%s' needs to be installed on target box: %s" %
+                           (module_name, socket.getfqdn()))
+
+
+def get_codec(name):
+    """Get codec by name."""
+    codec_name = (name or 'none').strip().lower()
+    if codec_name not in CODECS:
+        raise RuntimeError("ERROR: Unknown compression: %s (%s)" % (name, '|'.join(CODECS.keys())))
+
+    return CODECS[codec_name]
+
+
+def detect_codec(data):
+    """Detect codec from the first bytes of a stream."""
+    for codec in CODECS.values():
+        if codec.magic and data.startswith(codec.magic):
+            return codec
+
+    return CODECS['none']
+
+
+class NoneCompressor(object):
+    """Pass through compressor / decompressor."""
+
+    def compress(self, data):
+        """Compress."""
+        return data
+
+    def decompress(self, data):
+        """Decompress."""
+        return data
+
+    def flush(self):
+        """Flush."""
+        return ''
+
+
+def _zstd_raw_block(data, last=False):
+    """Get zstd raw block: 3 byte little endian header of last flag, type 0 (raw) and size, and data."""
+    return struct.pack('<I', int(last) | len(data) << 3)[:3] + data
+
+
+def _lz4_raw_block(data):
+    """Get lz4 uncompressed block: size, with the high bit set, and data."""
+    return struct.pack('<I', len(data) | 0x80000000) + data
+
+
+class RawFrameCompressor(object):
+    """Compressor writing data without compression, as raw blocks of a frame, with a zlib like interface."""
+
+    def __init__(self, header, block_size, raw_block, end):
+        """Init."""
+        super(RawFrameCompressor, self).__init__()
+        self.block_size = block_size
+        self.raw_block = raw_block
+        self.end = end
+
+        self._header = header
+
+    def compress(self, data):
+        """Compress."""
+        header, self._header = self._header, ''
+        return header + ''.join([self.raw_block(data[offset:offset + self.block_size])
+                                 for offset in range(0, len(data), self.block_size)])
+
+    def flush(self):
+        """Finish frame."""
+        header, self._header = self._header, ''
+        return header + self.end
+
+
+class Lz4Compressor(object):
+    """LZ4 frame compressor, with a zlib like interface."""
+
+    def __init__(self, level):
+        """Init."""
+        super(Lz4Compressor, self).__init__()
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        """Compress."""
+        header, self._header = self._header, ''
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        """Finish frame."""
+        header, self._header = self._header, ''
+        return header + self._compressor.flush()
+
+
+class MultiMemberDecompressor(object):
+    """Decompress a stream of concatenated members / frames."""
+
+    def __init__(self, new_decompressor):
+        """Init."""
+        super(MultiMemberDecompressor, self).__init__()
+        self.new_decompressor = new_decompressor
+        self._decompressor = new_decompressor()
+
+    def decompress(self, data):
+        """Decompress."""
+        result = []
+        while data:
+            result.append(self._decompressor.decompress(data))
+
+            data = getattr(self._decompressor, 'unused_data', '')
+            if data or getattr(self._decompressor, 'eof', False):
+                self._decompressor = self.new_decompressor()
+
+        return ''.join(result)
+
+    def flush(self):
+        """Flush."""
+        return ''
+
+
+class ZstdFramesDecompressor(object):
+    """Decompress a stream of concatenated zstd frames.
+
+    The zstd decompressor stops at the end of the first frame, so frames are split by their headers.
+    """
+
+    def __init__(self, new_decompressor):
+        """Init."""
+        super(ZstdFramesDecompressor, self).__init__()
+        self.new_decompressor = new_decompressor
+
+        self._decompressor = None
+        self._pending = ''
+        self._remaining = 0
+        self._state = 'frame_header'
+        self._checksum = False
+        self._last_block = False
+
+    def _frame_header_size(self):
+        """Get size of the frame header in pending data, None until enough is pending."""
+        if len(self._pending) < 5:
+            return None
+
+        descriptor = ord(self._pending[4])
+        single_segment = descriptor & 0x20
+        self._checksum = bool(descriptor & 0x04)
+
+        content_size_size = [1 if single_segment else 0, 2, 4, 8][descriptor >> 6]
+        dictionary_id_size = [0, 1, 2, 4][descriptor & 0x03]
+
+        return 5 + (0 if single_segment else 1) + dictionary_id_size + content_size_size
+
+    def _feed(self, size, result):
+        """Decompress size bytes of pending data."""
+        data, self._pending = self._pending[:size], self._pending[size:]
+        result.append(self._decompressor.decompress(data))
+
+    def decompress(self, data):
+        """Decompress."""
+        self._pending += data
+
+        result = []
+        while self._pending:
+            if self._state == 'frame_header':
+                size = self._frame_header_size()
+                if size is None or len(self._pending) < size:
+                    break
+
+                self._decompressor = self.new_decompressor()
+                self._feed(size, result)
+                self._state = 'block_header'
+            elif self._state == 'block_header':
+                if len(self._pending) < 3:
+                    break
+
+                header = struct.unpack('<I', self._pending[:3] + '\0')[0]
+                self._last_block = bool(header & 0x01)
+                # NOTE: RLE blocks hold one byte, raw and compressed blocks their size
+                self._remaining = 1 if (header >> 1) & 0x03 == 1 else header >> 3
+                self._feed(3, result)
+                self._state = 'block'
+            else:
+                size = min(self._remaining, len(self._pending))
+                self._feed(size, result)
+                self._remaining -= size
+
+            if self._state == 'block' and self._remaining == 0:
+                if not self._last_block:
+                    self._state = 'block_header'
+                elif self._checksum:
+                    self._state, self._remaining, self._checksum = 'checksum', 4, False
+                else:
+                    self._state = 'frame_header'
+
+            if self._state == 'checksum' and self._remaining == 0:
+                self._state = 'frame_header'
+
+        return ''.join(result)
+
+    def flush(self):
+        """Flush."""
+        return ''
+
+
+class CompressWriter(object):
+    """Compress a stream, written in chunks to fileobj.
+
+    With threads, codecs with parallel blocks compress blocks of the stream
+    in parallel, and write them to fileobj in order.
+
+    While storing, data is written without compression, e.g. at gzip level 0, or as raw
+    zstd / lz4 blocks, so already compressed data costs no compression CPU time.
+    """
+
+    def __init__(self, fileobj, codec, level=None, threads=1):
+        """Init. Level None is the codec default level."""
+        super(CompressWriter, self).__init__()
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = codec.default_level if level is None else level
+        self.threads = max(1, int(threads))
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_stored = 0
+
+        self._store = False
+        self._compressor = None
+        self._blocks = None
+        if codec.parallel_blocks and self.threads > 1:
+            self._blocks = BlockCompressor(self._write_out, codec.compress_block, self.level, self.threads)
+        else:
+            self._compressor = codec.compressobj(self.level, self.threads)
+
+    def can_store(self):
+        """Test if codec can store data without compression."""
+        return self.codec.can_store
+
+    def set_store(self, store):
+        """Start / stop storing data without compression."""
+        if store == self._store or not self.can_store():
+            return
+
+        self._store = store
+
+        if self._blocks is not None:
+            self._blocks.set_level(self.codec.store_level if store else self.level)
+        else:
+            # NOTE: Ends the current member, the next one stores or compresses
+            self._write_out(self._compressor.flush())
+            if store:
+                self._compressor = self.codec.storeobj()
+            else:
+                self._compressor = self.codec.compressobj(self.level, self.threads)
+
+    def _write_out(self, data):
+        """Write compressed data to fileobj."""
+        if data:
+            self.fileobj.write(data)
+            self.bytes_out += len(data)
+
+    def write(self, data):
+        """Write data."""
+        self.bytes_in += len(data)
+        if self._store:
+            self.bytes_stored += len(data)
+
+        if self._blocks is not None:
+            self._blocks.write(data)
+        else:
+            self._write_out(self._compressor.compress(data))
+
+    def flush(self):
+        """Flush."""
+        pass
+
+    def close(self):
+        """Finish compression. fileobj is not closed."""
+        if self._blocks is not None:
+            self._blocks.close()
+        else:
+            self._write_out(self._compressor.flush())
+
+    def abort(self):
+        """Abort compression."""
+        if self._blocks is not None:
+            self._blocks.abort()
+
+
+class BlockCompressor(object):
+    """Compress blocks in parallel threads, writing them out in order."""
+
+    def __init__(self, write_out, compress_block, level, threads, block_size=BLOCK_SIZE):
+        """Init."""
+        super(BlockCompressor, self).__init__()
+        self.write_out = write_out
+        self.compress_block = compress_block
+        self.level = level
+        self.threads = threads
+        self.block_size = block_size
+
+        self._buffer = []
+        self._buffer_size = 0
+        self._pending = collections.deque()
+        self._tasks = Queue.Queue()
+
+        self._workers = []
+        for _ in range(threads):
+            worker = threading.Thread(target=self._worker)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _worker(self):
+        """Worker thread."""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+
+            data, level, result = task
+            try:
+                result['data'] = self.compress_block(data, level)
+            except Exception as err:
+                result['error'] = err
+
+            result['done'].set()
+
+    def _write_done(self, wait_all=False):
+        """Write out compressed blocks in order. Waits while too many blocks are pending."""
+        while self._pending:
+            result = self._pending[0]
+            if not (result['done'].is_set() or wait_all or len(self._pending) > self.threads * 2):
+                return
+
+            result['done'].wait()
+            self._pending.popleft()
+
+            if 'error' in result:
+                raise result['error']
+
+            self.write_out(result['data'])
+
+    def _submit(self):
+        """Submit buffered block."""
+        if self._buffer_size == 0:
+            return
+
+        result = {'done': threading.Event()}
+        self._pending.append(result)
+        self._tasks.put((''.join(self._buffer), self.level, result))
+
+        self._buffer = []
+        self._buffer_size = 0
+
+        self._write_done()
+
+    def set_level(self, level):
+        """Set level of following blocks."""
+        self._submit()
+        self.level = level
+
+    def write(self, data):
+        """Write data."""
+        while data:
+            size = min(len(data), self.block_size - self._buffer_size)
+            self._buffer.append(data[:size])
+            self._buffer_size += size
+            data = data[size:]
+
+            if self._buffer_size >= self.block_size:
+                self._submit()
+
+    def close(self):
+        """Compress and write out remaining blocks, and stop threads."""
+        try:
+            self._submit()
+            self._write_done(wait_all=True)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Stop threads."""
+        for _ in self._workers:
+            self._tasks.put(None)
+
+        self._workers = []
+
+
+class DecompressReader(object):
+    """Readable stream of decompressed data, the codec is detected from the stream."""
+
+    def __init__(self, fileobj, chunk_size=BLOCK_SIZE):
+        """Init."""
+        super(DecompressReader, self).__init__()
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+
+        self._pending = fileobj.read(MAGIC_SIZE)
+        self.codec = detect_codec(self._pending)
+        self._decompressor = self.codec.decompressobj()
+
+        self._buffer = ''
+        self._eof = False
+
+    def read(self, size=-1):
+        """Read up to size bytes. Only returns no data at end of stream."""
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self._pending + self.fileobj.read(self.chunk_size)
+            self._pending = ''
+
+            if not data:
+                self._eof = True
+                self._buffer += self._decompressor.flush()
+                break
+
+            self._buffer += self._decompressor.decompress(data)
+
+            if size > 0 and len(self._buffer) > 0:
+                break
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        """Close."""
+        self._buffer = ''
@@ -2,8 +2,90 @@
 """SSH Module."""
 
 import os
+import tarfile
 
-import shell
+import log
+
+import utils
+
+from tar.Compression import CompressWriter, DecompressReader, get_codec
+
+# Members already compressed, e.g. git packs, are stored without compressing them again
+INCOMPRESSIBLE_EXTENSIONS = ('.pack', '.bitmap', '.gz', '.tgz', '.zip', '.jar', '.war',
+                             '.zst', '.lz4', '.xz', '.bz2', '.png', '.jpg', '.jpeg', '.gif')
+
+# Smaller members are not worth ending a compressed member for
+MIN_STORE_SIZE = 64 * 1024
+
+
+def is_incompressible(tarinfo):
+    """Test if TAR member is already compressed."""
+    return tarinfo.isfile() and \
+        tarinfo.size >= MIN_STORE_SIZE and \
+        tarinfo.name.lower().endswith(INCOMPRESSIBLE_EXTENSIONS)
+
+
+def _is_within(path, target):
+    """Test if target is path or under it."""
+    return target == path or target.startswith(path.rstrip(os.sep) + os.sep)
+
+
+def check_member(tarinfo, path):
+    """Raise if TAR member would be written outside path, or links outside it."""
+    path = os.path.realpath(path)
+
+    # NOTE: Parents are resolved, so a member is not written through a symlink extracted before it
+    target_path = os.path.join(os.path.realpath(os.path.join(path, os.path.dirname(tarinfo.name))),
+                               os.path.basename(tarinfo.name))
+    if not _is_within(path, os.path.normpath(target_path)):
+        raise RuntimeError("ERROR: TAR member outside of %s: %s" % (path, tarinfo.name))
+
+    link_path = None
+    if tarinfo.issym():
+        link_path = os.path.join(os.path.dirname(target_path), tarinfo.linkname)
+    elif tarinfo.islnk():
+        link_path = os.path.join(path, tarinfo.linkname)
+
+    if link_path is not None and not _is_within(path, os.path.realpath(link_path)):
+        raise RuntimeError("ERROR: TAR member links outside of %s: %s -> %s" % (path, tarinfo.name,
+                                                                              tarinfo.linkname))
+
+
+class OwnerTarFile(tarfile.TarFile):
+    """TAR file, extracting files owned by a fixed uid and gid, instead of the archived owner."""
+
+    owner = None
+
+    def chown(self, tarinfo, targetpath):
+        """Set owner of targetpath."""
+        if self.owner is None:
+            return tarfile.TarFile.chown(self, tarinfo, targetpath)
+
+        uid, gid = self.owner
+        if tarinfo.issym():
+            os.lchown(targetpath, uid, gid)
+        else:
+            os.chown(targetpath, uid, gid)
+
+
+class StoringTarFile(tarfile.TarFile):
+    """TAR file, storing incompressible members without compressing them."""
+
+    writer = None
+    bytes_incompressible = 0
+
+    def addfile(self, tarinfo, fileobj=None):
+        """Add member."""
+        store = self.writer is not None and is_incompressible(tarinfo)
+        if store:
+            self.bytes_incompressible += tarinfo.size
+            self.writer.set_store(True)
+
+        try:
+            tarfile.TarFile.addfile(self, tarinfo, fileobj)
+        finally:
+            if store:
+                self.writer.set_store(False)
 
 
 class Tar(object):
@@ -15,8 +97,25 @@ class Tar(object):
         self.dry_run = dry_run
         self.verbose = verbose
 
+        self.compression = 'gzip'
+        self.compression_level = None
+        self.compression_threads = 1
+        self.store_incompressible = True
+
+        self.bytes_in = 0
+        self.bytes_incompressible = 0
+        self.bytes_stored = 0
+        self.bytes_out = 0
+
+    def summary(self):
+        """Summary of last TAR created."""
+        return "%s in, %s already compressed (%s stored), %s out" % (utils.human_size(self.bytes_in),
+                                                                    utils.human_size(self.bytes_incompressible),
+                                                                    utils.human_size(self.bytes_stored),
+                                                                    utils.human_size(self.bytes_out))
+
     def create(self, file_path):
-        """Create TAR file."""
+        """Create TAR file. The file is named .tar.gz, whatever the compression."""
         path = os.path.dirname(file_path)
 
         if path == '':
@@ -27,35 +126,101 @@ class Tar(object):
         tar_filename = "%s.tar.gz" % folder_name
         tar_filename = os.path.join(path, tar_filename)
 
-        extra_tar_options = ""
+        if not self.dry_run:
+            try:
+                with open(tar_filename, 'wb') as output_file:
+                    self.create_stream(file_path, output_file)
+            except Exception:
+                if os.path.exists(tar_filename):
+                    os.remove(tar_filename)
+                raise
+
+        return tar_filename
+
+    def create_stream(self, file_path, fileobj, compress=True):
+        """Create compressed TAR stream, written in chunks to fileobj."""
+        folder_name = os.path.basename(file_path)
+
+        codec = get_codec(self.compression if compress else 'none')
+
         if self.verbose:
-            extra_tar_options += "v"
+            log.verbose("tar -cf - %s | %s (%d threads, stream)" % (file_path,
+                                                                   codec.name,
+                                                                   self.compression_threads))
 
-        cmd = "tar -%sczf %s %s" % (extra_tar_options, tar_filename, folder_name)
+        def _log_member(tarinfo):
+            log.verbose(tarinfo.name)
+            return tarinfo
+
+        member_filter = None
+        if self.verbose:
+            member_filter = _log_member
 
         if not self.dry_run:
-            exit_code = shell.run_shell_cmd(cmd, path, self.verbose)
+            writer = CompressWriter(fileobj, codec, self.compression_level, self.compression_threads)
+            try:
+                tar_file = StoringTarFile.open(fileobj=writer, mode='w|')
+                if self.store_incompressible:
+                    tar_file.writer = writer
+
+                tar_file.add(file_path, arcname=folder_name, filter=member_filter)
+                tar_file.close()
+            except Exception:
+                writer.abort()
+                raise
+
+            writer.close()
+
+            self.bytes_in = writer.bytes_in
+            self.bytes_incompressible = tar_file.bytes_incompressible
+            self.bytes_stored = writer.bytes_stored
+            self.bytes_out = writer.bytes_out
+
+    def extract_stream(self, fileobj, path, owner=None):
+        """Extract TAR stream, read in chunks from fileobj, into path. Files are owned by owner (uid, gid).
+
+        The compression is detected from the stream.
+        """
+        if self.verbose:
+            log.verbose("tar -xf - -C %s (stream)" % path)
 
-            if exit_code != 0:
-                raise RuntimeError("ERROR: Create TAR returned exit code: %d" % exit_code)
+        if not self.dry_run:
+            reader = DecompressReader(fileobj)
+            if self.verbose:
+                log.verbose("Compression: %s" % reader.codec.name)
+
+            tar_file = OwnerTarFile.open(fileobj=reader, mode='r|')
+            tar_file.owner = owner
+            for tarinfo in tar_file:
+                if self.verbose:
+                    log.verbose(tarinfo.name)
+                check_member(tarinfo, path)
+                tar_file.extract(tarinfo, path)
+            tar_file.close()
+
+    def open_member_stream(self, fileobj, member_name):
+        """Open file member of TAR stream, read in chunks from fileobj, as a readable stream.
+
+        The compression is detected from the stream.
+        """
+        if self.verbose:
+            log.verbose("tar -xOf - %s (stream)" % member_name)
 
-        return tar_filename
+        reader = DecompressReader(fileobj)
+        tar_file = tarfile.open(fileobj=reader, mode='r|')
+        for tarinfo in tar_file:
+            if tarinfo.isfile() and tarinfo.name == member_name:
+                return tar_file.extractfile(tarinfo)
+
+        raise RuntimeError("ERROR: File not found in TAR: %s" % member_name)
 
     def extract(self, file_path):
-        """Extract TAR file."""
+        """Extract TAR file, next to it."""
         path = os.path.dirname(file_path)
 
         if path == '':
             path = '.'
 
-        extra_tar_options = ""
-        if self.verbose:
-            extra_tar_options += "v"
-
-        cmd = "tar -%sxzf %s" % (extra_tar_options, file_path)
-
         if not self.dry_run:
-            exit_code = shell.run_shell_cmd(cmd, path, self.verbose)
-
-            if exit_code != 0:
-                raise RuntimeError("ERROR: Extract TAR returned exit code: %d" % exit_code)
+            with open(file_path, 'rb') as input_file:
+                self.extract_stream(input_file, path)
@@ -8,8 +8,12 @@ import time
 import log
 
 from mysql.Database import Database
+from mysql.Session import Session
 from jenkins.Jenkins import Jenkins
 
+# Database session, shared by the database_command tasks of a run, so locks last between tasks
+_database_session = None
+
 
 def skip_task(config, section, is_remote):
     """Skip Task."""
@@ -49,6 +53,40 @@ def _sleep(config, section):
         time.sleep(sleepTime)
 
 
+def _use_database_session(config):
+    """Test if database_command tasks share a persistent database session."""
+    if config.has_option('database', 'persistent_session'):
+        return config.getboolean('database', 'persistent_session')
+
+    return True
+
+
+def _get_database_session(config, dry_run, verbose):
+    """Get database session, opening it on first use."""
+    global _database_session
+
+    if _database_session is None or not _database_session.is_open():
+        database = Database(config.get('database', 'database_host'),
+                            config.get('database', 'database_username'),
+                            config.get('database', 'database_password'))
+        database.verbose = verbose
+        database.dry_run = dry_run
+
+        _database_session = Session(database)
+        _database_session.open()
+
+    return _database_session
+
+
+def close_database_session():
+    """Close database session of tasks, releasing its locks."""
+    global _database_session
+
+    if _database_session is not None:
+        _database_session.close()
+        _database_session = None
+
+
 def run_tasks(config, is_remote, taskPrefix, dry_run=False, verbose=False):
     """Run tasks."""
     for section in config.sections():
@@ -114,7 +152,13 @@ def run_tasks(config, is_remote, taskPrefix, dry_run=False, verbose=False):
                 shell.run_shell_cmd(command, pwd)
 
         elif taskName == 'database_command':
-            if not dry_run:
+            if not dry_run and _use_database_session(config):
+                _sleep(config, section)
+                session = _get_database_session(config, dry_run, verbose)
+                for line in session.execute(config.get(section, 'command')):
+                    log.print_log(line)
+
+            elif not dry_run:
                 _sleep(config, section)
                 database = Database(config.get('database', 'database_host'),
                                     config.get('database', 'database_username'),
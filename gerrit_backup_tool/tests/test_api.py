@@ -0,0 +1,137 @@
+"""Test Gerrit Api module."""
+
+import unittest
+
+import json
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+from gerrit.Api import Api, PrefixReader, iter_object_keys
+
+
+class IterObjectKeysTests(unittest.TestCase):
+    """Test iter_object_keys."""
+
+    def setUp(self):
+        """Setup."""
+        self.projects = {
+            'All-Projects': {'id': 'All-Projects', 'description': 'Access inherited by all other projects.'},
+            'team/repo': {'id': 'team%2Frepo', 'parent': {'a': ['b', 'c']}},
+            'odd "name" \\ ,{}[]:': {'id': 'odd', 'description': '"quoted", \\ {escaped}'},
+            u'caf\xe9': {'id': 'cafe'},
+        }
+        self.data = ")]}'\n" + json.dumps(self.projects, indent=2)
+
+    def test_keys(self):
+        """Test keys are found, whatever the chunk boundaries."""
+        for chunk_size in [1, 2, 3, 7, 64 * 1024]:
+            keys = list(iter_object_keys(PrefixReader(StringIO(self.data)), chunk_size))
+            self.assertEqual(sorted(self.projects.keys()), sorted(keys))
+
+    def test_empty(self):
+        """Test empty project list."""
+        self.assertEqual([], list(iter_object_keys(PrefixReader(StringIO(")]}'\n{}")))))
+
+
+class FakeHeaders(object):
+    """Fake response headers."""
+
+    def __init__(self, headers):
+        """Init."""
+        self.headers = headers
+
+    def getheader(self, name):
+        """Get header."""
+        return self.headers.get(name)
+
+
+class FakeResponse(object):
+    """Fake API response."""
+
+    def __init__(self, repos, headers):
+        """Init."""
+        self.fileobj = StringIO(")]}'\n" + json.dumps(dict((repo, {}) for repo in repos)))
+        self.headers = FakeHeaders(headers)
+
+    def read(self, size=-1):
+        """Read."""
+        return self.fileobj.read(size)
+
+    def close(self):
+        """Close."""
+        pass
+
+    def info(self):
+        """Response headers."""
+        return self.headers
+
+
+class FakeApi(Api):
+    """Api, serving projects from a list."""
+
+    def __init__(self, projects, page_size):
+        """Init."""
+        super(FakeApi, self).__init__('https://gerrit')
+        self.projects = projects
+        self.page_size = page_size
+        self.etag = '"1"'
+        self.requests = []
+
+    def _open(self, api_url, cached=None):
+        """Open API URL. Returns None if cached is not modified."""
+        self.requests.append((api_url, cached))
+        if cached is not None and cached.get('etag') == self.etag:
+            return None
+
+        start = int(api_url.split('&S=')[1]) if '&S=' in api_url else 0
+        end = start + self.page_size if self.page_size > 0 else len(self.projects)
+        return FakeResponse(self.projects[start:end], {'ETag': self.etag})
+
+
+class GetReposTests(unittest.TestCase):
+    """Test get_repos."""
+
+    def setUp(self):
+        """Setup."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.projects = ['repo%d' % index for index in range(5)]
+
+    def tearDown(self):
+        """Tear Down."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_cached_listing(self):
+        """Test an unmodified first page reuses the cached listing, without requesting other pages."""
+        api = FakeApi(self.projects, 2)
+        api.cache_file = os.path.join(self.temp_dir, 'repos.txt.cache.json')
+
+        self.assertEqual(self.projects, sorted(api.get_repos()))
+        self.assertEqual(3, len(api.requests))
+
+        api.requests = []
+        self.assertEqual(self.projects, sorted(api.get_repos()))
+        self.assertEqual(1, len(api.requests))
+        self.assertEqual('"1"', api.requests[0][1]['etag'])
+
+        api.projects = self.projects + ['repo5']
+        api.etag = '"2"'
+        api.requests = []
+        self.assertEqual(self.projects + ['repo5'], sorted(api.get_repos()))
+        self.assertEqual(4, len(api.requests))
+
+    def test_cache_url(self):
+        """Test the cached listing is not used for another page size."""
+        api = FakeApi(self.projects, 2)
+        api.cache_file = os.path.join(self.temp_dir, 'repos.txt.cache.json')
+        api.get_repos()
+
+        api.page_size = 0
+        api.requests = []
+        self.assertEqual(self.projects, sorted(api.get_repos()))
+        self.assertEqual([('https://gerrit/projects/?t', None)], api.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
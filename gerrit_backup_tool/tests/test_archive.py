@@ -0,0 +1,56 @@
+"""Test Archive module."""
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+
+from ssh import Archive
+
+
+class ArchiveTests(unittest.TestCase):
+    """Test Archive."""
+
+    def setUp(self):
+        """Setup."""
+        self.path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.path, 'pkg', '.cache'))
+        for name, data in [('main.py', 'main'), ('main.pyc', 'compiled'),
+                           ('pkg/mod.py', 'mod'), ('pkg/.cache/x', 'cache')]:
+            with open(os.path.join(self.path, name), 'w') as output_file:
+                output_file.write(data)
+
+    def tearDown(self):
+        """Tear Down."""
+        shutil.rmtree(self.path)
+
+    def _files(self):
+        return Archive.list_files(self.path, ['*.pyc'], ['.cache'])
+
+    def test_list_files(self):
+        """Test excluded files and folders are not listed."""
+        self.assertEqual(['main.py', os.path.join('pkg', 'mod.py')], [arcname for _, arcname in self._files()])
+
+    def test_files_hash(self):
+        """Test hash changes with contents only, not with times."""
+        files_hash = Archive.files_hash(self._files())
+
+        os.utime(os.path.join(self.path, 'main.py'), (time.time() - 60, time.time() - 60))
+        self.assertEqual(files_hash, Archive.files_hash(self._files()))
+
+        with open(os.path.join(self.path, 'pkg', 'mod.py'), 'w') as output_file:
+            output_file.write('changed')
+        self.assertNotEqual(files_hash, Archive.files_hash(self._files()))
+
+    def test_build_archive(self):
+        """Test archive is reproducible and holds the files."""
+        data = Archive.build_archive(self._files())
+
+        os.utime(os.path.join(self.path, 'main.py'), (time.time() - 60, time.time() - 60))
+        self.assertEqual(data, Archive.build_archive(self._files()))
+
+        tar_file = tarfile.open(fileobj=io.BytesIO(data), mode='r:gz')
+        self.assertEqual('mod', tar_file.extractfile('pkg/mod.py').read())
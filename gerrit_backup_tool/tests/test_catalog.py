@@ -0,0 +1,182 @@
+"""Test Catalog class."""
+
+import unittest
+
+import os
+import tempfile
+
+from gerrit.Backup import Backup
+from gerrit.Catalog import Catalog
+
+
+class FakeConfig(object):
+    """Config with fixed values."""
+
+    def get(self, section, option):
+        """Get option."""
+        return 'gerrit-server'
+
+
+class FakeBackupClass(object):
+    """Backup class with stored versions and a catalog file."""
+
+    def __init__(self, versions, catalog_data):
+        """Init."""
+        self.versions = versions
+        self.catalog_data = catalog_data
+
+    def description(self):
+        """Description."""
+        return 'fake'
+
+    def get_backup_repo_path(self, repo):
+        """Get backup repo path."""
+        return "host/repos/%s.git.tar.gz" % repo
+
+    def get_backup_repo_bundle_path(self, repo, filename):
+        """Get backup repo bundle path."""
+        return "host/repos/%s.git.bundles/%s" % (repo, filename)
+
+    def get_backup_catalog_path(self):
+        """Get backup catalog path."""
+        return 'host/catalog.sqlite'
+
+    def get_versions_index(self):
+        """Get versions index."""
+        return {self.get_backup_repo_path('project'): [{'version_id': version_id} for version_id in self.versions]}
+
+    def download_file(self, backup_path, local_file):
+        """Download catalog."""
+        with open(local_file, 'wb') as output_file:
+            output_file.write(self.catalog_data)
+
+
+class CatalogTests(unittest.TestCase):
+    """Test Catalog Class."""
+
+    def setUp(self):
+        """Setup."""
+        fd, self.db_file = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+
+    def tearDown(self):
+        """Tear down."""
+        os.remove(self.db_file)
+
+    def _open(self, run_id):
+        """Open catalog and start run."""
+        catalog = Catalog()
+        catalog.open(self.db_file)
+        catalog.start_run(run_id, 'gerrit-server')
+        return catalog
+
+    def test_record_and_get_versions(self):
+        """Test uploads are saved and returned newest first."""
+        catalog = self._open('run-1')
+        self.assertFalse(catalog.has_uploads())
+        catalog.record('repo', 'project', 'host/repos/project.git.tar.gz', 'v1', 100, 'abc', 1.5)
+        catalog.finish_run('ok')
+        catalog.close()
+
+        catalog = self._open('run-2')
+        catalog.record('repo', 'project', 'host/repos/project.git.tar.gz', 'v2', 200, 'def', 2.0)
+        catalog.finish_run('ok')
+        catalog.close()
+
+        catalog = self._open('run-3')
+        versions = catalog.get_versions(['repo'], 'project')
+        self.assertEqual(['v2', 'v1'], [version['version_id'] for version in versions])
+        self.assertEqual(['run-2', 'run-1'], [version['run_id'] for version in versions])
+        catalog.close()
+
+    def test_uncommitted_run_discarded(self):
+        """Test uploads of a run that is not finished are not saved."""
+        catalog = self._open('run-1')
+        catalog.record('repo', 'project', 'host/repos/project.git.tar.gz', 'v1', 100)
+        catalog.close()
+
+        catalog = self._open('run-2')
+        self.assertFalse(catalog.has_uploads())
+        catalog.close()
+
+    def test_estimate(self):
+        """Test estimate uses latest upload of each name."""
+        catalog = self._open('run-1')
+        catalog.record('repo', 'a', 'host/repos/a.git.tar.gz', None, 100)
+        catalog.record('repo', 'a', 'host/repos/a.git.tar.gz', None, 150)
+        catalog.record('repo', 'b', 'host/repos/b.git.tar.gz', None, 50)
+
+        total_size, missing = catalog.estimate('repo', ['a', 'b', 'c'])
+        self.assertEqual(200, total_size)
+        self.assertEqual(['c'], missing)
+        catalog.close()
+
+
+
+class BackupVersionsTests(unittest.TestCase):
+    """Test Backup versions, from the catalog and the backup class."""
+
+    def test_get_versions_merged(self):
+        """Test versions uploaded before the catalog existed are returned after the catalog's."""
+        backup = Backup(FakeConfig(), [FakeBackupClass(['v1', 'v2', 'v3'], '')])
+        backup.load_catalogs()
+        backup.catalogs[0].record('repo', 'project', 'host/repos/project.git.tar.gz', 'v3', 300)
+
+        backup.load_versions_indexes()
+        versions = backup.get_versions('project')['fake']
+        self.assertEqual(['v3', 'v1', 'v2'], [version['version_id'] for version in versions])
+        self.assertEqual(300, versions[0]['size'])
+        backup.catalogs[0].close()
+
+    def test_get_repo_costs(self):
+        """Test repos with a previous whole backup are costed by its duration, without a scan."""
+        backup = Backup(FakeConfig(), [FakeBackupClass([], '')])
+        backup.load_catalogs()
+        backup.catalogs[0].record_backup('a', 10.0, 1000)
+
+        scanned = []
+
+        def _get_repo_disk_usage(repo):
+            scanned.append(repo)
+            return {'bytes': 500}
+
+        backup.get_repo_disk_usage = _get_repo_disk_usage
+
+        costs, in_seconds = backup.get_repo_costs(['a', 'b'])
+        self.assertTrue(in_seconds)
+        self.assertEqual({'a': 10.0, 'b': 5.0}, costs)
+        self.assertEqual(['b'], scanned)
+        self.assertEqual(500, backup.repo_disk_sizes['b'])
+        backup.catalogs[0].close()
+
+    def test_get_repo_format(self):
+        """Test the restore format is the latest backup's, whatever the config."""
+        backup = Backup(FakeConfig(), [FakeBackupClass([], '')])
+        backup.load_catalogs()
+        self.assertEqual('tar', backup._get_repo_format('project'))
+
+        catalog = backup.catalogs[0]
+        catalog.record('repo', 'project', 'host/repos/project.git.tar.gz', 'v1', 100)
+        catalog.record('repo', 'project', 'host/repos/project.git.tar.recipe', 'v2', 100)
+        self.assertEqual('dedup', backup._get_repo_format('project'))
+
+        catalog.record('bundle', 'project', 'host/repos/project.git.bundles/1.bundle', 'v3', 100)
+        self.assertEqual('bundle', backup._get_repo_format('project'))
+
+        backup.dedup = True
+        catalog.record('repo', 'project', 'host/repos/project.git.tar.gz', 'v4', 100)
+        self.assertEqual('tar', backup._get_repo_format('project'))
+
+        self.assertRaises(RuntimeError, backup._get_repo_format, 'other')
+        catalog.close()
+
+    def test_corrupt_catalog(self):
+        """Test a catalog that is not a database is replaced by a new catalog."""
+        backup = Backup(FakeConfig(), [FakeBackupClass([], 'not a database' * 100)])
+        backup.load_catalogs()
+        self.assertFalse(backup.catalogs[0].has_uploads())
+        backup.catalogs[0].close()
+
+
+if __name__ == '__main__':
+    unittest.main()
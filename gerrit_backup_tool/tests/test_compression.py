@@ -0,0 +1,197 @@
+"""Test Compression module."""
+
+import unittest
+
+import gzip
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+from cStringIO import StringIO
+
+from tar import Compression
+from tar.Compression import CompressWriter, DecompressReader, get_codec
+from tar.Tar import Tar
+
+
+def _random_data(size, seed=1):
+    """Get compressible random data."""
+    rnd = random.Random(seed)
+    words = ['refs', 'heads', 'master', 'commit', 'tree', 'blob', '\n']
+    return ' '.join([rnd.choice(words) for _ in range(size // 4)])
+
+
+def _compress(data, codec_name, threads=1, write_size=1000):
+    """Compress data."""
+    output = StringIO()
+    writer = CompressWriter(output, get_codec(codec_name), threads=threads)
+    for offset in range(0, len(data), write_size):
+        writer.write(data[offset:offset + write_size])
+    writer.close()
+
+    return output.getvalue()
+
+
+class CompressionTests(unittest.TestCase):
+    """Test Compression Codecs."""
+
+    def setUp(self):
+        """Setup."""
+        self.data = _random_data(3 * Compression.BLOCK_SIZE)
+
+    def _round_trip(self, codec_name, threads=1):
+        """Test compressed data decompresses to the same data, with the codec detected."""
+        compressed = _compress(self.data, codec_name, threads)
+
+        reader = DecompressReader(StringIO(compressed))
+        self.assertEqual(reader.codec.name, codec_name)
+        self.assertEqual(reader.read(), self.data)
+
+        return compressed
+
+    def test_gzip(self):
+        """Test gzip."""
+        compressed = self._round_trip('gzip')
+        self.assertLess(len(compressed), len(self.data) // 2)
+
+    def test_gzip_threads(self):
+        """Test gzip compressed in parallel blocks can be read by gzip."""
+        compressed = self._round_trip('gzip', threads=4)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(compressed)).read(), self.data)
+
+    def test_none(self):
+        """Test no compression."""
+        self.assertEqual(self._round_trip('none'), self.data)
+
+    @unittest.skipIf(Compression.zstandard is None, "zstandard not installed")
+    def test_zstd(self):
+        """Test zstd."""
+        self._round_trip('zstd', threads=2)
+
+    @unittest.skipIf(Compression.lz4 is None, "lz4 not installed")
+    def test_lz4(self):
+        """Test lz4."""
+        self._round_trip('lz4')
+
+    def test_store(self):
+        """Test data stored without compression, between compressed data, decompresses, for all codecs."""
+        stored_data = os.urandom(300 * 1024)
+        for codec_name in Compression.CODECS.keys():
+            codec = get_codec(codec_name)
+            if codec_name == 'zstd' and Compression.zstandard is None or \
+                    codec_name == 'lz4' and Compression.lz4 is None:
+                continue
+
+            output = StringIO()
+            writer = CompressWriter(output, codec)
+            writer.write(self.data[:1000])
+            writer.set_store(True)
+            writer.write(stored_data)
+            writer.set_store(False)
+            writer.write(self.data[1000:2000])
+            writer.close()
+
+            self.assertEqual(len(stored_data) if codec.can_store else 0, writer.bytes_stored)
+            reader = DecompressReader(StringIO(output.getvalue()))
+            self.assertEqual(self.data[:1000] + stored_data + self.data[1000:2000], reader.read())
+
+    def test_unknown_codec(self):
+        """Test unknown codec."""
+        self.assertRaises(RuntimeError, get_codec, 'bzip2')
+
+
+class TarTests(unittest.TestCase):
+    """Test Tar Class."""
+
+    def setUp(self):
+        """Setup."""
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        self.path = tempfile.mkdtemp()
+
+        self.repo_path = os.path.join(self.path, 'repo.git')
+        os.makedirs(os.path.join(self.repo_path, 'refs', 'heads'))
+        with open(os.path.join(self.repo_path, 'HEAD'), 'w') as output_file:
+            output_file.write('ref: refs/heads/master\n')
+
+    def tearDown(self):
+        """Tear down."""
+        sys.stdout = self.stdout
+        shutil.rmtree(self.path)
+
+    def test_create_extract(self):
+        """Test TAR file is extracted, whatever its compression."""
+        for compression in ['gzip', 'none']:
+            tar = Tar()
+            tar.compression = compression
+            tar_file_path = tar.create(self.repo_path)
+            shutil.rmtree(self.repo_path)
+
+            Tar().extract(tar_file_path)
+            os.remove(tar_file_path)
+
+            with open(os.path.join(self.repo_path, 'HEAD'), 'r') as input_file:
+                self.assertEqual(input_file.read(), 'ref: refs/heads/master\n')
+
+    def test_extract_outside(self):
+        """Test members, and links, outside the extract path are refused."""
+        extract_path = os.path.join(self.path, 'extract')
+        os.makedirs(extract_path)
+
+        for name, member_type, linkname in [('../evil', tarfile.REGTYPE, ''),
+                                            ('/tmp/evil', tarfile.REGTYPE, ''),
+                                            ('link', tarfile.SYMTYPE, '../..'),
+                                            ('link', tarfile.LNKTYPE, '/etc/passwd')]:
+            output = StringIO()
+            tar_file = tarfile.open(fileobj=output, mode='w')
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.type = member_type
+            tarinfo.linkname = linkname
+            tar_file.addfile(tarinfo, StringIO(''))
+            tar_file.close()
+
+            output.seek(0)
+            self.assertRaises(RuntimeError, Tar().extract_stream, output, extract_path)
+
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'evil')))
+        self.assertEqual([], os.listdir(extract_path))
+
+    def test_open_member_stream(self):
+        """Test TAR member is read from the TAR stream."""
+        tar_file_path = Tar().create(self.repo_path)
+
+        with open(tar_file_path, 'rb') as input_file:
+            reader = Tar().open_member_stream(input_file, 'repo.git/HEAD')
+            self.assertEqual(reader.read(), 'ref: refs/heads/master\n')
+
+        with open(tar_file_path, 'rb') as input_file:
+            self.assertRaises(RuntimeError, Tar().open_member_stream, input_file, 'repo.git/missing')
+
+        os.remove(tar_file_path)
+
+    def test_store_packs(self):
+        """Test pack files are stored without compression, and extracted."""
+        pack_path = os.path.join(self.repo_path, 'objects', 'pack')
+        os.makedirs(pack_path)
+        pack_data = os.urandom(256 * 1024)
+        with open(os.path.join(pack_path, 'pack-1.pack'), 'wb') as output_file:
+            output_file.write(pack_data)
+
+        for threads in [1, 4]:
+            tar = Tar()
+            tar.compression_threads = threads
+            tar_file_path = tar.create(self.repo_path)
+            self.assertEqual(tar.bytes_incompressible, len(pack_data))
+            self.assertGreater(tar.bytes_stored, len(pack_data) // 2)
+            shutil.rmtree(self.repo_path)
+
+            Tar().extract(tar_file_path)
+            os.remove(tar_file_path)
+
+            with open(os.path.join(pack_path, 'pack-1.pack'), 'rb') as input_file:
+                self.assertEqual(input_file.read(), pack_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
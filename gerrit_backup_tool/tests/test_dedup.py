@@ -0,0 +1,155 @@
+
+"""Test Dedup classes."""
+
+import unittest
+
+import ConfigParser
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from cStringIO import StringIO
+
+from dedup import Chunker as ChunkerModule
+from dedup.Chunker import Chunker, KB
+from dedup.ChunkStore import ChunkStore, DedupWriter
+from gerrit.BackupFolder import BackupFolder
+
+
+def _chunk(data, avg_size=4 * KB):
+    """Chunk data, in uneven writes."""
+    chunks = []
+    chunker = Chunker(chunks.append, avg_size)
+    for i in range(0, len(data), 1000):
+        chunker.write(data[i:i + 1000])
+    chunker.close()
+    return chunks
+
+
+class ChunkerTests(unittest.TestCase):
+    """Test Chunker Class."""
+
+    def setUp(self):
+        """Setup."""
+        rand = random.Random(42)
+        self.data = ''.join([chr(rand.getrandbits(8)) for _ in range(256 * KB)])
+
+    def test_chunks_rebuild_data(self):
+        """Test chunks join back to the data, within size limits."""
+        chunks = _chunk(self.data)
+        self.assertEqual(''.join(chunks), self.data)
+        for chunk in chunks[:-1]:
+            self.assertTrue(1 * KB <= len(chunk) <= 16 * KB)
+
+    def test_insert_only_changes_nearby_chunks(self):
+        """Test boundaries re-synchronise after an insert."""
+        chunks = _chunk(self.data)
+        middle = len(self.data) // 2
+        changed = _chunk(self.data[:middle] + 'inserted' + self.data[middle:])
+
+        shared = set(chunks) & set(changed)
+        self.assertTrue(len(shared) >= len(chunks) - 3)
+
+    @unittest.skipIf(ChunkerModule.numpy is None, "numpy not installed")
+    def test_numpy_and_python_cut_same_chunks(self):
+        """Test the numpy hash cuts the same boundaries as the Python hash."""
+        chunks = _chunk(self.data)
+
+        gear_array, ChunkerModule.GEAR_ARRAY = ChunkerModule.GEAR_ARRAY, None
+        try:
+            self.assertEqual(chunks, _chunk(self.data))
+        finally:
+            ChunkerModule.GEAR_ARRAY = gear_array
+
+
+class ChunkStoreTests(unittest.TestCase):
+    """Test ChunkStore Class."""
+
+    def setUp(self):
+        """Setup."""
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        self.backup_path = tempfile.mkdtemp()
+
+        config = ConfigParser.RawConfigParser()
+        config.add_section('backup')
+        config.set('backup', 'ssh_hostname', 'gerrit-server')
+        config.add_section('backup_folder')
+        config.set('backup_folder', 'backup_folder', self.backup_path)
+
+        self.chunk_store = ChunkStore(BackupFolder(config))
+
+    def tearDown(self):
+        """Tear down."""
+        sys.stdout = self.stdout
+        shutil.rmtree(self.backup_path)
+
+    def _store(self, data, recipe_path):
+        """Store data."""
+        writer = DedupWriter([self.chunk_store], [recipe_path], 4 * KB)
+        writer.write(data)
+        writer.close()
+        return writer
+
+    def test_round_trip_and_dedup(self):
+        """Test stored data reads back, and is only stored once."""
+        rand = random.Random(7)
+        data = ''.join([chr(rand.getrandbits(8)) for _ in range(64 * KB)])
+
+        first = self._store(data, 'gerrit-server/a.recipe')
+        second = self._store(data, 'gerrit-server/b.recipe')
+
+        self.assertTrue(first.chunks_new > 0)
+        self.assertEqual(second.chunks_new, 0)
+
+        reader = self.chunk_store.open_recipe('gerrit-server/b.recipe')
+        self.assertEqual(reader.read(100) + reader.read(), data)
+
+        chunks_path = os.path.join(self.backup_path, 'gerrit-server', 'chunks')
+        self.assertTrue(os.path.isdir(chunks_path))
+
+    def test_index(self):
+        """Test known chunks are loaded from the index, instead of listing the store, until it is too old."""
+        rand = random.Random(7)
+        data = ''.join([chr(rand.getrandbits(8)) for _ in range(64 * KB)])
+
+        self.chunk_store.index_file = os.path.join(self.backup_path, 'index.json')
+        self._store(data, 'gerrit-server/a.recipe')
+        self.chunk_store.save_index()
+
+        chunk_store = ChunkStore(self.chunk_store.backup_class)
+        chunk_store.index_file = self.chunk_store.index_file
+        chunk_store.backup_class = None
+        self.assertEqual(self.chunk_store._get_known_chunks(), chunk_store._get_known_chunks())
+
+        chunk_store = ChunkStore(self.chunk_store.backup_class)
+        chunk_store.index_file = self.chunk_store.index_file
+        chunk_store.index_max_age = -1
+        self.assertEqual(self.chunk_store._get_known_chunks(), chunk_store._get_known_chunks())
+
+    def test_index_chunk_removed(self):
+        """Test a chunk in the index, removed from the store, is stored again."""
+        rand = random.Random(7)
+        data = ''.join([chr(rand.getrandbits(8)) for _ in range(64 * KB)])
+
+        self.chunk_store.index_file = os.path.join(self.backup_path, 'index.json')
+        first = self._store(data, 'gerrit-server/a.recipe')
+        self.chunk_store.save_index()
+
+        chunks_path = os.path.join(self.backup_path, 'gerrit-server', 'chunks')
+        for root, _, filenames in os.walk(chunks_path):
+            for filename in filenames:
+                os.remove(os.path.join(root, filename))
+
+        self.chunk_store = ChunkStore(self.chunk_store.backup_class)
+        self.chunk_store.index_file = os.path.join(self.backup_path, 'index.json')
+        second = self._store(data, 'gerrit-server/b.recipe')
+        self.assertEqual(first.chunks_new, second.chunks_new)
+
+        reader = self.chunk_store.open_recipe('gerrit-server/b.recipe')
+        self.assertEqual(reader.read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Test DiskUsage class."""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from gerrit.DiskUsage import DiskUsage, get_category
+
+
+def _write_file(path, size):
+    """Write file of size bytes."""
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with open(path, 'wb') as output_file:
+        output_file.write('x' * size)
+
+
+class DiskUsageTests(unittest.TestCase):
+    """Test DiskUsage Class."""
+
+    def setUp(self):
+        """Setup."""
+        self.path = tempfile.mkdtemp()
+        self.repo_path = os.path.join(self.path, 'project.git')
+
+        _write_file(os.path.join(self.repo_path, 'HEAD'), 10)
+        _write_file(os.path.join(self.repo_path, 'packed-refs'), 20)
+        _write_file(os.path.join(self.repo_path, 'refs', 'heads', 'master'), 41)
+        _write_file(os.path.join(self.repo_path, 'objects', 'pack', 'pack-1.pack'), 1000)
+        _write_file(os.path.join(self.repo_path, 'objects', 'ab', 'cdef'), 100)
+
+    def tearDown(self):
+        """Tear down."""
+        shutil.rmtree(self.path)
+
+    def test_get_category(self):
+        """Test files are categorised by path."""
+        self.assertEqual('packs', get_category(os.path.join('objects', 'pack', 'pack-1.idx')))
+        self.assertEqual('loose', get_category(os.path.join('objects', 'ab', 'cdef')))
+        self.assertEqual('refs', get_category(os.path.join('refs', 'heads', 'master')))
+        self.assertEqual('refs', get_category('packed-refs'))
+        self.assertEqual('other', get_category(os.path.join('objects', 'info', 'packs')))
+
+    def test_scan_repo(self):
+        """Test repo usage."""
+        usage = DiskUsage().scan_repo(self.repo_path)
+        self.assertEqual(1171, usage['bytes'])
+        self.assertEqual(5, usage['files'])
+        self.assertEqual((1, 1000), (usage['packs_files'], usage['packs_bytes']))
+        self.assertEqual((1, 100), (usage['loose_files'], usage['loose_bytes']))
+        self.assertEqual((2, 61), (usage['refs_files'], usage['refs_bytes']))
+
+    def test_cache(self):
+        """Test unchanged directories are not listed again, changed ones are."""
+        cache_file = os.path.join(self.path, 'cache.json')
+        disk_usage = DiskUsage()
+        disk_usage.scan_repo(self.repo_path)
+        disk_usage.save(cache_file)
+
+        disk_usage = DiskUsage()
+        disk_usage.load(cache_file)
+        self.assertEqual(1171, disk_usage.scan_repo(self.repo_path)['bytes'])
+        self.assertEqual(0, disk_usage.scanned_dirs)
+
+        loose_path = os.path.join(self.repo_path, 'objects', 'ab')
+        _write_file(os.path.join(loose_path, 'ef01'), 50)
+        os.utime(loose_path, (0, 0))
+
+        disk_usage = DiskUsage()
+        disk_usage.load(cache_file)
+        self.assertEqual(1221, disk_usage.scan_repo(self.repo_path)['bytes'])
+        self.assertEqual(1, disk_usage.scanned_dirs)
+
+    def test_cache_changed_in_place(self):
+        """Test files changed in place, without changing their directory's mtime, are counted."""
+        cache_file = os.path.join(self.path, 'cache.json')
+        os.utime(self.repo_path, (1000, 1000))
+        disk_usage = DiskUsage()
+        disk_usage.scan_repo(self.repo_path)
+        disk_usage.save(cache_file)
+
+        with open(os.path.join(self.repo_path, 'packed-refs'), 'ab') as output_file:
+            output_file.write('x' * 30)
+        os.utime(self.repo_path, (1000, 1000))
+
+        disk_usage = DiskUsage()
+        disk_usage.load(cache_file)
+        usage = disk_usage.scan_repo(self.repo_path)
+        self.assertEqual(1201, usage['bytes'])
+        self.assertEqual((2, 91), (usage['refs_files'], usage['refs_bytes']))
+        self.assertEqual(0, disk_usage.scanned_dirs)
+
+    def test_missing_repo(self):
+        """Test missing repo."""
+        self.assertRaises(RuntimeError, DiskUsage().scan_repo, os.path.join(self.path, 'missing.git'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+
+"""Test Manifest class."""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from gerrit.Manifest import Manifest, repo_fingerprint
+
+
+class ManifestTests(unittest.TestCase):
+    """Test Manifest Class."""
+
+    def setUp(self):
+        """Setup."""
+        self.repo_path = tempfile.mkdtemp(suffix='.git')
+        os.makedirs(os.path.join(self.repo_path, 'refs', 'heads'))
+        os.makedirs(os.path.join(self.repo_path, 'objects', 'pack'))
+        self._write('HEAD', 'ref: refs/heads/master\n')
+        self._write('refs/heads/master', '1' * 40 + '\n')
+
+    def tearDown(self):
+        """Tear down."""
+        shutil.rmtree(self.repo_path)
+
+    def _write(self, filename, content):
+        """Write file in repo."""
+        with open(os.path.join(self.repo_path, filename), 'w') as output_file:
+            output_file.write(content)
+
+    def test_fingerprint_changes_with_refs(self):
+        """Test fingerprint changes when a ref moves."""
+        fingerprint = repo_fingerprint(self.repo_path)
+        self.assertEqual(fingerprint, repo_fingerprint(self.repo_path))
+
+        self._write('refs/heads/master', '2' * 40 + '\n')
+        self.assertNotEqual(fingerprint, repo_fingerprint(self.repo_path))
+
+    def test_fingerprint_changes_with_packs(self):
+        """Test fingerprint changes when packs are repacked."""
+        fingerprint = repo_fingerprint(self.repo_path)
+
+        self._write('objects/pack/pack-%s.pack' % ('a' * 40), '')
+        self.assertNotEqual(fingerprint, repo_fingerprint(self.repo_path))
+
+    def test_unchanged_settings(self):
+        """Test repo is changed when its archive settings change."""
+        manifest = Manifest()
+        manifest.set_fingerprint('project/repo', 'abc', {'archive_format': 'tar'})
+
+        self.assertTrue(manifest.unchanged('project/repo', 'abc', {'archive_format': 'tar'}))
+        self.assertFalse(manifest.unchanged('project/repo', 'abc', {'archive_format': 'bundle'}))
+        self.assertFalse(manifest.unchanged('project/repo', 'abd', {'archive_format': 'tar'}))
+        self.assertFalse(manifest.unchanged('other/repo', 'abc', {'archive_format': 'tar'}))
+
+    def test_save_load(self):
+        """Test manifest round trip."""
+        manifest = Manifest()
+        manifest.set_fingerprint('project/repo', 'abc')
+
+        fd, manifest_file = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            manifest.save(manifest_file)
+
+            loaded = Manifest()
+            loaded.load(manifest_file)
+        finally:
+            os.remove(manifest_file)
+
+        self.assertTrue(loaded.unchanged('project/repo', 'abc'))
+        self.assertFalse(loaded.unchanged('project/repo', 'def'))
+        self.assertFalse(loaded.unchanged('other', 'abc'))
+
+if __name__ == '__main__':
+    unittest.main()
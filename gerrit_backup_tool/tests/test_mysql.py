@@ -8,6 +8,7 @@ from cStringIO import StringIO
 from contextlib import contextmanager
 
 from mysql.Database import Database
+from mysql.Session import Session
 
 
 @contextmanager
@@ -36,5 +37,29 @@ class DatabaseTests(unittest.TestCase):
         with capture(self.database.run_sql_cmd, "SHOW DATABASE;") as output:
             self.assertTrue(" --password=******** " in output)
 
+    def test_dump_table_stream_dry_run(self):
+        """Test dump_table_stream."""
+        self.database.verbose = True
+        self.database.dry_run = True
+        with capture(self.database.dump_table_stream, 'reviewdb', 'changes', StringIO()) as output:
+            self.assertTrue(" --password=******** " in output)
+            self.assertTrue(" reviewdb changes | (stream)" in output)
+
+    def test_dump_schema_stream_dry_run(self):
+        """Test dump_schema_stream."""
+        self.database.verbose = True
+        self.database.dry_run = True
+        with capture(self.database.dump_schema_stream, 'reviewdb', StringIO()) as output:
+            self.assertTrue(" --no-data --routines reviewdb | (stream)" in output)
+
+    def test_session_dry_run(self):
+        """Test Session."""
+        self.database.dry_run = True
+        session = Session(self.database)
+        session.open()
+        self.assertFalse(session.is_open())
+        self.assertEqual([], session.execute("SELECT 1"))
+        session.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+"""Test RemoteEnv module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from RemoteEnv import RemoteEnv
+
+
+class FakeSSH(object):
+    """SSH recording commands, optional requirements matching fail_name fail to install."""
+
+    def __init__(self, fail_name):
+        """Init."""
+        self.hostname = 'gerrit-server'
+        self.fail_name = fail_name
+        self.commands = []
+
+    def run_command(self, cmd, log_output=True):
+        """Record command."""
+        self.commands.append(cmd)
+        if 'pip install' in cmd and self.fail_name in cmd:
+            return 'failed\n', ''
+
+        return '', ''
+
+    def stream_to_remote(self, data, cmd):
+        """Record command."""
+        self.commands.append(cmd)
+
+
+class RemoteEnvTests(unittest.TestCase):
+    """Test RemoteEnv."""
+
+    def setUp(self):
+        """Setup."""
+        self.path = tempfile.mkdtemp()
+        self.requirements_file = os.path.join(self.path, 'requirements_remote.txt')
+        self._write_requirements('argparse\nboto\n')
+
+        self.optional_requirements_file = os.path.join(self.path, 'requirements_remote_optional.txt')
+        with open(self.optional_requirements_file, 'w') as output_file:
+            output_file.write('# Optional\nscandir\nlz4<3\n')
+
+    def tearDown(self):
+        """Tear Down."""
+        shutil.rmtree(self.path)
+
+    def _write_requirements(self, requirements):
+        """Write requirements file."""
+        with open(self.requirements_file, 'w') as output_file:
+            output_file.write(requirements)
+
+    def test_get_key(self):
+        """Test key changes with the requirements and the interpreter only."""
+        remote_env = RemoteEnv(None, self.requirements_file)
+        key = remote_env.get_key()
+        self.assertEqual(key, RemoteEnv(None, self.requirements_file).get_key())
+
+        remote_env.python = 'python2'
+        self.assertNotEqual(key, remote_env.get_key())
+
+        self._write_requirements('argparse\nboto==2.49.0\n')
+        self.assertNotEqual(key, RemoteEnv(None, self.requirements_file).get_key())
+
+    def test_get_key_optional(self):
+        """Test key changes with the optional requirements."""
+        key = RemoteEnv(None, self.requirements_file).get_key()
+        self.assertNotEqual(key, RemoteEnv(None, self.requirements_file, self.optional_requirements_file).get_key())
+
+    def test_prepare_optional(self):
+        """Test optional requirements are installed one by one, a failure does not fail the build."""
+        ssh = FakeSSH('lz4')
+        remote_env = RemoteEnv(ssh, self.requirements_file, self.optional_requirements_file)
+        self.assertEqual(['scandir', 'lz4<3'], remote_env.get_optional_requirements())
+
+        python_path = remote_env.prepare()
+        env_path = "~/.gerrit_backup_envs/env-%s" % remote_env.get_key()
+        self.assertEqual("%s/bin/python" % env_path, python_path)
+
+        self.assertTrue("pip install --quiet 'scandir'" in ssh.commands[2])
+        self.assertTrue("pip install --quiet 'lz4<3'" in ssh.commands[3])
+        self.assertEqual("touch %s/.ready" % env_path, ssh.commands[4])
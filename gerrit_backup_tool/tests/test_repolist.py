@@ -0,0 +1,50 @@
+"""Test Repo List module."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import repoList
+
+
+class RepoListTests(unittest.TestCase):
+    """Test Repo List."""
+
+    def setUp(self):
+        """Setup."""
+        self.git_path = tempfile.mkdtemp()
+        for repo in ['All-Projects', 'team/app', 'team/lib', 'team/nested/deep']:
+            os.makedirs(os.path.join(self.git_path, repo + '.git', 'objects', 'pack'))
+        os.makedirs(os.path.join(self.git_path, 'team', 'empty'))
+
+    def tearDown(self):
+        """Tear Down."""
+        shutil.rmtree(self.git_path)
+
+    def test_discover_repos(self):
+        """Test repos are discovered, not descended into."""
+        for jobs in [1, 4]:
+            self.assertEqual(['All-Projects', 'team/app', 'team/lib', 'team/nested/deep'],
+                             repoList.discover_repos(self.git_path, jobs))
+
+    def test_discover_repos_threads(self):
+        """Test no worker threads are left running after discovery."""
+        threads = threading.active_count()
+        repoList.discover_repos(self.git_path, 4)
+        self.assertEqual(threads, threading.active_count())
+
+    def test_discover_repos_missing(self):
+        """Test missing git path raises."""
+        self.assertRaises(RuntimeError, repoList.discover_repos, os.path.join(self.git_path, 'missing'))
+
+    def test_diff_repo_lists(self):
+        """Test orphaned and missing repos."""
+        self.assertEqual((['orphan'], ['gone']),
+                         repoList.diff_repo_lists(['All-Projects', 'orphan'], ['gone', 'All-Projects']))
+
+    def test_write_parse_repo_list(self):
+        """Test written repo list is parsed back, sorted."""
+        repo_list_file = repoList.write_repo_list(['b', 'a'], os.path.join(self.git_path, 'repos.txt'))
+        self.assertEqual(['a', 'b'], repoList.parse_repo_list(repo_list_file))
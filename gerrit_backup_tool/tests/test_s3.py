@@ -0,0 +1,451 @@
+"""Test S3 module, against a fake bucket."""
+
+import hashlib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+from cStringIO import StringIO
+
+try:
+    from aws import S3 as S3Module
+    from aws.S3 import MB, S3, S3ETagHasher
+except ImportError:
+    S3Module = None
+
+
+def _etag(parts):
+    """Get S3 ETag of data uploaded as parts."""
+    if len(parts) == 1:
+        return '"%s"' % hashlib.md5(parts[0]).hexdigest()
+
+    digests = ''.join(hashlib.md5(part).digest() for part in parts)
+    return '"%s-%d"' % (hashlib.md5(digests).hexdigest(), len(parts))
+
+
+class FakeKey(object):
+    """S3 key of a FakeBucket."""
+
+    def __init__(self, bucket, name):
+        """Init."""
+        self.bucket = bucket
+        self.name = name
+        self.metadata = {}
+
+        self.size = 0
+        self.etag = None
+        self.version_id = None
+
+    def set_metadata(self, name, value):
+        """Set metadata."""
+        self.metadata[name] = value
+
+    def set_contents_from_string(self, data, headers=None, encrypt_key=False):
+        """Upload data in one PUT."""
+        self.bucket.put(self.name, [data], self.metadata)
+        return len(data)
+
+    def set_contents_from_filename(self, file_path, headers=None, encrypt_key=False):
+        """Upload file in one PUT."""
+        with open(file_path, 'rb') as input_file:
+            return self.set_contents_from_string(input_file.read())
+
+    def get_contents_to_file(self, fileobj, headers=None, version_id=None):
+        """Download key, or the byte range in headers, to fileobj."""
+        data = self.bucket.get(self.name, version_id)
+
+        if headers and 'Range' in headers:
+            start, end = [int(value) for value in headers['Range'].split('=', 1)[1].split('-')]
+            data = data[start:end + 1]
+
+        self.bucket.before_get(self.name, fileobj, data)
+        fileobj.write(data)
+
+    def get_contents_to_filename(self, file_path, headers=None, version_id=None):
+        """Download key to file."""
+        with open(file_path, 'wb') as output_file:
+            self.get_contents_to_file(output_file, headers, version_id)
+
+
+class FakePart(object):
+    """Uploaded part of a FakeMultipart."""
+
+    def __init__(self, part_number, data):
+        """Init."""
+        self.part_number = part_number
+        self.size = len(data)
+        self.etag = '"%s"' % hashlib.md5(data).hexdigest()
+
+
+class FakeMultipart(object):
+    """Multipart upload of a FakeBucket."""
+
+    def __init__(self, bucket, key_name, metadata=None):
+        """Init."""
+        self.bucket = bucket
+        self.key_name = key_name
+        self.metadata = metadata or {}
+        self.id = None
+
+        self.parts = {}
+
+    def upload_part_from_file(self, fileobj, part_num, md5=None, size=None):
+        """Upload part, size bytes of fileobj, or the rest of it."""
+        data = fileobj.read(size) if size is not None else fileobj.read()
+        self.bucket.before_upload_part(part_num)
+        self.bucket.multiparts[self.id].parts[part_num] = data
+
+    def __iter__(self):
+        """Iterate uploaded parts."""
+        parts = self.bucket.multiparts[self.id].parts
+        return iter([FakePart(part_num, data) for part_num, data in sorted(parts.items())])
+
+    def complete_upload(self):
+        """Complete upload."""
+        parts = self.bucket.multiparts.pop(self.id).parts
+        self.bucket.put(self.key_name, [data for _, data in sorted(parts.items())], self.metadata)
+
+    def cancel_upload(self):
+        """Cancel upload."""
+        self.bucket.multiparts.pop(self.id, None)
+
+
+class FakeConnection(object):
+    """Connection of a FakeBucket."""
+
+    def __init__(self, bucket):
+        """Init."""
+        self.bucket = bucket
+        self.closed = False
+
+    def get_bucket(self, name, validate=True):
+        """Get bucket."""
+        return FakeBucketView(self.bucket, self)
+
+    def close(self):
+        """Close."""
+        self.closed = True
+
+
+class FakeBucketView(object):
+    """FakeBucket, as seen by one connection."""
+
+    def __init__(self, bucket, connection):
+        """Init."""
+        self.bucket = bucket
+        self.connection = connection
+        self.name = 'fake-bucket'
+
+    def __getattr__(self, name):
+        """Delegate to the bucket."""
+        return getattr(self.bucket, name)
+
+
+class FakeBucket(object):
+    """In-memory S3 bucket, with versions."""
+
+    def __init__(self):
+        """Init."""
+        self.keys = {}
+        self.versions = []
+        self.version_data = {}
+        self.multiparts = {}
+
+        self.on_get = None
+        self.on_upload_part = None
+
+        self._lock = threading.Lock()
+
+    def put(self, name, parts, metadata):
+        """Store key uploaded as parts."""
+        with self._lock:
+            version_id = 'v%d' % (len(self.versions) + 1)
+            self.keys[name] = (''.join(parts), _etag(parts), version_id, dict(metadata))
+            self.versions.append((name, version_id, len(''.join(parts))))
+            self.version_data[version_id] = ''.join(parts)
+
+    def delete(self, name):
+        """Delete key, leaving a delete marker."""
+        with self._lock:
+            self.keys.pop(name)
+            self.versions.append((name, 'v%d' % (len(self.versions) + 1), None))
+
+    def get(self, name, version_id=None):
+        """Get data of key, or of version of key."""
+        if version_id is not None:
+            return self.version_data[version_id]
+
+        return self.keys[name][0]
+
+    def before_get(self, name, fileobj, data):
+        """Call on_get, to inject failures."""
+        if self.on_get is not None:
+            self.on_get(name, fileobj, data)
+
+    def before_upload_part(self, part_num):
+        """Call on_upload_part, to inject failures."""
+        if self.on_upload_part is not None:
+            self.on_upload_part(part_num)
+
+    def list_versions(self, prefix=''):
+        """List versions of keys with prefix, latest first."""
+        versions = []
+        for name, version_id, size in reversed(self.versions):
+            if name.startswith(prefix):
+                if size is None:
+                    version = S3Module.boto.s3.deletemarker.DeleteMarker()
+                    version.name = name
+                else:
+                    version = FakeKey(self, name)
+                    version.size = size
+
+                version.version_id = version_id
+                version.last_modified = '2026-10-18T00:00:00.000Z'
+                version.is_latest = not any(later_name == name for later_name, _, _ in
+                                            self.versions[self.versions.index((name, version_id, size)) + 1:])
+                versions.append(version)
+
+        return versions
+
+    def new_key(self, name):
+        """New key."""
+        return FakeKey(self, name)
+
+    def get_key(self, name):
+        """Get key, or None."""
+        if name not in self.keys:
+            return None
+
+        data, etag, version_id, metadata = self.keys[name]
+        key = FakeKey(self, name)
+        key.size = len(data)
+        key.etag = etag
+        key.version_id = version_id
+        key.metadata = metadata
+        return key
+
+    def initiate_multipart_upload(self, key_name, headers=None, metadata=None, encrypt_key=False):
+        """Initiate multipart upload."""
+        multipart = FakeMultipart(self, key_name, metadata)
+        with self._lock:
+            multipart.id = 'upload%d' % (len(self.multiparts) + 1)
+            self.multiparts[multipart.id] = multipart
+
+        return multipart
+
+
+class FakeMultiPartUpload(FakeMultipart):
+    """boto MultiPartUpload, of a FakeBucketView."""
+
+    def __init__(self, bucket_view):
+        """Init."""
+        super(FakeMultiPartUpload, self).__init__(bucket_view.bucket, None)
+
+
+@unittest.skipIf(S3Module is None, "boto not installed")
+class S3Tests(unittest.TestCase):
+    """Test S3, against a FakeBucket."""
+
+    def setUp(self):
+        """Setup."""
+        self.bucket = FakeBucket()
+
+        self.s3 = S3('access', 'secret', 'fake-bucket')
+
+        self._connection_class = S3Module.S3CountingConnection
+        S3Module.S3CountingConnection = lambda *args, **kwargs: FakeConnection(self.bucket)
+
+        self._multipart_upload = S3Module.boto.s3.multipart.MultiPartUpload
+        S3Module.boto.s3.multipart.MultiPartUpload = FakeMultiPartUpload
+
+        self.data = (''.join(chr(i) for i in range(251)) * (13 * MB / 251 + 1))[:13 * MB + 123]
+
+        self.path = tempfile.mkdtemp()
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        """Tear Down."""
+        sys.stdout = self.stdout
+        shutil.rmtree(self.path)
+        S3Module.boto.s3.multipart.MultiPartUpload = self._multipart_upload
+        S3Module.S3CountingConnection = self._connection_class
+
+    def _check_etag(self, name):
+        """Check ETag of key against the data."""
+        key = self.bucket.get_key(name)
+        hasher = S3ETagHasher(key.etag, self.s3.get_part_size())
+        hasher.update(self.bucket.get(name))
+        return hasher.check(name)
+
+    def test_upload_stream_parts(self):
+        """Test streamed parts are exactly the part size, whatever the writes, and the ETag checks."""
+        self.s3.multipart_chunk_size = 1 * MB
+
+        stream = self.s3.open_upload_stream('stream.tar')
+        for offset in range(0, len(self.data), 3 * MB + 7):
+            stream.write(self.data[offset:offset + 3 * MB + 7])
+        stream.close()
+
+        self.assertEqual(self.data, self.bucket.get('stream.tar'))
+        self.assertEqual('3', self.bucket.get_key('stream.tar').etag.strip('"').split('-')[1])
+        self.assertTrue(self._check_etag('stream.tar'))
+
+    def test_upload_stream_small(self):
+        """Test stream smaller than a part is uploaded in one PUT."""
+        stream = self.s3.open_upload_stream('small.tar')
+        stream.write('small')
+        stream.close()
+
+        self.assertEqual('small', self.bucket.get('small.tar'))
+        self.assertTrue(self._check_etag('small.tar'))
+
+    def test_download_file_ranged_retry(self):
+        """Test ranges failing part way are retried without damaging the ranges around them."""
+        self.bucket.put('repo.tar', [self.data[:8 * MB], self.data[8 * MB:]], {})
+
+        failed = set()
+
+        def _fail_once(name, fileobj, data):
+            """Write half of the range, then fail, once per range."""
+            if data[:16] not in failed:
+                failed.add(data[:16])
+                fileobj.write(data[:len(data) // 2])
+                raise socket.error("Connection reset")
+
+        self.bucket.on_get = _fail_once
+        self.s3.multipart_threshold = 1 * MB
+        self.s3.download_chunk_size = 1 * MB
+
+        to_file = os.path.join(self.path, 'repo.tar')
+        self.s3.download_file('repo.tar', to_file)
+
+        self.assertEqual(14, len(failed))
+        with open(to_file, 'rb') as input_file:
+            self.assertTrue(input_file.read() == self.data)
+        self.assertNotIn('ERROR', sys.stdout.getvalue())
+
+    def test_download_ranges_version(self):
+        """Test all ranges are of the version of the key when the download started."""
+        self.bucket.put('repo.tar', [self.data[:8 * MB], self.data[8 * MB:]], {})
+
+        def _overwrite(name, fileobj, data):
+            """Upload a new version of the key, once a range is downloaded."""
+            if self.bucket.get(name) == self.data:
+                self.bucket.put(name, ['x' * len(self.data)], {})
+
+        self.bucket.on_get = _overwrite
+        self.s3.multipart_threshold = 1 * MB
+        self.s3.download_chunk_size = 1 * MB
+
+        to_file = os.path.join(self.path, 'repo.tar')
+        self.s3.download_file('repo.tar', to_file)
+        with open(to_file, 'rb') as input_file:
+            self.assertTrue(input_file.read() == self.data)
+
+        self.bucket.put('repo.tar', [self.data[:8 * MB], self.data[8 * MB:]], {})
+        stream = self.s3.open_download_stream('repo.tar')
+        data = ''.join(iter(lambda: stream.read(300 * 1024), ''))
+        stream.close()
+        self.assertTrue(data == self.data)
+
+    def test_upload_file_multipart(self):
+        """Test large files are uploaded as parallel parts, failed parts are retried."""
+        file_path = os.path.join(self.path, 'repo.tar')
+        with open(file_path, 'wb') as output_file:
+            output_file.write(self.data)
+
+        failed = set()
+
+        def _fail_once(part_num):
+            """Fail each part once."""
+            if part_num not in failed:
+                failed.add(part_num)
+                raise socket.error("Connection reset")
+
+        self.bucket.on_upload_part = _fail_once
+        self.s3.multipart_threshold = 1 * MB
+        self.s3.multipart_chunk_size = 1 * MB
+        self.s3.encrypt_files = True
+
+        self.s3.upload_file('repo.tar', file_path)
+
+        self.assertEqual(set([1, 2, 3]), failed)
+        self.assertEqual(self.data, self.bucket.get('repo.tar'))
+        self.assertEqual({'s3tools-gpgenc': 'gpg'}, self.bucket.get_key('repo.tar').metadata)
+        self.assertTrue(self._check_etag('repo.tar'))
+
+    def test_upload_file_metadata(self):
+        """Test single PUT uploads set the same metadata as multipart uploads."""
+        file_path = os.path.join(self.path, 'small.tar')
+        with open(file_path, 'wb') as output_file:
+            output_file.write('small')
+
+        self.s3.encrypt_files = True
+        self.s3.upload_file('small.tar', file_path)
+
+        self.assertEqual({'s3tools-gpgenc': 'gpg'}, self.bucket.get_key('small.tar').metadata)
+
+    def test_open_download_stream_ranged(self):
+        """Test large keys are read as parallel ranges, in order."""
+        self.bucket.put('repo.tar', [self.data[:8 * MB], self.data[8 * MB:]], {})
+        self.s3.multipart_threshold = 1 * MB
+        self.s3.download_chunk_size = 1 * MB
+
+        stream = self.s3.open_download_stream('repo.tar')
+        data = ''.join(iter(lambda: stream.read(300 * 1024), ''))
+        stream.close()
+
+        self.assertTrue(data == self.data)
+        self.assertNotIn('ERROR', sys.stdout.getvalue())
+
+    def test_connection_pool(self):
+        """Test connections are reused, and replaced after a connection error."""
+        self.bucket.put('a', ['a'], {})
+
+        for _ in range(5):
+            self.s3.get_key('a')
+        self.assertEqual(1, self.s3.connection_count)
+
+        self.s3.download_concurrency = 3
+        self.s3.multipart_threshold = 1
+        self.s3.download_chunk_size = 1
+        self.bucket.put('abc', ['abc'], {})
+        self.s3.download_file('abc', os.path.join(self.path, 'abc'))
+        self.assertTrue(self.s3.connection_count <= 3)
+
+        connection_count = self.s3.connection_count
+        failed = []
+
+        def _fail_once(s3_bucket):
+            """Fail once with a connection error."""
+            if not failed:
+                failed.append(s3_bucket.connection)
+                raise socket.error("Connection reset")
+            return s3_bucket.connection
+
+        connection = self.s3._with_bucket(_fail_once)
+        self.assertTrue(failed[0].closed)
+        self.assertFalse(connection.closed)
+        self.assertTrue(self.s3.connection_count <= connection_count + 1)
+
+    def test_get_versions_index(self):
+        """Test the index lists every version of every key, latest first."""
+        self.bucket.put('gerrit-server/repos/a.tar', ['1'], {})
+        self.bucket.put('gerrit-server/repos/b.tar', ['22'], {})
+        self.bucket.put('gerrit-server/repos/a.tar', ['333'], {})
+        self.bucket.put('gerrit-server/database/db.tar', ['4444'], {})
+        self.bucket.delete('gerrit-server/repos/b.tar')
+
+        index = self.s3.get_versions_index('gerrit-server/repos/')
+
+        self.assertEqual(['gerrit-server/repos/a.tar', 'gerrit-server/repos/b.tar'], sorted(index))
+        self.assertEqual([('v3', 3, True), ('v1', 1, False)],
+                         [(version['version_id'], version['size'], version['is_latest'])
+                          for version in index['gerrit-server/repos/a.tar']])
+        self.assertEqual([(True, None, True), (False, 2, False)],
+                         [(version['deleted'], version['size'], version['is_latest'])
+                          for version in index['gerrit-server/repos/b.tar']])
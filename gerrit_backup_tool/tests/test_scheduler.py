@@ -0,0 +1,33 @@
+"""Test Scheduler module."""
+
+import unittest
+
+from scheduler import lpt_order, predict_makespan
+
+
+class SchedulerTests(unittest.TestCase):
+    """Test Scheduler."""
+
+    def setUp(self):
+        """Setup."""
+        self.costs = {'a': 1, 'b': 7, 'c': 3, 'All-Projects': 0.5, 'big': 10}
+
+    def test_lpt_order(self):
+        """Test items are ordered largest first."""
+        self.assertEqual(['big', 'b', 'c', 'a', 'All-Projects'], lpt_order(sorted(self.costs), self.costs))
+
+    def test_priority_items(self):
+        """Test priority items come first, unknown priority items are ignored."""
+        self.assertEqual(['All-Projects', 'big', 'b', 'c', 'a'],
+                         lpt_order(sorted(self.costs), self.costs, ['All-Projects', 'All-Users']))
+
+    def test_predict_makespan(self):
+        """Test makespan of largest first is shorter than largest last."""
+        self.assertEqual(11, predict_makespan(lpt_order(sorted(self.costs), self.costs), self.costs, 2))
+        self.assertEqual(13.5, predict_makespan(['a', 'All-Projects', 'c', 'b', 'big'], self.costs, 2))
+        self.assertEqual(17, predict_makespan(['big', 'b'], self.costs, 1))
+        self.assertEqual(0, predict_makespan([], self.costs, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
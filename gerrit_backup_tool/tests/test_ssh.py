@@ -0,0 +1,220 @@
+"""Test SSH module."""
+
+import errno
+import fcntl
+import os
+import select
+import subprocess
+import threading
+import time
+import unittest
+
+try:
+    from ssh.SSH import SSH, Future
+except ImportError:
+    SSH = Future = None
+
+
+class FakeChannel(object):
+    """Channel running the command locally. The command 'hang' never exits, and drops the connection.
+
+    Up to WINDOW_SIZE bytes of stdout and stderr are buffered, as in the channel window; then the command waits.
+    """
+
+    WINDOW_SIZE = 64 * 1024
+
+    def __init__(self, transport):
+        """Init."""
+        self.transport = transport
+        self.process = None
+        self.stdout = ''
+        self.stderr = ''
+
+        self._cond = threading.Condition()
+        self._pumps = []
+
+        # NOTE: Readable once the command has run, as the paramiko channel is once data arrives
+        self.pipe = os.pipe()
+
+    def fileno(self):
+        """Get file descriptor, for select."""
+        return self.pipe[0]
+
+    def exec_command(self, cmd):
+        """Run command, counting open channels."""
+        with self.transport.lock:
+            self.transport.open_channels += 1
+            self.transport.max_open_channels = max(self.transport.max_open_channels, self.transport.open_channels)
+
+        if cmd == 'hang':
+            self.transport.active = False
+            return
+
+        self.process = subprocess.Popen(cmd, shell=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdin_fd = self.process.stdin.fileno()
+        fcntl.fcntl(stdin_fd, fcntl.F_SETFL, fcntl.fcntl(stdin_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        for output, name in [(self.process.stdout, 'stdout'), (self.process.stderr, 'stderr')]:
+            pump = threading.Thread(target=self._pump, args=(output, name))
+            pump.daemon = True
+            pump.start()
+            self._pumps.append(pump)
+
+        os.write(self.pipe[1], 'x')
+
+    def _pump(self, output, name):
+        """Buffer command output, up to the window size."""
+        for data in iter(lambda: os.read(output.fileno(), 4096), ''):
+            with self._cond:
+                while len(getattr(self, name)) >= self.WINDOW_SIZE:
+                    self._cond.wait()
+                setattr(self, name, getattr(self, name) + data)
+
+    def send_ready(self):
+        """Test if stdin data can be sent."""
+        return bool(select.select([], [self.process.stdin], [], 0)[1])
+
+    def send(self, data):
+        """Send stdin data. Returns bytes sent."""
+        try:
+            return os.write(self.process.stdin.fileno(), data)
+        except OSError as err:
+            if err.errno == errno.EAGAIN:
+                return 0
+            raise
+
+    def shutdown_write(self):
+        """Close stdin."""
+        if self.process is not None:
+            self.process.stdin.close()
+
+    def recv_ready(self):
+        """Test if stdout data is ready."""
+        return self.stdout != ''
+
+    def recv_stderr_ready(self):
+        """Test if stderr data is ready."""
+        return self.stderr != ''
+
+    def recv(self, size):
+        """Read stdout data."""
+        with self._cond:
+            data, self.stdout = self.stdout[:size], self.stdout[size:]
+            self._cond.notify_all()
+        return data
+
+    def recv_stderr(self, size):
+        """Read stderr data."""
+        with self._cond:
+            data, self.stderr = self.stderr[:size], self.stderr[size:]
+            self._cond.notify_all()
+        return data
+
+    def exit_status_ready(self):
+        """Test if command has exited, and all its output is buffered."""
+        return (self.process is not None and self.process.poll() is not None and
+                not any(pump.is_alive() for pump in self._pumps))
+
+    def recv_exit_status(self):
+        """Get exit status."""
+        return self.process.wait()
+
+    def close(self):
+        """Close, counting open channels."""
+        with self.transport.lock:
+            self.transport.open_channels -= 1
+
+        os.close(self.pipe[0])
+        os.close(self.pipe[1])
+
+
+class FakeTransport(object):
+    """Transport, counting open channels."""
+
+    def __init__(self):
+        """Init."""
+        self.lock = threading.Lock()
+        self.open_channels = 0
+        self.max_open_channels = 0
+        self.active = True
+
+    def is_active(self):
+        """Test if connection is active."""
+        return self.active
+
+    def open_session(self):
+        """Open channel."""
+        return FakeChannel(self)
+
+
+class FakeClient(object):
+    """SSH Client."""
+
+    def __init__(self):
+        """Init."""
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        """Get transport."""
+        return self.transport
+
+    def close(self):
+        """Close."""
+        self.closed = True
+
+
+@unittest.skipIf(SSH is None, "paramiko / scp not installed")
+class SSHTests(unittest.TestCase):
+    """Test SSH concurrent channels."""
+
+    def setUp(self):
+        """Setup."""
+        self.ssh = SSH('localhost', 'user')
+        self.ssh.ssh_client = FakeClient()
+
+    def tearDown(self):
+        """Tear Down."""
+        self.ssh.close_client()
+
+    def test_run_commands(self):
+        """Test commands run concurrently, up to max_channels, with results in order."""
+        self.ssh.max_channels = 3
+
+        started = time.time()
+        results = self.ssh.run_commands(["sleep 0.3; echo %d" % i for i in range(6)] + ["echo err >&2; exit 3"])
+
+        self.assertLess(time.time() - started, 1.5)
+        self.assertEqual([(0, "%d\n" % i, '') for i in range(6)] + [(3, '', "err\n")], results)
+        self.assertEqual(3, self.ssh.ssh_client.transport.max_open_channels)
+
+    def test_submit_exception(self):
+        """Test exception is raised by the future's result."""
+        def fail():
+            raise RuntimeError("ERROR: failed")
+
+        future = self.ssh.submit('fail', fail)
+        self.assertIsInstance(future.exception(), RuntimeError)
+        self.assertRaises(RuntimeError, future.result)
+        self.assertTrue(future.done())
+
+    def test_connection_lost(self):
+        """Test a command on a lost connection raises, instead of waiting forever."""
+        self.assertRaises(RuntimeError, self.ssh.submit_command('hang').result, 5)
+
+    def test_stream_to_remote(self):
+        """Test stdin is sent while stdout and stderr are read, so output larger than the window does not hang."""
+        data = ''.join('%07d\n' % i for i in range(32 * 1024))
+
+        future = self.ssh.submit('stream', self.ssh._exec_channel, 'tee /dev/stderr', data)
+        self.assertEqual((0, data, data), future.result(10))
+
+        self.assertRaises(RuntimeError, self.ssh.stream_to_remote, 'data', 'cat >/dev/null; exit 2')
+
+    def test_close_client(self):
+        """Test close_client closes and resets the client, so the next command reconnects."""
+        ssh_client = self.ssh.ssh_client
+        self.ssh.close_client()
+        self.assertTrue(ssh_client.closed)
+        self.assertIsNone(self.ssh.ssh_client)
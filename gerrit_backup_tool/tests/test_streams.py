@@ -0,0 +1,48 @@
+"""Test streams module."""
+
+import unittest
+
+from streams import MultiWriter
+
+
+class FakeWriter(object):
+    """Writer, recording whether it was closed or aborted."""
+
+    def __init__(self, fail=False):
+        """Init."""
+        self.fail = fail
+        self.closed = False
+        self.aborted = False
+
+    def write(self, data):
+        """Write data."""
+        pass
+
+    def close(self):
+        """Close, failing if fail is set."""
+        if self.fail:
+            raise RuntimeError("ERROR: close failed")
+
+        self.closed = True
+
+    def abort(self):
+        """Abort."""
+        self.aborted = True
+
+
+class MultiWriterTests(unittest.TestCase):
+    """Test MultiWriter Class."""
+
+    def test_close_failure_aborts(self):
+        """Test a writer failing to close aborts it and the writers after it."""
+        writers = [FakeWriter(), FakeWriter(fail=True), FakeWriter()]
+        stream = MultiWriter(writers)
+        stream.write('data')
+
+        self.assertRaises(RuntimeError, stream.close)
+        self.assertEqual([True, False, False], [writer.closed for writer in writers])
+        self.assertEqual([False, True, True], [writer.aborted for writer in writers])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+
+"""Test Workers module."""
+
+import unittest
+
+import sys
+from cStringIO import StringIO
+
+from workers import Pipeline, WorkerPool, progress_string
+
+
+class WorkerPoolTests(unittest.TestCase):
+    """Test WorkerPool Class."""
+
+    def setUp(self):
+        """Setup."""
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        """Tear down."""
+        sys.stdout = self.stdout
+
+    def test_run_all_items(self):
+        """Test all items are processed."""
+        processed = []
+        pool = WorkerPool(4)
+        failures = pool.run(processed.append, range(20))
+        self.assertEqual(failures, [])
+        self.assertEqual(sorted(processed), range(20))
+
+    def test_failures_do_not_abort(self):
+        """Test failures are collected and do not stop other items."""
+        processed = []
+
+        def process(item):
+            if item % 5 == 0:
+                raise RuntimeError("ERROR: %d" % item)
+            processed.append(item)
+
+        pool = WorkerPool(3)
+        failures = pool.run(process, range(10))
+        self.assertEqual(sorted([f[0] for f in failures]), [0, 5])
+        self.assertEqual(len(processed), 8)
+        self.assertEqual(pool.report_failures('test'), 2)
+
+    def test_progress_string(self):
+        """Test progress string."""
+        self.assertEqual(progress_string(1, 4), " [1/4] 25.00%")
+        self.assertEqual(progress_string(0, 0), " [0/0] 100.00%")
+
+
+class PipelineTests(unittest.TestCase):
+    """Test Pipeline Class."""
+
+    def setUp(self):
+        """Setup."""
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        """Tear down."""
+        sys.stdout = self.stdout
+
+    def test_stages_in_order(self):
+        """Test each item passes through all stages, failed items are not passed on."""
+        processed = []
+
+        def double(item):
+            if item == 3:
+                raise RuntimeError("ERROR: %d" % item)
+            return item * 2
+
+        pipeline = Pipeline(queue_size=1)
+        pipeline.add_stage('double', double, 3)
+        pipeline.add_stage('add', lambda value: value + 1, 2)
+        pipeline.add_stage('collect', processed.append)
+
+        failures = pipeline.run(range(10))
+        self.assertEqual([f[0] for f in failures], [3])
+        self.assertEqual(sorted(processed), [i * 2 + 1 for i in range(10) if i != 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -45,3 +45,11 @@ def human_size(nbytes):
     formatted = ('%.2f' % nbytes).rstrip('0').rstrip('.')
 
     return '%s %s' % (formatted, size_suffixes[i])
+
+
+def throughput_string(nbytes, seconds):
+    """Throughput String."""
+    if seconds <= 0:
+        return "%s in 0.0s" % human_size(nbytes)
+
+    return "%s in %.1fs (%s/s)" % (human_size(nbytes), seconds, human_size(int(nbytes / seconds)))
@@ -0,0 +1,228 @@
+
+"""Workers Module."""
+
+import threading
+import traceback
+import Queue
+
+import log
+
+
+def progress_string(item_cnt, total_items):
+    """Progress String."""
+    percentage = 100.0
+    if total_items > 0:
+        percentage = (float(item_cnt) / total_items) * 100
+
+    return " [{0:d}/{1:d}] {2:.2f}%".format(item_cnt, total_items, percentage)
+
+
+class Workers(object):
+    """Workers, recording failures of items, to report them together."""
+
+    def __init__(self, description=''):
+        """Init."""
+        super(Workers, self).__init__()
+        self.description = description
+
+        self.verbose = False
+
+        self.failures = []
+
+        self._lock = threading.Lock()
+        self._total_items = 0
+
+    def report_failures(self, action='process'):
+        """Report all failures together."""
+        if len(self.failures) == 0:
+            return 0
+
+        log.failed("%d of %d item(s) failed to %s: -" % (len(self.failures),
+                                                          self._total_items,
+                                                          action))
+        for item, msg, trace in self.failures:
+            log.failed("- %s: %s" % (item, msg))
+            if self.verbose:
+                log.verbose(trace)
+
+        return len(self.failures)
+
+
+class WorkerPool(Workers):
+    """Bounded Worker Pool."""
+
+    def __init__(self, jobs=1, description=''):
+        """Init."""
+        super(WorkerPool, self).__init__(description)
+        self.jobs = max(1, int(jobs))
+
+        self._item_cnt = 0
+
+    def _next_progress(self):
+        """Get next item progress."""
+        with self._lock:
+            self._item_cnt += 1
+            return progress_string(self._item_cnt, self._total_items)
+
+    def _run_item(self, func, item):
+        """Run function for a single item, recording failures."""
+        progress = self._next_progress()
+        if self.description:
+            log.info("%s%s: %s" % (self.description, progress, item))
+
+        try:
+            func(item)
+        except Exception as err:
+            log.error("%s: %s" % (item, err))
+            with self._lock:
+                self.failures.append((item, str(err), traceback.format_exc()))
+
+    def _worker(self, func, queue):
+        """Worker thread."""
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                self._run_item(func, item)
+            finally:
+                queue.task_done()
+
+    def run(self, func, items):
+        """Run function for all items. Returns list of failures."""
+        items = list(items)
+
+        self.failures = []
+        self._item_cnt = 0
+        self._total_items = len(items)
+
+        queue = Queue.Queue()
+        for item in items:
+            queue.put(item)
+
+        jobs = min(self.jobs, len(items))
+        if jobs <= 1:
+            self._worker(func, queue)
+            return self.failures
+
+        threads = []
+        for _ in range(jobs):
+            thread = threading.Thread(target=self._worker, args=(func, queue))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # NOTE: Join with timeout, so KeyboardInterrupt is still delivered.
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+
+        return self.failures
+
+
+class Pipeline(Workers):
+    """Pipeline of stages, each with its own workers, joined by bounded queues.
+
+    Each item passes through the stages in order; the result of a stage is
+    the input of the next. Items that fail a stage are not passed on.
+    """
+
+    def __init__(self, description='', queue_size=2):
+        """Init."""
+        super(Pipeline, self).__init__(description)
+        self.queue_size = max(1, int(queue_size))
+
+        self.stages = []
+
+        self._stage_cnts = []
+
+    def add_stage(self, name, func, jobs=1):
+        """Add stage."""
+        self.stages.append((name, func, max(1, int(jobs))))
+
+    def _next_stage_progress(self, stage_index):
+        """Get next item progress of stage."""
+        with self._lock:
+            self._stage_cnts[stage_index] += 1
+            return progress_string(self._stage_cnts[stage_index], self._total_items)
+
+    def _stage_worker(self, stage_index, queues, live_workers):
+        """Stage worker thread."""
+        name, func, _ = self.stages[stage_index]
+        in_queue = queues[stage_index]
+        out_queue = None
+        if stage_index + 1 < len(self.stages):
+            out_queue = queues[stage_index + 1]
+
+        try:
+            while True:
+                entry = in_queue.get()
+                if entry is None:
+                    return
+
+                item, value = entry
+
+                progress = self._next_stage_progress(stage_index)
+                if self.description:
+                    log.info("%s: %s%s: %s" % (self.description, name, progress, item))
+
+                try:
+                    result = func(value)
+                except Exception as err:
+                    log.error("%s: %s" % (item, err))
+                    with self._lock:
+                        self.failures.append((item, str(err), traceback.format_exc()))
+                    continue
+
+                if out_queue is not None:
+                    out_queue.put((item, result))
+        finally:
+            with self._lock:
+                live_workers[stage_index] -= 1
+                last_worker = live_workers[stage_index] == 0
+
+            # NOTE: Last worker of a stage stops the workers of the next stage
+            if last_worker and out_queue is not None:
+                for _ in range(self.stages[stage_index + 1][2]):
+                    out_queue.put(None)
+
+    def _feed(self, items, queue):
+        """Feed items to first stage."""
+        for item in items:
+            queue.put((item, item))
+
+        for _ in range(self.stages[0][2]):
+            queue.put(None)
+
+    def run(self, items):
+        """Run all items through the stages. Returns list of failures."""
+        items = list(items)
+
+        self.failures = []
+        self._total_items = len(items)
+        self._stage_cnts = [0 for _ in self.stages]
+
+        if len(self.stages) == 0:
+            return self.failures
+
+        queues = [Queue.Queue(self.queue_size) for _ in self.stages]
+        live_workers = [jobs for _, _, jobs in self.stages]
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]))]
+        for stage_index, (_, _, jobs) in enumerate(self.stages):
+            for _ in range(jobs):
+                threads.append(threading.Thread(target=self._stage_worker,
+                                                args=(stage_index, queues, live_workers)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # NOTE: Join with timeout, so KeyboardInterrupt is still delivered.
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+
+        return self.failures